@@ -9,7 +9,12 @@ try:
 except NameError:
     pass  # load_translations() added in calibre 1.9
 
+import os
 import time
+
+# startup time of the plugin, see MassSearchReplaceAction.initialization_complete()
+_import_start = time.perf_counter()
+
 from collections import defaultdict
 from functools import partial
 from typing import Union
@@ -22,6 +27,9 @@ except ImportError:
 from calibre.gui2 import info_dialog, question_dialog, warning_dialog
 from calibre.gui2.actions import InterfaceAction
 
+from .auto_apply import AutoApply
+from .backup import DEFER_MINIMUM, dirtied_books, get_deferred_backup
+from .book_index import BookIndex
 from .common_utils import CALIBRE_VERSION, GUI, debug_print, get_icon
 from .common_utils.dialogs import ProgressDialog, custom_exception_dialog
 from .common_utils.librarys import (
@@ -32,19 +40,17 @@ from .common_utils.librarys import (
     get_curent_virtual,
     set_marked,
 )
-from .common_utils.menus import create_menu_action_unique, create_menu_item, unregister_menu_actions
-from .config import (
-    ERROR_OPERATION,
-    ERROR_UPDATE,
-    ICON,
-    KEY_ERROR,
-    KEY_MENU,
-    PREFS,
-    ConfigOperationListDialog,
-    get_default_menu,
-)
-from .search_replace import Operation, SearchReplaceWidget, operation_list_active
-from .search_replace import text as CalibreText
+from .common_utils.menus import create_menu_action_unique, create_menu_item
+from .prefs import ERROR_OPERATION, ERROR_UPDATE, ICON, KEY_ERROR, KEY_MENU, PREFS, PROFILE, get_default_menu
+from .refresh import refresh_books
+from .store import get_store, operation_count
+from .tracing import span
+from .writer import ChunkedWriter, ignore_changes, write_safely
+
+# The Search/Replace module (with the calibre widget), the engine and the config dialogs
+# are imported on first use, they are not needed to build the menus at the startup of calibre.
+
+_import_time = time.perf_counter() - _import_start
 
 
 class MassSearchReplaceAction(InterfaceAction):
@@ -58,6 +64,8 @@ class MassSearchReplaceAction(InterfaceAction):
     dont_add_to = frozenset(['context-menu-device'])
     
     def genesis(self):
+        start = time.perf_counter()
+        
         self.menu = QMenu(GUI)
         self.qaction.setMenu(self.menu)
         self.qaction.setIcon(get_icon(ICON.PLUGIN))
@@ -69,80 +77,214 @@ class MassSearchReplaceAction(InterfaceAction):
         error_update = PREFS[KEY_ERROR.ERROR][KEY_ERROR.UPDATE]
         if error_update not in ERROR_UPDATE.LIST.keys():
             PREFS[KEY_ERROR.ERROR][KEY_ERROR.UPDATE] = ERROR_UPDATE.DEFAULT
+        
+        self.auto_apply = AutoApply(GUI)
+        # created only if enabled, to not import the network module of Qt at startup
+        self.job_server = None
+        
+        self.genesis_time = time.perf_counter() - start
     
     def initialization_complete(self):
+        start = time.perf_counter()
         self.rebuild_menus()
+        debug_print(
+            f'Startup time: import {_import_time*1000:0.1f} ms, genesis {self.genesis_time*1000:0.1f} ms, '
+            f'menus {(time.perf_counter()-start)*1000:0.1f} ms'
+        )
+    
+    def library_about_to_change(self, olddb, db):
+        get_deferred_backup().flush()
+    
+    def library_changed(self, db):
+        self.auto_apply.set_library(db)
+    
+    def shutting_down(self):
+        self.auto_apply.stop()
+        if self.job_server is not None:
+            self.job_server.stop()
+        get_deferred_backup().flush()
+    
+    def update_job_server(self):
+        if PREFS[KEY_MENU.JOB_SERVER]:
+            if self.job_server is None:
+                from .job_server import JobServer
+                self.job_server = JobServer(GUI)
+            self.job_server.start()
+        elif self.job_server is not None:
+            self.job_server.stop()
     
     def rebuild_menus(self):
-        self.menu.clear()
-        sub_menus = {}
-        
-        unregister_menu_actions()
+        '''
+        Update the menu from the preferences.
+        
+        The menu entries are compared by unique name with the current ones: only the added,
+        removed or renamed entries are created or unregistered, and the keyboard shortcuts
+        are finalized once, only if a entry has been added or removed.
+        Editing the operations of a menu doesn't change the menu at all,
+        the operations are read from the preferences when the entry is triggered.
+        '''
+        self.update_job_server()
+        
+        # {unique_name: menu}
+        self.menus_by_name = {}
+        # (unique_name, sub_menu_text, menu_text, image_name), unique_name is None for a separator
+        layout = []
+        for menu in get_store().get_menus():
+            if menu_get_error(menu) or not menu[KEY_MENU.ACTIVE]:
+                continue
+            menu_text = menu[KEY_MENU.TEXT]
+            sub_menu_text = menu[KEY_MENU.SUBMENU]
+            if not menu_text:
+                layout.append((None, sub_menu_text, None, None))
+            elif operation_count(menu)>0:
+                if sub_menu_text:
+                    unique_name = f'{sub_menu_text} > {menu_text}'
+                else:
+                    unique_name = f'{menu_text}'
+                unique_name = unique_name.replace('&','')
+                self.menus_by_name[unique_name] = menu
+                layout.append((unique_name, sub_menu_text, menu_text, menu[KEY_MENU.IMAGE]))
+            elif sub_menu_text:
+                # the sub-menu is created, even if empty
+                layout.append((False, sub_menu_text, None, None))
+        layout = tuple(layout)
+        
+        if layout == getattr(self, 'menu_layout', None):
+            debug_print('Menu unchanged')
+            self.auto_apply.set_library(GUI.current_db)
+            return
         
         debug_print('Rebuilding menu')
-        for menu in PREFS[KEY_MENU.MENU]:
-            if not menu_get_error(menu) and menu[KEY_MENU.ACTIVE]:
-                self.append_menu_item_ex(self.menu, sub_menus, menu)
+        if not hasattr(self, 'menu_layout'):
+            # {unique_name: (QAction, menu_text, image_name)}
+            self.menu_actions = {}
+            # {sub_menu_text: (QAction, QMenu)}
+            self.sub_menus = {}
+            self.static_actions = None
+            self.menu.aboutToShow.connect(partial(self.load_menu_icons, self.menu))
+        self.menu_layout = layout
+        
+        # detach all entries, without deleting them
+        for menu in [self.menu] + [sm for ac, sm in self.sub_menus.values()]:
+            for ac in menu.actions():
+                menu.removeAction(ac)
+                if ac.isSeparator():
+                    ac.deleteLater()
+        
+        old_actions = self.menu_actions
+        old_sub_menus = self.sub_menus
+        self.menu_actions = {}
+        self.sub_menus = {}
+        keyboard_changed = False
+        
+        for unique_name, sub_menu_text, menu_text, image_name in layout:
+            parent_menu = self.menu
+            if sub_menu_text:
+                # Create the sub-menu if it does not exist
+                if sub_menu_text not in self.sub_menus:
+                    if sub_menu_text in old_sub_menus:
+                        ac, sm = old_sub_menus.pop(sub_menu_text)
+                        self.menu.addAction(ac)
+                    else:
+                        ac = create_menu_item(self, self.menu, sub_menu_text, image=None, shortcut=None)
+                        sm = QMenu(self.menu)
+                        sm.aboutToShow.connect(partial(self.load_menu_icons, sm))
+                        ac.setMenu(sm)
+                    self.sub_menus[sub_menu_text] = (ac, sm)
+                # Now set our menu variable so the parent menu item will be the sub-menu
+                parent_menu = self.sub_menus[sub_menu_text][1]
+            
+            if unique_name is None:
+                parent_menu.addSeparator()
+            elif unique_name:
+                old = old_actions.pop(unique_name, None)
+                if old and old[1:] == (menu_text, image_name):
+                    ac = old[0]
+                    parent_menu.addAction(ac)
+                else:
+                    if old:
+                        self.unregister_menu_action(old[0])
+                    ac = create_menu_action_unique(self, parent_menu, menu_text, None,
+                                triggered=partial(self.run_menu, unique_name),
+                                unique_name=unique_name,
+                                )
+                    # the icon is loaded when the menu is shown, see load_menu_icons()
+                    ac.msr_image = image_name
+                    keyboard_changed = True
+                self.menu_actions[unique_name] = (ac, menu_text, image_name)
+        
+        for ac, menu_text, image_name in old_actions.values():
+            self.unregister_menu_action(ac)
+            keyboard_changed = True
+        for ac, sm in old_sub_menus.values():
+            self.unregister_menu_action(ac)
+            sm.deleteLater()
         
         self.menu.addSeparator()
         
-        ac = create_menu_item(self, self.menu, _('&Quick Search/Replace…'), ICON.PLUGIN)
-        mn_books = QMenu(self.menu)
-        ac.setMenu(mn_books)
+        if self.static_actions is None:
+            ac = create_menu_item(self, self.menu, _('&Quick Search/Replace…'), ICON.PLUGIN)
+            mn_books = QMenu(self.menu)
+            ac.setMenu(mn_books)
+            
+            create_menu_action_unique(self, mn_books, _('&Selection'), 'highlight_only_on.png',
+                                            triggered=self.quick_selected,
+                                            unique_name='&Quick Search/Replace in all books>&Selection')
+        
+            create_menu_action_unique(self, mn_books, _('&Current search'), 'search.png',
+                                            triggered=self.quick_search,
+                                            unique_name='&Quick Search/Replace in all books>&Current search')
         
-        create_menu_action_unique(self, mn_books, _('&Selection'), 'highlight_only_on.png',
-                                        triggered=self.quick_selected,
-                                        unique_name='&Quick Search/Replace in all books>&Selection')
+            create_menu_action_unique(self, mn_books, _('&Virtual library'), 'vl.png',
+                                            triggered=self.quick_virtual,
+                                            unique_name='&Quick Search/Replace in all books>&Virtual library')
+        
+            create_menu_action_unique(self, mn_books, _('&Library'), 'library.png',
+                                            triggered=self.quick_library,
+                                            unique_name='&Quick Search/Replace in all books>&Library')
+            
+            ac_libraries = create_menu_action_unique(self, self.menu, _('Run a menu on several &libraries…'),
+                                            'lt.png',
+                                            triggered=self.run_libraries,
+                                            unique_name='&Run a menu on several libraries')
+            
+            self.menu.addSeparator()
+            
+            ac_config = create_menu_action_unique(self, self.menu, _('&Customize plugin…'), 'config.png',
+                                            triggered=self.show_configuration,
+                                            unique_name='&Customize plugin',
+                                            shortcut=False)
+            self.static_actions = (ac, ac_libraries, ac_config)
+            keyboard_changed = True
+        else:
+            ac, ac_libraries, ac_config = self.static_actions
+            self.menu.addAction(ac)
+            self.menu.addAction(ac_libraries)
+            self.menu.addSeparator()
+            self.menu.addAction(ac_config)
+        
+        if keyboard_changed:
+            GUI.keyboard.finalize()
+        
+        self.auto_apply.set_library(GUI.current_db)
     
-        create_menu_action_unique(self, mn_books, _('&Current search'), 'search.png',
-                                        triggered=self.quick_search,
-                                        unique_name='&Quick Search/Replace in all books>&Current search')
+    def unregister_menu_action(self, ac):
+        if hasattr(ac, 'calibre_shortcut_unique_name'):
+            GUI.keyboard.unregister_shortcut(ac.calibre_shortcut_unique_name)
+        GUI.removeAction(ac)
+        ac.deleteLater()
     
-        create_menu_action_unique(self, mn_books, _('&Virtual library'), 'vl.png',
-                                        triggered=self.quick_virtual,
-                                        unique_name='&Quick Search/Replace in all books>&Virtual library')
+    def load_menu_icons(self, menu):
+        for ac in menu.actions():
+            image_name = getattr(ac, 'msr_image', None)
+            if image_name:
+                ac.setIcon(get_icon(image_name))
+                ac.msr_image = None
     
-        create_menu_action_unique(self, mn_books, _('&Library'), 'library.png',
-                                        triggered=self.quick_library,
-                                        unique_name='&Quick Search/Replace in all books>&Library')
-        
-        self.menu.addSeparator()
-        
-        create_menu_action_unique(self, self.menu, _('&Customize plugin…'), 'config.png',
-                                        triggered=self.show_configuration,
-                                        unique_name='&Customize plugin',
-                                        shortcut=False)
-        GUI.keyboard.finalize()
-    
-    def append_menu_item_ex(self, parent_menu, sub_menus, menu):
-        
-        menu_text = menu[KEY_MENU.TEXT]
-        sub_menu_text = menu[KEY_MENU.SUBMENU]
-        image_name = menu[KEY_MENU.IMAGE]
-        
-        ac = None
-        if sub_menu_text:
-            # Create the sub-menu if it does not exist
-            if sub_menu_text not in sub_menus:
-                ac = create_menu_item(self, parent_menu, sub_menu_text, image=None, shortcut=None)
-                sm = QMenu(parent_menu)
-                ac.setMenu(sm)
-                sub_menus[sub_menu_text] = sm
-            # Now set our menu variable so the parent menu item will be the sub-menu
-            parent_menu = sub_menus[sub_menu_text]
-        
-        if not menu_text:
-            parent_menu.addSeparator()
-        elif len(menu[KEY_MENU.OPERATIONS])>0:
-            if sub_menu_text:
-                unique_name = f'{sub_menu_text} > {menu_text}'
-            else:
-                unique_name = f'{menu_text}'
-            unique_name = unique_name.replace('&','')
-            create_menu_action_unique(self, parent_menu, menu_text, image_name,
-                        triggered=partial(self.run_SearchReplace, menu, None),
-                        unique_name=unique_name,
-                        )
+    def run_menu(self, unique_name):
+        menu = self.menus_by_name.get(unique_name, None)
+        if menu:
+            self.run_SearchReplace(menu, None)
     
     def quick_selected(self):
         self.quick_search_replace(get_BookIds_selected(), _('the selected books'))
@@ -164,10 +306,12 @@ class MassSearchReplaceAction(InterfaceAction):
         self.quick_search_replace(get_BookIds_search(), _('the current search'))
     
     def quick_search_replace(self, book_ids, text):
+        from .config import ConfigOperationListDialog
+        from .search_replace import Operation
         
         menu = get_default_menu()
         menu[KEY_MENU.TEXT] = text +' '+ _('({:d} books)').format(len(book_ids))
-        menu[KEY_MENU.OPERATIONS] = [Operation(o) for o in PREFS[KEY_MENU.QUICK]]
+        menu[KEY_MENU.OPERATIONS] = [Operation(o) for o in get_store().get_quick()]
         
         d = ConfigOperationListDialog(menu=menu, book_ids=book_ids)
         
@@ -180,7 +324,7 @@ class MassSearchReplaceAction(InterfaceAction):
                 
                 self.run_SearchReplace(menu, book_ids)
         
-        PREFS[KEY_MENU.QUICK] = d.operation_list
+        get_store().set_quick(d.operation_list)
     
     def run_SearchReplace(self, menu, book_ids):
         if book_ids is None:
@@ -188,27 +332,75 @@ class MassSearchReplaceAction(InterfaceAction):
         
         SearchReplacesProgressDialog(book_ids, menu=menu)
     
+    def run_libraries(self):
+        from calibre.gui2 import gprefs
+        
+        from .config import LibrariesDialog
+        
+        menu_names = [name for name, menu in self.menus_by_name.items() if not menu_get_error(menu)]
+        current_path = GUI.current_db.library_path
+        library_paths = [current_path] + [
+            path for path in gprefs.get('library_usage_stats', {})
+            if path != current_path and os.path.exists(os.path.join(path, 'metadata.db'))
+        ]
+        d = LibrariesDialog(menu_names, library_paths)
+        if not d.exec():
+            return
+        
+        LibrariesProgressDialog(
+            [], menu=self.menus_by_name[d.menu_name], menu_name=d.menu_name,
+            library_paths=d.library_list, search=d.search_text, dry_run=d.dry_run,
+        )
+    
     def show_configuration(self):
         self.interface_action_base_plugin.do_user_config(GUI)
 
 
 def menu_get_error(menu: QMenu) -> Union[Exception, None]:
     
-    difference = set(KEY_MENU.ALL).difference(menu)
-    for key in difference:
-        return Exception(_('Invalide menu configuration, the "{:s}" key is missing.').format(key))
+    # the operations of a stored menu are not read
+    for key in KEY_MENU.ALL:
+        if key not in menu:
+            return Exception(_('Invalide menu configuration, the "{:s}" key is missing.').format(key))
     
     return None
 
 
+def get_book_info(dbAPI, book_id) -> str:
+    miA = dbAPI.get_proxy_metadata(book_id)
+    # title (author & author)
+    return '"{title}" ({authors})'.format(
+        title=miA.get('title'), authors=' & '.join(miA.get('authors')),
+    )
+
+
 class SearchReplacesProgressDialog(ProgressDialog):
     
     title = _('{PLUGIN_NAME} progress').format(PLUGIN_NAME=MassSearchReplaceAction.name)
     
     def progress_text(self):
-        return _('Search/Replace {:d} of {:d}. Book {:d} of {:d}.').format(
+        text = _('Search/Replace {:d} of {:d}. Book {:d} of {:d}.').format(
             self.op_num, self.operation_count, self.book_num, self.book_count
         )
+        eta = self.eta_text()
+        if eta:
+            text += '\n' + eta
+        return text
+    
+    def eta_text(self):
+        from .estimate import format_duration
+        
+        if not self.estimate or not self.estimate.cost or self.start_evaluate is None:
+            return None
+        elapsed = time.time() - self.start_evaluate
+        done = self.cost_done + self.step_cost * self.book_num / max(self.book_count, 1)
+        fraction = done / self.estimate.cost
+        if elapsed < 1 or fraction <= 0:
+            return None
+        remaining = elapsed * (1-fraction) / fraction + self.estimate.write
+        return _('{:0.1f} books/s, about {:s} remaining.').format(
+            fraction * self.book_count / elapsed, format_duration(remaining),
+        )
     
     def setup_progress(self, **kvargs):
         # Count update
@@ -221,21 +413,39 @@ class SearchReplacesProgressDialog(ProgressDialog):
         
         # operation list of Search/Replace
         self.op_num = 0
+        from .search_replace import operation_list_active
         self.operation_list = operation_list_active(kvargs['menu'][KEY_MENU.OPERATIONS])
         
         # Count of Search/Replace
         self.operation_count = len(self.operation_list)
         
+        # skip the books not modified since the last run of the menu
+        self.menu = kvargs['menu']
+        self.book_index = None
+        self.books_skipped = 0
+        if PREFS[KEY_MENU.SKIP_UNCHANGED] and not self.quick_search_replace:
+            self.book_index = BookIndex(GUI.current_db)
+            book_ids = self.book_index.filter(self.menu, self.operation_list, self.book_ids)
+            self.books_skipped = self.book_count - len(book_ids)
+            self.book_ids = book_ids
+            self.book_count = len(book_ids)
+        
         # Count of Search/Replace
         self.total_operation_count = self.book_count*self.operation_count
         
-        # Search/Replace Widget
-        self.s_r = SearchReplaceWidget(self.book_ids)
+        # compiled pattern cache, snapshot for the timing report
+        from .search_replace.patterns import PATTERN_CACHE
+        self.pattern_stats = PATTERN_CACHE.stats()
         
         # operation error
         self.operationStrategy = PREFS[KEY_ERROR.ERROR][KEY_ERROR.OPERATION]
         self.operationErrorList = []
         
+        # optional profiling of the evaluation and of the library update
+        from .profiler import RunProfiler
+        self.profiler = RunProfiler(PREFS[KEY_MENU.PROFILE], kvargs['menu'][KEY_MENU.TEXT])
+        self.profile_files = []
+        
         # use mark
         self.useMark = PREFS[KEY_MENU.USE_MARK]
         
@@ -249,11 +459,38 @@ class SearchReplacesProgressDialog(ProgressDialog):
         self.exception_update = False
         self.exception_safely = False
         
+        # (count of values, write lock hold time) of the transactions of the library update
+        self.write_chunks = []
+        
+        # the engine of the run, created by job_progress()
+        self.engine = None
+        
+        # timings of the run, for the run history
+        self.operation_times = []
+        self.evaluate_time = 0
+        self.write_time = 0
+        # latency of each operation {'Operation n': histogram}, and the slowest evaluations
+        self.latency_summary = {}
+        self.slow_books = []
+        
+        # estimated duration, and progress of the evaluation weighted by the estimated cost of the steps
+        self.estimate = None
+        self.start_evaluate = None
+        self.cost_done = 0
+        self.step_cost = 0
+        self.run_declined = False
+        self.start_write = time.time()
+        
+        # metadata.opf backup of the updated books
+        self.deferBackup = PREFS[KEY_MENU.DEFER_BACKUP]
+        self.backup_count = 0
+        self.backup_deferred = 0
+        
         return self.total_operation_count
     
     def end_progress(self):
         
-        if self.wasCanceled():
+        if self.wasCanceled() or self.run_declined:
             debug_print('Mass Search/Replace was cancelled. No change.\n')
         
         elif self.exception_unhandled:
@@ -275,6 +512,8 @@ class SearchReplacesProgressDialog(ProgressDialog):
             
             # info debug
             debug_print(f'Search/Replace launched for {self.book_count} books with {self.operation_count} operation.')
+            if self.books_skipped:
+                debug_print(f'{self.books_skipped} books skipped, unchanged since the last run.')
             
             if self.operationErrorList:
                 debug_print(f'!! {len(self.operationErrorList):d} invalid operation was detected.')
@@ -296,6 +535,24 @@ class SearchReplacesProgressDialog(ProgressDialog):
                     f'Search/Replace performed for {self.books_update} books'
                     f'with a total of {self.fields_update} fields modify.'
                 )
+            if self.write_chunks:
+                holds = [hold for rows, hold in self.write_chunks]
+                debug_print(
+                    f'Library update: {len(holds)} transactions, '
+                    f'write lock held {max(holds):0.3f} seconds at most, {sum(holds):0.3f} seconds in total.'
+                )
+            if self.backup_count:
+                debug_print(
+                    f'metadata.opf backup: {self.backup_count} books to write, {self.backup_deferred} deferred.'
+                )
+            from .search_replace.patterns import pattern_stats_delta
+            pattern_stats = pattern_stats_delta(self.pattern_stats)
+            debug_print(
+                'Compiled pattern cache: {hits} hits, {misses} compiled ({errors} errors).'.format(**pattern_stats)
+            )
+            templates = self.engine.templates if self.engine is not None else None
+            if templates and (templates.evaluations or templates.hits):
+                debug_print(f'Templates: {templates.evaluations} evaluations, {templates.hits} shared results.')
             debug_print(f'Search/Replace execute in {self.time_execut:0.3f} seconds.\n')
             
             # info dialog
@@ -335,20 +592,140 @@ class SearchReplacesProgressDialog(ProgressDialog):
                     show=True, show_copy_button=True,
                 )
             
-            if self.showUpdateReport and not (self.exception_update and self.exceptionStrategy == ERROR_UPDATE.RESTORE):
+            if ((self.showUpdateReport or self.profile_files)
+                    and not (self.exception_update and self.exceptionStrategy == ERROR_UPDATE.RESTORE)):
                 books_update, fields_update = self.books_update, self.fields_update
-                info_dialog(GUI, _('Update Report'),
-                    _('Mass Search/Replace performed for {:d} books with a total of {:d} fields modify.').format(
-                        books_update,
-                        fields_update,
-                    ),
-                    show=True, show_copy_button=False,
+                msg = _('Mass Search/Replace performed for {:d} books with a total of {:d} fields modify.').format(
+                    books_update,
+                    fields_update,
+                )
+                if self.books_skipped:
+                    msg += '\n' + _('{:d} books unchanged since the last run have been skipped.').format(
+                        self.books_skipped,
+                    )
+                if self.backup_deferred:
+                    msg += '\n' + _('The metadata.opf backup of {:d} books is deferred, '
+                                     'it will be written by small batches in the following minutes.').format(
+                        self.backup_deferred,
+                    )
+                elif self.backup_count:
+                    msg += '\n' + _('calibre will write the metadata.opf backup of {:d} books.').format(
+                        self.backup_count,
+                    )
+                if len(self.write_chunks) > 1:
+                    msg += '\n' + _('The library was updated in {:d} transactions, '
+                                     'the library was locked {:0.3f} seconds at most.').format(
+                        len(self.write_chunks), max(hold for rows, hold in self.write_chunks),
+                    )
+                if self.profile_files:
+                    msg += '\n\n' + _('The profile of the run is saved in:') + '\n' + '\n'.join(self.profile_files)
+                det_msg = None
+                if self.slow_books:
+                    from .search_replace.latency import format_slowest
+                    slowest = self.slow_books[0]
+                    msg += '\n' + _('The slowest book took {:0.1f} ms ({:s}), see the details.').format(
+                        slowest['ms'], slowest['operation'],
+                    )
+                    det_msg = '-- Mass Search/Replace: Slowest books --\n\n'
+                    det_msg += '\n'.join(format_slowest(self.slow_books))
+                    det_msg += '\n\n-- Latency by book --\n\n' + '\n'.join(
+                        f'{label}: p50 {h["p50_ms"]:0.3f} ms, p90 {h["p90_ms"]:0.3f} ms, '
+                        f'p99 {h["p99_ms"]:0.3f} ms, max {h["max_ms"]:0.3f} ms'
+                        for label, h in self.latency_summary.items()
+                    )
+                info_dialog(GUI, _('Update Report'), msg, det_msg=det_msg,
+                    show=True, show_copy_button=bool(det_msg),
                 )
         
-        self.s_r.close()
-        del self.s_r
+        self.record_history()
+        self.engine = None
+    
+    def record_history(self):
+        from .book_index import menu_index_key
+        from .history import KEY_RUN, get_history, new_record
+        
+        try:
+            menu = None if self.quick_search_replace else menu_index_key(self.menu)
+            record = new_record(menu, self.operation_list, getattr(self.dbAPI, 'library_id', None))
+            holds = [hold for rows, hold in self.write_chunks]
+            record.update({
+                KEY_RUN.BOOK_COUNT: self.book_count,
+                KEY_RUN.BOOKS_UPDATE: self.books_update,
+                KEY_RUN.FIELDS_UPDATE: self.fields_update,
+                KEY_RUN.OPERATIONS: self.operation_times,
+                KEY_RUN.EVALUATE: self.evaluate_time,
+                KEY_RUN.WRITE: self.write_time,
+                KEY_RUN.LOCK_HOLD: sum(holds),
+                KEY_RUN.LOCK_HOLD_MAX: max(holds, default=0),
+                KEY_RUN.TOTAL: self.time_execut,
+                KEY_RUN.OPERATION_ERRORS: len(self.operationErrorList),
+                KEY_RUN.BOOK_ERRORS: len(self.exception) if isinstance(self.exception, list) else 1,
+                KEY_RUN.CANCELED: bool(self.wasCanceled() or self.run_declined),
+                KEY_RUN.COST: self.estimate.cost if self.estimate else 0,
+                KEY_RUN.PROFILE: self.profiler.path,
+                KEY_RUN.LATENCY: self.latency_summary,
+                KEY_RUN.SLOW_BOOKS: self.slow_books,
+            })
+            get_history().add(record)
+        except Exception as e:
+            debug_print('Run history: unable to record the run >', e)
+    
+    def write_progress(self, done, total):
+        from .estimate import format_duration
+        
+        text = _('Update the library: {:d} of {:d} fields…').format(done, total)
+        elapsed = time.time() - self.start_write
+        if done and elapsed >= 1:
+            text += '\n' + _('{:0.1f} fields/s, about {:s} remaining.').format(
+                done / elapsed, format_duration(elapsed * (total-done) / done),
+            )
+        self.set_value(-1, text=text)
+    
+    def read_latency(self, compiled_list):
+        from .search_replace.latency import format_slowest
+        
+        latency = self.engine.latency
+        if not latency:
+            return
+        labels = {compiled:f'Operation {op_num}' for op_num, compiled in compiled_list}
+        self.latency_summary = latency.summary(labels)
+        # the sizes of the fields are read before the library update
+        self.slow_books = latency.slowest(self.dbAPI, labels)
+        for label, histogram in self.latency_summary.items():
+            debug_print(
+                f'{label}/{self.operation_count} > latency by book: p50 {histogram["p50_ms"]:0.3f} ms, '
+                f'p90 {histogram["p90_ms"]:0.3f} ms, p99 {histogram["p99_ms"]:0.3f} ms, '
+                f'max {histogram["max_ms"]:0.3f} ms'
+            )
+        debug_print('Slowest books:\n' + '\n'.join(format_slowest(self.slow_books)) + '\n')
+    
+    def estimate_run(self, plan):
+        from .book_index import operation_list_hash
+        from .estimate import estimate_run
+        from .history import get_history
+        
+        try:
+            with span('estimate', 'compile'):
+                records = get_history().records(library_id=getattr(self.dbAPI, 'library_id', None))
+                self.estimate = estimate_run(
+                    self.dbAPI, plan.steps, self.book_ids, records, operation_list_hash(self.operation_list),
+                )
+            debug_print('Estimated duration:', self.estimate)
+        except Exception as e:
+            debug_print('Unable to estimate the duration of the run >', e)
+            self.estimate = None
+    
+    def book_progress(self, book_num, weight=1):
+        self.book_num = book_num
+        for _i in range(weight):
+            self.increment()
+        if self.wasCanceled():
+            self.engine.cancel()
     
     def job_progress(self):
+        from .estimate import CONFIRM_DURATION, format_duration
+        from .search_replace.engine import SearchReplaceEngine
+        from .search_replace.optimizer import Plan, PrefilterGroup, format_op_nums
         
         debug_print(f'Launch Search/Replace for {self.book_count} books with {self.operation_count} operation.\n')
         
@@ -357,20 +734,32 @@ class SearchReplacesProgressDialog(ProgressDialog):
         
         alreadyOperationError = False
         
+        # the trace cover the compilation, the profile only the evaluation and the library update
+        if self.profiler.mode == PROFILE.TRACE:
+            self.profiler.start()
+        
+        # Search/Replace engine
+        with span('engine', 'compile'):
+            self.engine = SearchReplaceEngine(self.dbAPI, self.book_ids)
+        
         try:
             
+            compiled_list = []
             for self.op_num, operation in enumerate(self.operation_list, 1):
                 
                 debug_print(f'Operation {self.op_num}/{self.operation_count} >', operation.string_info())
                 
-                err = operation.get_error()
-                if not err:
-                    self.s_r.load_operation(operation)
-                    err = self.s_r.get_error()
+                with span('compile', 'compile', operation=self.op_num):
+                    err = operation.get_error()
+                    if not err:
+                        compiled = self.engine.compile(operation)
+                        err = compiled.error
                 
                 if err:
                     debug_print('!! Invalide operation:', err, '\n')
                     self.operationErrorList.append([self.op_num, str(err)])
+                else:
+                    compiled_list.append((self.op_num, compiled))
                 
                 if len(self.operationErrorList) == 1 and self.operationStrategy == ERROR_OPERATION.ABORT:
                     return
@@ -380,57 +769,70 @@ class SearchReplacesProgressDialog(ProgressDialog):
                 ):
                     alreadyOperationError = True
                     start_dialog =  time.time()
-                    rslt = question_dialog(self, _('Invalid operation'),
-                            _('A invalid operations has detected:\n{:s}\n\n'
-                              'Continue the execution of Mass Search/Replace?\n'
-                              'Other errors may exist and will be ignored.').format(str(self.operationErrorList[0][1])),
-                              default_yes=True, override_icon=get_icon('dialog_warning.png'))
+                    with span('question dialog', 'gui'):
+                        rslt = question_dialog(self, _('Invalid operation'),
+                                _('A invalid operations has detected:\n{:s}\n\n'
+                                  'Continue the execution of Mass Search/Replace?\n'
+                                  'Other errors may exist and will be ignored.'
+                                ).format(str(self.operationErrorList[0][1])),
+                                  default_yes=True, override_icon=get_icon('dialog_warning.png'))
                     
                     self.start = self.start + (time.time() - start_dialog)
                     
                     if not rslt:
                         return
-                
-                if not err:
-                    for self.book_num, book_id in enumerate(self.book_ids, 1):
-                        
-                        # update Progress
-                        self.increment()
-                        
-                        miA = self.dbAPI.get_proxy_metadata(book_id)
-                        
-                        # Book book_num/book_count > "title" (author & author) {id: book_id}
-                        book_info = 'Book {book_num}/{book_count} > "{title}" ({authors}) {{id: {book_id}}}'.format(
-                            book_num=self.book_num,
-                            book_count=self.book_count,
-                            title=miA.get('title'),
-                            authors=' & '.join(miA.get('authors')),
-                            book_id=book_id,
+            
+            with span('plan', 'compile'):
+                plan = Plan(compiled_list)
+            if plan.notes:
+                debug_print('Execution plan:\n' + '\n'.join(plan.notes) + '\n')
+            
+            self.estimate_run(plan)
+            if self.estimate and self.estimate.total > CONFIRM_DURATION:
+                start_dialog = time.time()
+                with span('question dialog', 'gui'):
+                    rslt = question_dialog(self, _('Long run'),
+                            _('The Search/Replace of {:d} books is estimated to take {:s}.\n\n'
+                              'Continue the execution of Mass Search/Replace?').format(
+                                self.book_count, format_duration(self.estimate.total),
+                            ), default_yes=True)
+                self.start = self.start + (time.time() - start_dialog)
+                if not rslt:
+                    self.run_declined = True
+                    return
+            
+            self.profiler.start()
+            start_evaluate = self.start_evaluate = time.time()
+            for step_num, (self.op_num, compiled) in enumerate(plan.steps):
+                if self.estimate:
+                    self.step_cost = self.estimate.step_costs[step_num]
+                start_operation = time.time()
+                prefilter_skips = self.engine.prefilter_skips
+                if isinstance(compiled, PrefilterGroup):
+                    op_info = f'Operations {format_op_nums(compiled.op_nums)}/{self.operation_count}'
+                    with span(op_info, 'evaluate', books=self.book_count):
+                        self.engine.run_prefilter_group(
+                            compiled, progress=partial(self.book_progress, weight=len(compiled.operations)),
                         )
-                        
-                        if self.book_num == self.book_count:
-                            nl = '\n'
-                        else:
-                            nl = ''
-                        
-                        debug_print(book_info+nl)
-                        
-                        if self.wasCanceled():
-                            return
-                        
-                        err = self.s_r.search_replace(book_id)
-                        if err:
-                            if type(err) is Exception:
-                                if str(err) == CalibreText.EXCEPTION_Invalid_identifier:
-                                    # title (author & author)
-                                    book_info = '"{title}" ({authors})'.format(
-                                        title=miA.get('title'), authors=' & '.join(miA.get('authors')),
-                                    )
-                                    self.exception.append((book_id, book_info, 'identifier', err))
-                                else:
-                                    raise err
-                            else:
-                                raise Exception(err)
+                else:
+                    op_info = f'Operation {self.op_num}/{self.operation_count}'
+                    with span(op_info, 'evaluate', books=self.book_count):
+                        self.engine.run_operation(compiled, progress=self.book_progress)
+                op_nums = compiled.op_nums if isinstance(compiled, PrefilterGroup) else [self.op_num]
+                self.operation_times.append((op_nums, time.time()-start_operation))
+                self.cost_done += self.step_cost
+                self.step_cost = 0
+                if self.wasCanceled():
+                    return
+                debug_print(f'{op_info} > executed in {time.time()-start_operation:0.3f} seconds.')
+                prefilter_skips = self.engine.prefilter_skips - prefilter_skips
+                if prefilter_skips:
+                    debug_print(f'{op_info} > {prefilter_skips} evaluations skipped, the books cannot match.')
+            self.evaluate_time = time.time() - start_evaluate
+            self.read_latency(compiled_list)
+            
+            for book_id, field, err in self.engine.errors:
+                self.exception.append((book_id, get_book_info(self.dbAPI, book_id), field, err))
         
         except Exception as e:
             self.exception_unhandled = True
@@ -439,7 +841,7 @@ class SearchReplacesProgressDialog(ProgressDialog):
         else:
             
             lst_id = []
-            for field, book_id_val_map in self.s_r.updated_fields.items():
+            for field, book_id_val_map in self.engine.set_field_calls.items():
                 lst_id += book_id_val_map.keys()
             
             self.fields_update = len(lst_id)
@@ -451,10 +853,15 @@ class SearchReplacesProgressDialog(ProgressDialog):
             if self.books_update > 0:
                 books_update, fields_update = self.books_update, self.fields_update
                 debug_print(f'Update the database for {books_update} books with a total of {fields_update} fields…\n')
+                ignore_changes(self.dbAPI, self.engine.set_field_calls)
                 self.set_value(-1,
                     text=_('Update the library for {:d} books with a total of {:d} fields…').format(
                         books_update, fields_update,
                     ))
+                start_write = self.start_write = time.time()
+                write_span = span(
+                    'library update', 'write', strategy=self.exceptionStrategy, fields=fields_update,
+                ).begin()
                 
                 if self.exceptionStrategy == ERROR_UPDATE.SAFELY or self.exceptionStrategy == ERROR_UPDATE.DONT_STOP:
                     
@@ -463,66 +870,132 @@ class SearchReplacesProgressDialog(ProgressDialog):
                     if self.exception:
                         self.exception_safely = True
                     
-                    for id in iter(lst_id):
-                        if self.exception and not dont_stop:
-                            break
-                        for field, book_id_val_map in self.s_r.updated_fields.items():
-                            if self.exception and not dont_stop:
-                                break
-                            if id in book_id_val_map:
-                                try:
-                                    val = self.s_r.updated_fields[field][id]
-                                    self.dbAPI.set_field(field, {id:val})
-                                    book_id_update[field][id] = ''
-                                except Exception as e:
-                                    self.exception_safely = True
-                                    
-                                    miA = self.dbAPI.get_proxy_metadata(id)
-                                    # title (author & author)
-                                    book_info = '"{title}" ({authors})'.format(
-                                        title=miA.get('title'), authors=' & '.join(miA.get('authors')),
-                                    )
-                                    self.exception.append((id, book_info, field, e))
+                    if not self.exception or dont_stop:
+                        book_id_update, errors = write_safely(
+                            self.dbAPI, self.engine.set_field_calls, dont_stop=dont_stop,
+                        )
+                        for id, field, e in errors:
+                            self.exception_safely = True
+                            self.exception.append((id, get_book_info(self.dbAPI, id), field, e))
                 
                 else:
+                    is_restore = self.exceptionStrategy == ERROR_UPDATE.RESTORE
+                    writer = ChunkedWriter(self.dbAPI, self.engine.set_field_calls, journal=is_restore)
                     try:
                         
-                        backup_fields = None
-                        is_restore = self.exceptionStrategy == ERROR_UPDATE.RESTORE
-                        if is_restore:
-                            backup_fields = defaultdict(dict)
-                            for field, book_id_val_map in self.s_r.updated_fields.items():
-                                backup_fields[field] = self.dbAPI.all_field_for(field, book_id_val_map.keys())
-                        
                         if self.exception:
                             raise Exception('raise')
                         
-                        with self.dbAPI.write_lock, self.dbAPI.backend.conn:
-                            for field, book_id_val_map in self.s_r.updated_fields.items():
-                                self.dbAPI.set_field(field, book_id_val_map)
-                                book_id_update[field] = {id:'' for id in book_id_val_map.keys()}
+                        writer.write(callback=self.write_progress)
                     
                     except Exception as e:
                         self.exception_update = True
                         self.exception.append((None, None, None, e))
                         
                         if is_restore:
-                            with self.dbAPI.write_lock, self.dbAPI.backend.conn:
-                                for field, book_id_val_map in backup_fields.items():
-                                    self.dbAPI.set_field(field, book_id_val_map)
-                            book_id_update = {}
+                            writer.restore()
+                    
+                    book_id_update = writer.written
+                    self.write_chunks = writer.chunks
+                
+                self.write_time = time.time() - start_write
+                write_span.end()
+                updated = set()
+                for book_id_map in book_id_update.values():
+                    updated.update(book_id_map.keys())
+                with span('backup', 'write'):
+                    self.backup_count = len(dirtied_books(self.dbAPI, updated))
+                    if self.deferBackup and len(updated) >= DEFER_MINIMUM:
+                        self.backup_deferred = get_deferred_backup().defer(self.dbAPI, updated)
                 
-                GUI.iactions['Edit Metadata'].refresh_gui(lst_id, covers_changed=False)
+                with span('refresh_gui', 'gui', books=len(lst_id)):
+                    refresh_books(lst_id, self.engine.set_field_calls.keys())
+            
+            if self.book_index and not self.exception and not self.operationErrorList:
+                self.book_index.record(self.menu, self.operation_list, self.book_ids)
         
         finally:
             
-            lst_id = []
+            updated = set()
+            self.fields_update = 0
             for field, book_id_map in book_id_update.items():
-                lst_id += book_id_map.keys()
-            self.fields_update = len(lst_id)
-            
-            lst_id = list(dict.fromkeys(lst_id))
-            self.books_update = len(lst_id)
+                updated.update(book_id_map.keys())
+                self.fields_update += len(book_id_map)
+            self.books_update = len(updated)
             
             if CALIBRE_VERSION >= (5,41,0) and self.useMark and self.fields_update:
-                set_marked('mass_search_replace_updated', lst_id)
+                with span('set_marked', 'gui', books=len(updated)):
+                    set_marked('mass_search_replace_updated', list(updated))
+            
+            self.profiler.stop()
+            self.profile_files = self.profiler.save()
+
+
+class LibrariesProgressDialog(ProgressDialog):
+    
+    title = _('{PLUGIN_NAME} progress').format(PLUGIN_NAME=MassSearchReplaceAction.name)
+    
+    def setup_progress(self, **kvargs):
+        self.menu = kvargs['menu']
+        self.menu_name = kvargs['menu_name']
+        self.library_paths = kvargs['library_paths']
+        self.search = kvargs['search']
+        self.dry_run = kvargs['dry_run']
+        self.batch = None
+        self.exception = None
+        return len(self.library_paths)
+    
+    def batch_progress(self, library_num, library_count, phase, done, total):
+        from .api import PHASE_WRITE
+        from .batch import library_name
+        
+        path = self.library_paths[library_num-1]
+        if phase == PHASE_WRITE:
+            text = _('Library {:d} of {:d}: {:s}. Update the library: {:d} of {:d} fields…')
+        else:
+            text = _('Library {:d} of {:d}: {:s}. Search/Replace {:d} of {:d}…')
+        self.set_value(library_num-1, text=text.format(library_num, library_count, library_name(path), done, total))
+        return self.wasCanceled()
+    
+    def job_progress(self):
+        from .batch import run_libraries
+        
+        debug_print(f'Launch "{self.menu_name}" on {len(self.library_paths)} libraries.\n')
+        error_operation = PREFS[KEY_ERROR.ERROR][KEY_ERROR.OPERATION]
+        if error_operation == ERROR_OPERATION.ASK:
+            # cannot ask for each library
+            error_operation = ERROR_OPERATION.ABORT
+        try:
+            self.batch = run_libraries(
+                self.library_paths, self.menu[KEY_MENU.OPERATIONS], search=self.search,
+                strategy=PREFS[KEY_ERROR.ERROR][KEY_ERROR.UPDATE], dry_run=self.dry_run,
+                operation_strategy=error_operation, progress=self.batch_progress,
+                current_db=self.dbAPI,
+            )
+        except Exception as e:
+            self.exception = e
+            return
+        
+        for run in self.batch.runs:
+            if run.db_is_current and run.result is not None and run.result.written:
+                refresh_books(run.result.updated_books(), run.result.written.keys())
+    
+    def end_progress(self):
+        if self.exception is not None:
+            custom_exception_dialog(self.exception)
+            return
+        
+        report = self.batch.report()
+        debug_print(report + '\n')
+        msg = _('"{:s}" performed on {:d} libraries for {:d} books with a total of {:d} fields modify.').format(
+            self.menu_name, len(self.batch.runs), self.batch.books_update, self.batch.fields_update,
+        )
+        if self.batch.dry_run:
+            msg += '\n' + _('Dry run, the libraries have not been modified.')
+        if self.batch.has_error():
+            msg += '\n' + _('Some errors have occurred, see the details.')
+        dialog = warning_dialog if self.batch.has_error() else info_dialog
+        dialog(GUI, _('Update Report'), msg,
+            det_msg='-- Mass Search/Replace: Libraries --\n\n'+report,
+            show=True, show_copy_button=True,
+        )
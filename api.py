@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .common_utils import debug_print
+from .prefs import ERROR_OPERATION, ERROR_UPDATE, PROFILE
+from .profiler import RunProfiler
+from .search_replace.engine import SearchReplaceEngine
+from .search_replace.optimizer import Plan, PrefilterGroup
+from .search_replace.query import KEY_QUERY
+from .tracing import span
+from .writer import ChunkedWriter, ignore_changes, write_safely
+
+# Public API of Mass Search/Replace, to run a list of operations without the GUI of the plugin.
+# Nothing here create a widget or a dialog, it can be used by other plugins and by scripts
+# (calibre-debug), the library can be open in calibre or by calibre.library.db().
+# The API uses the preferences and the logging of the plugin (prefs.py and common_utils),
+# so the GUI libraries are imported, it needs the environment of calibre (calibre-debug):
+#
+#     from calibre_plugins.mass_search_replace.api import run
+#
+#     result = run(db, book_ids, operations, ERROR_UPDATE.RESTORE, dry_run=True)
+#     for field, book_id_val_map in result.changes.items():
+#         ...
+#
+# The operations are the dict of the calibre Search/Replace widget, as stored in the menus.
+# To run the same operations many times, compile them once with Runner(db, operations).
+
+# phases passed to the progress callback
+PHASE_EVALUATE = 'evaluate'
+PHASE_WRITE = 'write'
+
+
+class RunResult:
+    '''
+    Result of a run.
+    
+    changes: the new values computed by the operations {field: {book_id: value}}
+    written: the values written in the library {field: {book_id: ''}}, empty for a dry run
+    operation_errors: the invalid operations [(operation number, message)]
+    book_errors: the errors of the books [(book_id, field, exception)]
+    timings: the duration of each phase in seconds {'compile', 'evaluate', 'write', 'total'}
+    profile_files: the files of the profile of the run, see profiler.py
+    latency: the latency by book of each operation {'Operation n': histogram}
+    slow_books: the slowest (operation, book) evaluations, with the size of their fields
+    '''
+    
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.changes: Dict[str, Dict[int, Any]] = {}
+        self.written: Dict[str, Dict[int, str]] = {}
+        self.operation_errors: List[Tuple[int, str]] = []
+        self.book_errors: List[Tuple[int, str, Exception]] = []
+        self.timings: Dict[str, float] = {}
+        self.book_count = 0
+        self.operation_count = 0
+        self.prefilter_skips = 0
+        self.plan_notes: List[str] = []
+        self.write_chunks: List[Tuple[int, float]] = []
+        # the run has been canceled by the progress callback or aborted by a invalid operation
+        self.canceled = False
+        self.aborted = False
+        # the written values have been restored after a error (strategy ERROR_UPDATE.RESTORE)
+        self.restored = False
+        self.profile_files: List[str] = []
+        self.latency: Dict[str, Dict[str, Any]] = {}
+        self.slow_books: List[Dict[str, Any]] = []
+    
+    @property
+    def books_update(self) -> int:
+        return len(self.updated_books())
+    
+    @property
+    def fields_update(self) -> int:
+        return sum(len(m) for m in (self.changes if self.dry_run else self.written).values())
+    
+    def updated_books(self) -> set:
+        '''The books updated in the library, or that would be updated for a dry run'''
+        rslt = set()
+        for book_id_map in (self.changes if self.dry_run else self.written).values():
+            rslt.update(book_id_map.keys())
+        return rslt
+    
+    def has_error(self) -> bool:
+        return bool(self.operation_errors or self.book_errors)
+    
+    def string_info(self) -> str:
+        return (f'{self.books_update} books, {self.fields_update} fields updated'
+                f'{" (dry run)" if self.dry_run else ""} in {self.timings.get("total", 0):0.3f} seconds, '
+                f'{len(self.operation_errors)} invalid operations, {len(self.book_errors)} errors')
+
+
+class Runner:
+    '''
+    The operations compiled for a library, that can be run many times on different books.
+    
+    The invalid operations are listed in errors [(operation number, message)],
+    they are ignored by the runs, or abort them if operation_strategy is ERROR_OPERATION.ABORT.
+    ERROR_OPERATION.ASK cannot ask anything without the GUI, it's the same as ABORT.
+    '''
+    
+    def __init__(self, db, operations: Iterable[Dict[str, Any]], operation_strategy=ERROR_OPERATION.HIDE):
+        start = time.perf_counter()
+        self.db = getattr(db, 'new_api', db)
+        self.operation_strategy = operation_strategy
+        self.errors: List[Tuple[int, str]] = []
+        
+        operations = list(operations)
+        self.operation_count = len(operations)
+        engine = SearchReplaceEngine(self.db, [])
+        compiled_list = []
+        for op_num, operation in enumerate(operations, 1):
+            if not operation.get(KEY_QUERY.ACTIVE, True):
+                continue
+            compiled = engine.compile(operation)
+            if compiled.error:
+                self.errors.append((op_num, str(compiled.error)))
+            else:
+                compiled_list.append((op_num, compiled))
+        self.compiled_list = compiled_list
+        self.plan = Plan(compiled_list)
+        self.compile_time = time.perf_counter() - start
+    
+    @classmethod
+    def join(cls, runners: List['Runner']) -> 'Runner':
+        '''
+        The operations of several Runners of the same library, one after the other,
+        without compiling them again. The operations are numbered in this order.
+        '''
+        rslt = cls.__new__(cls)
+        rslt.db = runners[0].db
+        rslt.operation_strategy = runners[0].operation_strategy
+        rslt.errors = []
+        compiled_list = []
+        offset = 0
+        for runner in runners:
+            rslt.errors.extend((op_num+offset, msg) for op_num, msg in runner.errors)
+            compiled_list.extend((op_num+offset, compiled) for op_num, compiled in runner.compiled_list)
+            offset += runner.operation_count
+        rslt.operation_count = offset
+        rslt.compiled_list = compiled_list
+        rslt.plan = Plan(compiled_list)
+        rslt.compile_time = sum(runner.compile_time for runner in runners)
+        return rslt
+    
+    def is_aborted(self) -> bool:
+        return bool(self.errors) and self.operation_strategy != ERROR_OPERATION.HIDE
+    
+    def run(self, book_ids: Iterable[int], strategy=ERROR_UPDATE.INTERRUPT, dry_run=False,
+            progress: Optional[Callable[[str, int, int], Any]] = None, profile=PROFILE.NONE) -> RunResult:
+        '''
+        Run the operations on the books.
+        
+        strategy: the behavior when a error occurs during the library update (see ERROR_UPDATE).
+        dry_run: compute the changes without writing them.
+        progress: called with (phase, done, total), phase is PHASE_EVALUATE or PHASE_WRITE.
+        If it return True, the run is canceled (before the write of the library).
+        profile: profile the evaluation and the write (see PROFILE).
+        '''
+        start = time.perf_counter()
+        book_ids = list(book_ids)
+        result = RunResult(dry_run)
+        result.book_count = len(book_ids)
+        result.operation_count = self.operation_count
+        result.operation_errors = list(self.errors)
+        result.plan_notes = list(self.plan.notes)
+        result.timings['compile'] = self.compile_time
+        
+        if self.is_aborted():
+            result.aborted = True
+            result.timings['total'] = time.perf_counter() - start
+            return result
+        
+        engine = SearchReplaceEngine(self.db, book_ids)
+        profiler = RunProfiler(profile)
+        try:
+            profiler.start()
+            self._run(result, engine, book_ids, strategy, dry_run, progress)
+        finally:
+            profiler.stop()
+            result.profile_files = profiler.save()
+        
+        result.timings['total'] = time.perf_counter() - start + self.compile_time
+        debug_print('Mass Search/Replace API:', result.string_info())
+        return result
+    
+    def _run(self, result, engine, book_ids, strategy, dry_run, progress):
+        for op_num, compiled in self.compiled_list:
+            if compiled.template:
+                engine.templates.register(compiled.template)
+        
+        total = len(book_ids) * sum(
+            len(step.operations) if isinstance(step, PrefilterGroup) else 1 for op_num, step in self.plan.steps
+        )
+        done = 0
+        
+        def book_progress(book_num, weight=1):
+            if progress and progress(PHASE_EVALUATE, done + book_num*weight, total):
+                engine.cancel()
+        
+        start_evaluate = time.perf_counter()
+        for op_num, step in self.plan.steps:
+            if isinstance(step, PrefilterGroup):
+                weight = len(step.operations)
+                with span(f'Operations {step.op_nums}', 'evaluate', books=len(book_ids)):
+                    engine.run_prefilter_group(step, progress=lambda n: book_progress(n, weight))
+            else:
+                weight = 1
+                with span(f'Operation {op_num}', 'evaluate', books=len(book_ids)):
+                    engine.run_operation(step, progress=book_progress)
+            done += len(book_ids) * weight
+            if engine.canceled:
+                result.canceled = True
+                break
+        result.timings['evaluate'] = time.perf_counter() - start_evaluate
+        result.prefilter_skips = engine.prefilter_skips
+        labels = {compiled:f'Operation {op_num}' for op_num, compiled in self.compiled_list}
+        result.latency = engine.latency.summary(labels)
+        result.slow_books = engine.latency.slowest(self.db, labels)
+        result.book_errors = list(engine.errors)
+        result.changes = {field:dict(m) for field, m in engine.set_field_calls.items() if m}
+        
+        if not dry_run and not result.canceled and result.changes:
+            self.write(result, strategy, progress)
+    
+    def write(self, result: RunResult, strategy=ERROR_UPDATE.INTERRUPT,
+              progress: Optional[Callable[[str, int, int], Any]] = None):
+        '''
+        Write the changes of the result in the library, see run() for the arguments.
+        Used by run(), or to write a dry run evaluated in a other thread.
+        '''
+        result.dry_run = False
+        # the auto-apply menus must not run on these writes if the library is open in the GUI
+        ignore_changes(self.db, result.changes)
+        start_write = time.perf_counter()
+        with span('library update', 'write', strategy=strategy):
+            self._write(result, strategy, progress)
+        result.timings['write'] = time.perf_counter() - start_write
+    
+    def _write(self, result, strategy, progress):
+        def write_progress(done, total):
+            if progress:
+                progress(PHASE_WRITE, done, total)
+        
+        if strategy in (ERROR_UPDATE.SAFELY, ERROR_UPDATE.DONT_STOP):
+            dont_stop = strategy == ERROR_UPDATE.DONT_STOP
+            if result.book_errors and not dont_stop:
+                return
+            written, errors = write_safely(self.db, result.changes, dont_stop=dont_stop, callback=write_progress)
+            result.written = dict(written)
+            result.book_errors.extend(errors)
+            return
+        
+        if result.book_errors:
+            return
+        writer = ChunkedWriter(self.db, result.changes, journal=strategy == ERROR_UPDATE.RESTORE)
+        try:
+            writer.write(callback=write_progress)
+        except Exception as e:
+            result.book_errors.append((None, None, e))
+            if strategy == ERROR_UPDATE.RESTORE:
+                writer.restore()
+                result.restored = True
+        result.written = {field:dict(m) for field, m in writer.written.items()}
+        result.write_chunks = list(writer.chunks)
+
+
+def run(db, book_ids: Iterable[int], operations: Iterable[Dict[str, Any]], strategy=ERROR_UPDATE.INTERRUPT,
+        dry_run=False, progress: Optional[Callable[[str, int, int], Any]] = None,
+        operation_strategy=ERROR_OPERATION.HIDE, profile=PROFILE.NONE) -> RunResult:
+    '''
+    Compile and run a list of operations on the books of the library db.
+    See Runner.run() for the arguments.
+    '''
+    return Runner(db, operations, operation_strategy=operation_strategy).run(
+        book_ids, strategy=strategy, dry_run=dry_run, progress=progress, profile=profile,
+    )
+
+
+def run_menu(db, book_ids: Iterable[int], menu_name: str, **kvargs) -> RunResult:
+    '''
+    Run the operations of a menu of the plugin, by its name ("Sub-menu > Menu" for a menu in a sub-menu).
+    Raise KeyError if the menu doesn't exist.
+    '''
+    from .book_index import menu_index_key
+    from .prefs import KEY_MENU
+    from .store import get_store
+    
+    for menu in get_store().get_menus():
+        if menu_index_key(menu) == menu_name:
+            return run(db, book_ids, menu[KEY_MENU.OPERATIONS], **kvargs)
+    raise KeyError(menu_name)
+
+
+def changes_by_book(result: RunResult) -> Dict[int, Dict[str, Any]]:
+    '''The changes of a result by book {book_id: {field: value}}'''
+    rslt = defaultdict(dict)
+    for field, book_id_val_map in result.changes.items():
+        for book_id, value in book_id_val_map.items():
+            rslt[book_id][field] = value
+    return dict(rslt)
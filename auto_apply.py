@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from threading import Thread
+from typing import Any, Dict, List
+
+try:
+    from qt.core import QObject, QTimer, pyqtSignal
+except ImportError:
+    from PyQt5.Qt import QObject, QTimer, pyqtSignal
+
+from .common_utils import debug_print
+from .prefs import KEY_MENU
+from .refresh import refresh_books
+from .store import get_store
+from .writer import filter_written, ignore_changes, listen_changes
+
+try:
+    from calibre.db.listeners import EventType
+except ImportError:
+    EventType = None
+
+
+# wait this delay (ms) after the last library event before applying the menus
+DELAY = 2000
+
+
+def get_auto_menus() -> List[Dict[str, Any]]:
+    rslt = []
+    for menu in get_store().get_menus():
+        if (menu.get(KEY_MENU.ACTIVE, False) and menu.get(KEY_MENU.AUTO_APPLY, False)
+                and menu.get(KEY_MENU.TEXT, None) and menu.get(KEY_MENU.OPERATIONS, None)):
+            rslt.append(menu)
+    return rslt
+
+
+class AutoApply(QObject):
+    '''
+    Apply the menus marked as "auto-apply" to the books added or edited in the library.
+    
+    The book_ids of the library events are queued and coalesced, and after a short delay
+    the operations of each menu are compiled in the GUI thread
+    and evaluated in a background thread only for these books.
+    The changes are written in the GUI thread.
+    '''
+    
+    books_changed = pyqtSignal(object)
+    evaluated = pyqtSignal(object)
+    
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.db = None
+        self.pending = set()
+        self.queue = []
+        self.running = False
+        # keep a strong reference, calibre store only a weak reference of the listeners
+        self._listener = lambda db, event_type, event_data: self.event_listener(event_type, event_data)
+        
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DELAY)
+        self.timer.timeout.connect(self.apply)
+        
+        self.books_changed.connect(self.queue_books)
+        self.evaluated.connect(self.write)
+    
+    def set_library(self, db):
+        listen = EventType is not None and db is not None and bool(get_auto_menus())
+        if listen and self.db is not None and db.new_api is self.db:
+            # same library, keep the books not yet applied
+            return
+        self.stop()
+        if not listen:
+            return
+        self.db = db.new_api
+        listen_changes(self.db)
+        self.db.add_listener(self._listener)
+        debug_print('Auto-apply: listen the library events')
+    
+    def stop(self):
+        if self.db is not None:
+            try:
+                self.db.remove_listener(self._listener)
+            except Exception:
+                pass
+        self.db = None
+        listen_changes(None)
+        self.pending.clear()
+        self.queue.clear()
+        self.timer.stop()
+    
+    def event_listener(self, event_type, event_data):
+        # called in the event thread of calibre
+        if event_type == EventType.book_created:
+            book_ids = [event_data[0]]
+        elif event_type == EventType.metadata_changed:
+            field, book_ids = event_data
+            if field == 'last_modified':
+                return
+            book_ids = filter_written(field, book_ids)
+        else:
+            return
+        
+        if book_ids:
+            self.books_changed.emit(book_ids)
+    
+    def queue_books(self, book_ids):
+        self.pending.update(book_ids)
+        self.timer.start()
+    
+    def apply(self):
+        if self.db is None:
+            return
+        if self.running:
+            # wait the end of the previous pass
+            self.timer.start()
+            return
+        
+        book_ids = [book_id for book_id in sorted(self.pending) if self.db.has_id(book_id)]
+        self.pending.clear()
+        if not book_ids:
+            return
+        
+        # the operations are compiled in the GUI thread
+        from .search_replace import operation_list_active
+        from .search_replace.engine import SearchReplaceEngine
+        self.queue = []
+        for menu in get_auto_menus():
+            name = menu[KEY_MENU.TEXT]
+            engine = SearchReplaceEngine(self.db, book_ids)
+            compiled_list = []
+            for operation in operation_list_active(menu[KEY_MENU.OPERATIONS]):
+                err = operation.get_error()
+                if not err:
+                    compiled = engine.compile(operation)
+                    err = compiled.error
+                if err:
+                    debug_print('Auto-apply: invalid operation in', name, '>', err)
+                else:
+                    compiled_list.append(compiled)
+            if compiled_list:
+                self.queue.append((name, engine, compiled_list))
+        
+        if self.queue:
+            debug_print(f'Auto-apply: {len(self.queue)} menus for {len(book_ids)} books')
+            self.running = True
+            self.next_menu()
+    
+    def next_menu(self):
+        if not self.queue or self.db is None:
+            self.running = False
+            return
+        name, engine, compiled_list = self.queue.pop(0)
+        Thread(
+            target=self.evaluate, args=(name, engine, compiled_list),
+            name='MassSearchReplace:AutoApply', daemon=True,
+        ).start()
+    
+    def evaluate(self, name, engine, compiled_list):
+        # called in a background thread
+        try:
+            for compiled in compiled_list:
+                engine.run_operation(compiled)
+        except Exception as e:
+            debug_print('Auto-apply: exception in', name, '>', e)
+            engine.set_field_calls.clear()
+        self.evaluated.emit(engine)
+    
+    def write(self, engine):
+        set_field_calls = engine.set_field_calls
+        db = engine.db
+        if set_field_calls and db is not self.db:
+            # the library has changed during the evaluation, the book_ids are not the same books
+            debug_print('Auto-apply: library changed, the result is dropped')
+        elif set_field_calls:
+            lst_id = set()
+            for book_id_val_map in set_field_calls.values():
+                lst_id.update(book_id_val_map.keys())
+            
+            ignore_changes(db, set_field_calls)
+            try:
+                with db.write_lock, db.backend.conn:
+                    for field, book_id_val_map in set_field_calls.items():
+                        db.set_field(field, book_id_val_map)
+            except Exception as e:
+                debug_print('Auto-apply: exception during the library update >', e)
+            
+            debug_print(f'Auto-apply: {len(lst_id)} books updated')
+            refresh_books(lst_id, set_field_calls.keys())
+        
+        self.next_menu()
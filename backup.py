@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from typing import Iterable
+
+try:
+    from qt.core import QObject, QTimer
+except ImportError:
+    from PyQt5.Qt import QObject, QTimer
+
+from .common_utils import GUI, debug_print
+
+# the backup is deferred only for the updates of at least this count of books
+DEFER_MINIMUM = 1000
+# count of books marked for the backup at each step…
+BATCH_SIZE = 500
+# …and delay between the steps (ms)
+BATCH_INTERVAL = 15000
+
+
+def dirtied_books(db, book_ids: Iterable[int]) -> set:
+    '''Return the books of book_ids that wait for the backup of their metadata.opf'''
+    dirtied = getattr(db, 'dirtied_cache', {})
+    return {book_id for book_id in book_ids if book_id in dirtied}
+
+
+class DeferredBackup(QObject):
+    '''
+    Defer the backup of the metadata.opf of the books updated by a large run.
+    
+    calibre mark the updated books as "dirtied" and write their metadata.opf in background,
+    just after the run. The deferred books are unmarked, and marked again by small batches
+    in the following minutes, so the disk is not saturated after the run.
+    The remaining books are marked immediately when the library is changed or calibre is closed.
+    '''
+    
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.db = None
+        self.queue = []
+        self.timer = QTimer(self)
+        self.timer.setInterval(BATCH_INTERVAL)
+        self.timer.timeout.connect(self.next_batch)
+    
+    def defer(self, db, book_ids: Iterable[int]) -> int:
+        '''Defer the backup of the books, return the count of deferred books'''
+        db = getattr(db, 'new_api', db)
+        if not hasattr(db, 'clear_dirtied') or not hasattr(db, 'mark_as_dirty'):
+            return 0
+        if self.db is not None and self.db is not db:
+            self.flush()
+        
+        dirtied = getattr(db, 'dirtied_cache', {})
+        deferred = []
+        for book_id in book_ids:
+            sequence = dirtied.get(book_id, None)
+            if sequence is not None:
+                db.clear_dirtied(book_id, sequence)
+                deferred.append(book_id)
+        
+        if deferred:
+            self.db = db
+            known = set(self.queue)
+            self.queue.extend(book_id for book_id in deferred if book_id not in known)
+            if not self.timer.isActive():
+                self.timer.start()
+            debug_print(f'Deferred backup: {len(deferred)} metadata.opf deferred, {len(self.queue)} waiting.')
+        return len(deferred)
+    
+    def next_batch(self):
+        batch, self.queue = self.queue[:BATCH_SIZE], self.queue[BATCH_SIZE:]
+        self._mark(batch)
+        if not self.queue:
+            self.timer.stop()
+            self.db = None
+    
+    def flush(self):
+        '''Mark immediately all the waiting books for the backup'''
+        self.timer.stop()
+        batch, self.queue = self.queue, []
+        self._mark(batch)
+        self.db = None
+    
+    def _mark(self, book_ids):
+        if not book_ids or self.db is None:
+            return
+        try:
+            book_ids = [book_id for book_id in book_ids if self.db.has_id(book_id)]
+            self.db.mark_as_dirty(book_ids)
+        except Exception as e:
+            debug_print('Deferred backup: exception >', e)
+
+
+_deferred_backup = None
+
+
+def get_deferred_backup() -> DeferredBackup:
+    global _deferred_backup
+    if _deferred_backup is None:
+        _deferred_backup = DeferredBackup(GUI)
+    return _deferred_backup
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .api import Runner, RunResult
+from .common_utils import debug_print
+from .prefs import ERROR_OPERATION, ERROR_UPDATE
+
+# Run the same operations on several libraries, one after the other.
+# Like api.py, nothing here create a widget: the batch can be run from the GUI or by a script (calibre-debug):
+#
+#     from calibre_plugins.mass_search_replace.batch import run_libraries
+#
+#     batch = run_libraries(['/path/library 1', '/path/library 2'], operations, search='tags:foo')
+#     print(batch.report())
+#
+# The operations are compiled and validated for each library, against its own fields.
+# The compiled patterns are shared by all the libraries (see search_replace.patterns).
+
+
+def _normpath(path) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def library_name(path) -> str:
+    return os.path.basename(os.path.normpath(path))
+
+
+class LibraryRun:
+    '''
+    Run of the operations on one library.
+    
+    result: the RunResult, None if the library cannot be open or searched
+    error: the exception that prevented the run
+    timings: the duration of each step in seconds {'open', 'search', 'run', 'close', 'total'}
+    '''
+    
+    def __init__(self, path):
+        self.path = path
+        self.name = library_name(path)
+        self.result: Optional[RunResult] = None
+        self.error: Optional[Exception] = None
+        self.timings: Dict[str, float] = {}
+        # the library is the one given by current_db
+        self.db_is_current = False
+    
+    def string_info(self) -> str:
+        if self.error is not None:
+            return f'{self.name}: error > {self.error}'
+        if self.result is None:
+            return f'{self.name}: not run'
+        return f'{self.name}: {self.result.string_info()}'
+
+
+class BatchResult:
+    '''Aggregated result of the runs on several libraries'''
+    
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.runs: List[LibraryRun] = []
+        self.timings: Dict[str, float] = {}
+        self.pattern_stats: Dict[str, int] = {}
+        self.canceled = False
+    
+    def results(self) -> List[RunResult]:
+        return [run.result for run in self.runs if run.result is not None]
+    
+    @property
+    def books_update(self) -> int:
+        return sum(result.books_update for result in self.results())
+    
+    @property
+    def fields_update(self) -> int:
+        return sum(result.fields_update for result in self.results())
+    
+    def has_error(self) -> bool:
+        return any(run.error is not None or (run.result is not None and run.result.has_error()) for run in self.runs)
+    
+    def string_info(self) -> str:
+        return (f'{len(self.runs)} libraries, {self.books_update} books, {self.fields_update} fields updated'
+                f'{" (dry run)" if self.dry_run else ""} in {self.timings.get("total", 0):0.3f} seconds')
+    
+    def report(self) -> str:
+        '''Text report of the batch, with the timings and the errors of each library'''
+        lines = [self.string_info()]
+        if self.canceled:
+            lines.append('The batch has been canceled.')
+        for run in self.runs:
+            lines.append('')
+            lines.append(f'{run.string_info()}')
+            lines.append('    ' + ', '.join(f'{k} {v:0.3f} s' for k, v in run.timings.items()))
+            if run.result is None:
+                continue
+            if run.result.aborted:
+                lines.append('    aborted by the invalid operations')
+            for op_num, err in run.result.operation_errors:
+                lines.append(f'    Operation {op_num}/{run.result.operation_count} > {err}')
+            for book_id, field, e in run.result.book_errors:
+                lines.append(f'    Book {book_id} | {field} > {e.__class__.__name__}: {e}')
+        if self.pattern_stats:
+            lines.append('')
+            lines.append('Compiled pattern cache: {hits} hits, {misses} compiled ({errors} errors).'.format(
+                **self.pattern_stats
+            ))
+        return '\n'.join(lines)
+
+
+def run_libraries(library_paths: Iterable[str], operations: Iterable[Dict[str, Any]], search='',
+                  strategy=ERROR_UPDATE.INTERRUPT, dry_run=False, operation_strategy=ERROR_OPERATION.HIDE,
+                  progress: Optional[Callable[[int, int, str, int, int], Any]] = None,
+                  current_db=None) -> BatchResult:
+    '''
+    Run the operations on the books of each library, that match the calibre search (all the books if empty).
+    
+    progress: called with (library number, library count, phase, done, total), see Runner.run().
+    If it return True, the batch is canceled.
+    current_db: the library already open (the one of the GUI), used instead of opening it a second time.
+    Its writes go through Runner.run(), like the other libraries, so the auto-apply menus ignore them.
+    The other libraries are open one after the other, and closed after their run.
+    '''
+    from calibre.library import db as open_library
+    
+    from .search_replace.patterns import PATTERN_CACHE, pattern_stats_delta
+    
+    start = time.perf_counter()
+    pattern_stats = PATTERN_CACHE.stats()
+    operations = list(operations)
+    library_paths = list(library_paths)
+    current_db = getattr(current_db, 'new_api', current_db)
+    current_path = _normpath(current_db.library_path) if current_db is not None else None
+    
+    batch = BatchResult(dry_run)
+    for library_num, path in enumerate(library_paths, 1):
+        run = LibraryRun(path)
+        batch.runs.append(run)
+        start_library = time.perf_counter()
+        
+        def library_progress(phase, done, total):
+            if progress and progress(library_num, len(library_paths), phase, done, total):
+                batch.canceled = True
+                return True
+        
+        legacy = None
+        try:
+            if current_path and _normpath(path) == current_path:
+                db = current_db
+                run.db_is_current = True
+            else:
+                legacy = open_library(path, read_only=dry_run)
+                db = legacy.new_api
+            run.timings['open'] = time.perf_counter() - start_library
+            
+            start_step = time.perf_counter()
+            book_ids = db.search(search) if search else db.all_book_ids()
+            run.timings['search'] = time.perf_counter() - start_step
+            
+            start_step = time.perf_counter()
+            run.result = Runner(db, operations, operation_strategy=operation_strategy).run(
+                sorted(book_ids), strategy=strategy, dry_run=dry_run, progress=library_progress,
+            )
+            run.timings['run'] = time.perf_counter() - start_step
+        except Exception as e:
+            debug_print(f'Batch: library "{run.name}" >', e)
+            run.error = e
+        finally:
+            if legacy is not None:
+                start_step = time.perf_counter()
+                try:
+                    legacy.close()
+                except Exception as e:
+                    debug_print(f'Batch: unable to close the library "{run.name}" >', e)
+                run.timings['close'] = time.perf_counter() - start_step
+        run.timings['total'] = time.perf_counter() - start_library
+        debug_print('Batch:', run.string_info())
+        
+        if batch.canceled:
+            break
+    
+    batch.pattern_stats = pattern_stats_delta(pattern_stats)
+    batch.timings['total'] = time.perf_counter() - start
+    return batch
+
+
+def run_menu_libraries(library_paths: Iterable[str], menu_name: str, **kvargs) -> BatchResult:
+    '''
+    Run the operations of a menu of the plugin on several libraries, see run_libraries() for the arguments.
+    Raise KeyError if the menu doesn't exist.
+    '''
+    from .book_index import menu_index_key
+    from .prefs import KEY_MENU
+    from .store import get_store
+    
+    for menu in get_store().get_menus():
+        if menu_index_key(menu) == menu_name:
+            return run_libraries(library_paths, menu[KEY_MENU.OPERATIONS], **kvargs)
+    raise KeyError(menu_name)
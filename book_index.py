@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import hashlib
+import json
+from typing import Dict, List
+
+from calibre.utils.config import JSONConfig
+
+from .common_utils import debug_print
+from .prefs import KEY_MENU
+
+
+def operation_list_hash(operation_list) -> str:
+    '''
+    Hash of the content of a operation list, the same in all the languages of the interface.
+    The content of the shared named operations is part of the hash, so editing them
+    (also in the Search/Replace dialog of calibre) change the hash too.
+    '''
+    from .search_replace.named import get_named_queries
+    from .search_replace.query import KEY_QUERY
+    from .search_replace.schema import OperationSpec
+    
+    queries = get_named_queries()
+    data = []
+    for operation in operation_list:
+        named = queries.get(operation.get(KEY_QUERY.NAME, None))
+        data.append([OperationSpec(operation).hash, OperationSpec(named).hash if named else None])
+    
+    data = json.dumps(data)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def menu_index_key(menu) -> str:
+    text = menu.get(KEY_MENU.TEXT, None)
+    if not text:
+        return None
+    sub_menu = menu.get(KEY_MENU.SUBMENU, None)
+    if sub_menu:
+        return f'{sub_menu} > {text}'
+    return text
+
+
+def _timestamps(db, book_ids) -> Dict[int, float]:
+    rslt = {}
+    for book_id, date in db.all_field_for('last_modified', book_ids).items():
+        try:
+            rslt[book_id] = date.timestamp()
+        except Exception:
+            pass
+    return rslt
+
+
+class BookIndex:
+    '''
+    Per-menu index of the books processed by the last runs of Mass Search/Replace.
+    
+    For each menu, the index store the hash of the operation list
+    and the "last_modified" date of the books after the run {book_id: timestamp}.
+    A book not modified since it was processed with the same operations can be skipped.
+    Editing the operations of the menu invalidate the index of this menu.
+    
+    The index is stored by library, in the config folder of calibre.
+    '''
+    
+    def __init__(self, db):
+        self.db = getattr(db, 'new_api', db)
+        library_id = getattr(self.db, 'library_id', None) or 'default'
+        self.prefs = JSONConfig(f'plugins/Mass Search-Replace.index/{library_id}')
+    
+    def filter(self, menu, operation_list, book_ids) -> List[int]:
+        '''Return the books of book_ids that have been modified since the last run of the menu'''
+        key = menu_index_key(menu)
+        if not key or not book_ids:
+            return list(book_ids)
+        
+        entry = self.prefs.get(key, None)
+        if not entry or entry.get('hash', None) != operation_list_hash(operation_list):
+            return list(book_ids)
+        
+        processed = entry.get('books', {})
+        timestamps = _timestamps(self.db, book_ids)
+        rslt = []
+        for book_id in book_ids:
+            timestamp = timestamps.get(book_id, None)
+            if timestamp is None or processed.get(str(book_id), None) != timestamp:
+                rslt.append(book_id)
+        return rslt
+    
+    def record(self, menu, operation_list, book_ids):
+        '''Record the books processed by a successful run of the menu'''
+        key = menu_index_key(menu)
+        if not key or not book_ids:
+            return
+        
+        op_hash = operation_list_hash(operation_list)
+        entry = self.prefs.get(key, None)
+        if not entry or entry.get('hash', None) != op_hash:
+            entry = {'hash': op_hash, 'books': {}}
+        
+        books = entry['books']
+        for book_id, timestamp in _timestamps(self.db, book_ids).items():
+            books[str(book_id)] = timestamp
+        
+        # forget the deleted books
+        all_ids = self.db.all_book_ids()
+        for book_id in list(books.keys()):
+            if int(book_id) not in all_ids:
+                del books[book_id]
+        
+        self.prefs[key] = entry
+        debug_print(f'Last-processed index: {len(books)} books recorded for "{key}"')
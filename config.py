@@ -10,6 +10,7 @@ except NameError:
     pass  # load_translations() added in calibre 1.9
 
 import copy
+import hashlib
 import json
 import os
 from functools import partial
@@ -22,6 +23,9 @@ try:
         QCheckBox,
         QHBoxLayout,
         QLabel,
+        QLineEdit,
+        QListWidget,
+        QListWidgetItem,
         QPushButton,
         QSizePolicy,
         QSpacerItem,
@@ -40,6 +44,9 @@ except ImportError:
         QCheckBox,
         QHBoxLayout,
         QLabel,
+        QLineEdit,
+        QListWidget,
+        QListWidgetItem,
         QPushButton,
         QSizePolicy,
         QSpacerItem,
@@ -54,11 +61,9 @@ except ImportError:
 
 from calibre.gui2 import error_dialog, info_dialog, open_local_file, question_dialog
 from calibre.gui2.widgets2 import Dialog
-from calibre.utils.config import JSONConfig
 from calibre.utils.zipfile import ZipFile
-from polyglot.builtins import unicode_type
 
-from .common_utils import CALIBRE_VERSION, GUI, PREFS_json, debug_print, get_icon, get_image_map, local_resource
+from .common_utils import CALIBRE_VERSION, GUI, debug_print, get_icon, get_image_map, local_resource
 from .common_utils.dialogs import (
     ImageDialog,
     KeyboardConfigDialogButton,
@@ -76,125 +81,21 @@ from .common_utils.widgets import (
     ReadOnlyTableWidgetItem,
     TextIconWidgetItem,
 )
+from .prefs import ERROR_OPERATION, ERROR_UPDATE, ICON, KEY_ERROR, KEY_MENU, PREFS, PROFILE, get_default_menu  # noqa: F401
 from .search_replace import KEY_QUERY, Operation, SearchReplaceDialog, clean_empty_operation
+from .search_replace.named import get_named_queries
+from .store import get_store
 
+try:
+    from calibre.db.listeners import EventType  # noqa: F401
+    HAS_LIBRARY_EVENTS = True
+except ImportError:
+    HAS_LIBRARY_EVENTS = False
 
-class ICON:
-    PLUGIN    = 'images/plugin.png'
-    ADD_IMAGE = 'images/image_add.png'
-    EXPORT    = 'images/export.png'
-    IMPORT    = 'images/import.png'
-    WARNING   = 'images/warning.png'
-
-
-class KEY_MENU:
-    MENU = 'Menu'
-    ACTIVE = 'Active'
-    IMAGE = 'Image'
-    TEXT = 'Text'
-    SUBMENU = 'SubMenu'
-    OPERATIONS = 'Operations'
-    
-    ALL = [
-        ACTIVE,
-        TEXT,
-        SUBMENU,
-        IMAGE,
-        OPERATIONS,
-    ]
-    
-    QUICK = 'Quick'
-    UPDATE_REPORT = 'UpdateReport'
-    USE_MARK = 'UseMark'
-
-
-class KEY_ERROR:
-    ERROR = 'ErrorStrategy'
-    UPDATE = 'Update'
-    OPERATION = 'Operation'
-
-
-class ERROR_UPDATE:
-    
-    INTERRUPT = 'interrupt'
-    INTERRUPT_NAME = _('Interrupt execution')
-    INTERRUPT_DESC = _('Stop Mass Search/Replace and display the error normally without further action.')
-    
-    RESTORE = 'restore'
-    RESTORE_NAME = _('Restore the library')
-    RESTORE_DESC = _('Stop Mass Search/Replace and restore the library to its original state.')
-    
-    safely_txt = _('Updates the fields one by one. This operation can be slower than other strategies.')
-    
-    SAFELY = 'safely stop'
-    SAFELY_NAME = _('Carefully executed (slower)')
-    SAFELY_DESC = (safely_txt+'\n'+
-    _('When a error occurs, stop Mass Search/Replace and display the error normally without further action.'))
-    
-    DONT_STOP = "don't stop"
-    DONT_STOP_NAME = _("Don't stop (slower, not recomanded)")
-    DONT_STOP_DESC = (safely_txt+'\n'+
-    _('Update the library, no matter how many errors are encountered. The problematics fields will not be updated.'))
-    
-    LIST = {
-            INTERRUPT: [INTERRUPT_NAME, INTERRUPT_DESC],
-            RESTORE: [RESTORE_NAME, RESTORE_DESC],
-            SAFELY: [SAFELY_NAME, SAFELY_DESC],
-            DONT_STOP: [DONT_STOP_NAME, DONT_STOP_DESC],
-    }
-    
-    DEFAULT = INTERRUPT
-
-
-class ERROR_OPERATION:
-    
-    ABORT = 'abort'
-    ABORT_NAME = _('Abbort')
-    ABORT_DESC = _('If an invalid operation is detected, abort the changes.')
-    
-    ASK = 'ask'
-    ASK_NAME = _('Asked')
-    ASK_DESC = _('If an invalid operation is detected, asked whether to continue or abort the changes.')
-    
-    HIDE = 'hide'
-    HIDE_NAME = _('Hidden')
-    HIDE_DESC = _('Ignore all invalid operations.')
-    
-    LIST = {
-            ABORT: [ABORT_NAME, ABORT_DESC],
-            ASK: [ASK_NAME, ASK_DESC],
-            HIDE: [HIDE_NAME, HIDE_DESC],
-    }
-    
-    DEFAULT = ASK
-
-
-# This is where all preferences for this plugin are stored
-PREFS = PREFS_json()
-# Set defaults
-PREFS.defaults[KEY_MENU.MENU] = []
-PREFS.defaults[KEY_MENU.QUICK] = []
-PREFS.defaults[KEY_MENU.UPDATE_REPORT] = False
-PREFS.defaults[KEY_MENU.USE_MARK] = True
-
-PREFS.defaults[KEY_ERROR.ERROR] = {
-    KEY_ERROR.OPERATION : ERROR_UPDATE.DEFAULT,
-    KEY_ERROR.UPDATE : ERROR_OPERATION.DEFAULT
-}
 
 OWIP = 'owip'
 
 
-def get_default_menu() -> Dict[str, Any]:
-    menu = {}
-    menu[KEY_MENU.ACTIVE] = True
-    menu[KEY_MENU.TEXT] = ''
-    menu[KEY_MENU.SUBMENU] = ''
-    menu[KEY_MENU.IMAGE] = ''
-    menu[KEY_MENU.OPERATIONS] = []
-    return menu
-
-
 class ConfigWidget(QWidget):
     def __init__(self):
         QWidget.__init__(self)
@@ -203,7 +104,7 @@ class ConfigWidget(QWidget):
         self.setLayout(layout)
         
         menu_list = []
-        for menu in PREFS[KEY_MENU.MENU]:
+        for menu in get_store().get_menus():
             menu[KEY_MENU.OPERATIONS] = [Operation(o) for o in menu[KEY_MENU.OPERATIONS]]
             menu_list.append(menu)
         
@@ -278,19 +179,60 @@ class ConfigWidget(QWidget):
         self.updateReport.setChecked(PREFS[KEY_MENU.UPDATE_REPORT])
         keyboard_layout.addWidget(self.updateReport)
         
+        self.skipUnchanged = QCheckBox(_('Skip the unchanged books'), self)
+        self.skipUnchanged.setToolTip(_('Skip the books not modified since the last run of the same menu, '
+                                        'if its operations have not been edited.\n'
+                                        "Don't use it with the templates that depend on the date, "
+                                        'on the other books or on the other fields'))
+        self.skipUnchanged.setChecked(PREFS[KEY_MENU.SKIP_UNCHANGED])
+        keyboard_layout.addWidget(self.skipUnchanged)
+        
+        self.deferBackup = QCheckBox(_('Defer the metadata.opf backup'), self)
+        self.deferBackup.setToolTip(_('For the large updates, write the metadata.opf backup of the books '
+                                      'by small batches in the following minutes'))
+        self.deferBackup.setChecked(PREFS[KEY_MENU.DEFER_BACKUP])
+        keyboard_layout.addWidget(self.deferBackup)
+        
+        self.jobServer = QCheckBox(_('Accept the jobs of the local scripts'), self)
+        self.jobServer.setToolTip(_('Run the menus and the operations submitted by the scripts of this computer '
+                                    'on a local socket, accessible only to the current user'))
+        self.jobServer.setChecked(PREFS[KEY_MENU.JOB_SERVER])
+        keyboard_layout.addWidget(self.jobServer)
+        
         error_button = QPushButton(_('Error strategy')+'…', self)
         error_button.setToolTip(_('Define the strategy when a error occurs during the library update'))
         error_button.clicked.connect(self.edit_error_strategy)
         keyboard_layout.addWidget(error_button)
+        
+        history_button = QPushButton(_('Run history')+'…', self)
+        history_button.setToolTip(_('Show the throughput of the last runs of each menu'))
+        history_button.clicked.connect(self.show_history)
+        keyboard_layout.addWidget(history_button)
+        
+        self.profile = KeyValueComboBox(
+            {key:value[0] for key, value in PROFILE.LIST.items()},
+            PREFS[KEY_MENU.PROFILE] if PREFS[KEY_MENU.PROFILE] in PROFILE.LIST else PROFILE.DEFAULT,
+            parent=self,
+        )
+        self.profile.setToolTip(_('Profile the runs, to send a report of a slow run to the developers'))
+        keyboard_layout.addWidget(self.profile)
     
     def save_settings(self):
-        PREFS[KEY_MENU.MENU] = self.table.get_menu_list()
+        menu_list = self.table.get_menu_list()
+        get_store().set_menus(menu_list)
         PREFS[KEY_MENU.UPDATE_REPORT] = self.updateReport.checkState() == Qt.Checked
+        PREFS[KEY_MENU.SKIP_UNCHANGED] = self.skipUnchanged.checkState() == Qt.Checked
+        PREFS[KEY_MENU.DEFER_BACKUP] = self.deferBackup.checkState() == Qt.Checked
+        PREFS[KEY_MENU.JOB_SERVER] = self.jobServer.checkState() == Qt.Checked
+        PREFS[KEY_MENU.PROFILE] = self.profile.selected_key()
         if CALIBRE_VERSION >= (5,41,0):
             PREFS[KEY_MENU.USE_MARK] = self.useMark.checkState() == Qt.Checked
-        debug_print('Save settings: menu operation count:', len(PREFS[KEY_MENU.MENU]), '\n')
+        debug_print('Save settings: menu operation count:', len(menu_list), '\n')
         # debug_print('Save settings:\n', PREFS, '\n')
     
+    def show_history(self):
+        HistoryDialog(self).exec()
+    
     def edit_error_strategy(self):
         d = ErrorStrategyDialog(self)
         if d.exec():
@@ -624,6 +566,7 @@ class MenuTableWidget(QTableWidget):
         if menu[KEY_MENU.TEXT]:
             menu[KEY_MENU.IMAGE] = self.cellWidget(row, 3).currentText().strip()
             menu[KEY_MENU.OPERATIONS] = self.cellWidget(row, 4).get_operation_list()
+            menu[KEY_MENU.AUTO_APPLY] = self.cellWidget(row, 4).get_menu().get(KEY_MENU.AUTO_APPLY, False)
         return menu
     
     def get_selected_menu(self) -> List[Dict[str, Any]]:
@@ -639,6 +582,13 @@ class MenuTableWidget(QTableWidget):
             self.populate_table_row(row, menu)
 
 
+def menu_hash(menu) -> str:
+    '''Hash of the operations list of a menu, from the cached hashes of the operations'''
+    data = [menu.get(KEY_MENU.AUTO_APPLY, False)]
+    data.extend(operation.get_hash() for operation in menu.get(KEY_MENU.OPERATIONS, None) or [])
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+
 class SettingsButton(QToolButton):
     def __init__(self, table, menu):
         QToolButton.__init__(self, parent=table)
@@ -649,21 +599,25 @@ class SettingsButton(QToolButton):
         self.clicked.connect(self._clicked)
         
         self.table = table
-        self._initial_menu = copy.deepcopy(menu)
+        self._initial_hash = menu_hash(menu)
         self.set_menu(menu)
     
     def set_menu(self, menu):
+        # the menu is never changed in place, a new menu is set (copy-on-write)
         self._menu = menu
+        self._hash = menu_hash(menu)
+        self._has_error = any(operation.get_error() for operation in menu[KEY_MENU.OPERATIONS])
         self.update_text()
-        self.has_error()
+        self.update_icon()
     
     def get_menu(self) -> Dict[str, Any]:
         return copy.copy(self._menu)
     
     def update_text(self):
-        count = len(self.get_operation_list())
+        operation_list = self._menu[KEY_MENU.OPERATIONS]
+        count = len(operation_list)
         active = 0
-        for operation in self.get_operation_list():
+        for operation in operation_list:
             if operation.get(KEY_QUERY.ACTIVE, True):
                 active += 1
         
@@ -673,46 +627,31 @@ class SettingsButton(QToolButton):
         else:
             txt = _('{:d} operations').format(count)
         
+        if self._menu.get(KEY_MENU.AUTO_APPLY, False):
+            txt += ' ' + _('(auto-apply)')
+        
         if self.get_has_changed():
             txt+='*'
         self.setText(txt)
     
-    def has_error(self) -> bool:
-        has_error = False
-        
-        for operation in self.get_operation_list():
-            if operation.get_error():
-                has_error = True
-                break
-        
-        if has_error:
+    def update_icon(self):
+        if self._has_error:
             self.setIcon(get_icon(ICON.WARNING))
             self.setToolTip(_('This operations list contain a error'))
         else:
             self.setIcon(get_icon('gear.png'))
             self.setToolTip(_('Edit the operations list'))
-        
-        return has_error
+    
+    def has_error(self) -> bool:
+        return self._has_error
     
     def get_has_changed(self) -> bool:
-        op_lst = self.get_operation_list()
-        initial_op_lst = self._initial_menu[KEY_MENU.OPERATIONS]
-        if len(op_lst) != len(initial_op_lst):
-            return True
-        
-        for i in range(len(op_lst)):
-            if op_lst[i].get(KEY_QUERY.ACTIVE, True) != initial_op_lst[i].get(KEY_QUERY.ACTIVE, True):
-                return True
-            
-            for key in KEY_QUERY.ALL:
-                if op_lst[i][key] != initial_op_lst[i][key]:
-                    return True
-        
-        return False
+        return self._hash != self._initial_hash
     
     def set_operation_list(self, operation_list):
-        self._menu[KEY_MENU.OPERATIONS] = operation_list
-        self.set_menu(self._menu)
+        menu = copy.copy(self._menu)
+        menu[KEY_MENU.OPERATIONS] = operation_list
+        self.set_menu(menu)
     
     def get_operation_list(self) -> List[Operation]:
         return copy.copy(self._menu[KEY_MENU.OPERATIONS])
@@ -720,7 +659,10 @@ class SettingsButton(QToolButton):
     def _clicked(self):
         d = ConfigOperationListDialog(self.get_menu(), parent=self)
         if d.exec():
-            self.set_operation_list(d.operation_list)
+            menu = copy.copy(self._menu)
+            menu[KEY_MENU.AUTO_APPLY] = d.auto_apply
+            menu[KEY_MENU.OPERATIONS] = d.operation_list
+            self.set_menu(menu)
 
 
 COL_CONFIG = ['', _('Name'), _('Columns'), _('Template'), _('Search mode'), _('Search'), _('Replace')]
@@ -732,7 +674,9 @@ class ConfigOperationListDialog(Dialog):
         name = menu[KEY_MENU.TEXT]
         sub_menu = menu[KEY_MENU.SUBMENU]
         self.operation_list = menu[KEY_MENU.OPERATIONS]
+        self.auto_apply = menu.get(KEY_MENU.AUTO_APPLY, False)
         self.book_ids = book_ids
+        self.is_quick = not name
         
         title = ''
         if not name:
@@ -820,6 +764,13 @@ class ConfigOperationListDialog(Dialog):
         delete_button.clicked.connect(self.table.delete_rows)
         copy_button.clicked.connect(self.table.copy_row)
         
+        if not self.is_quick and HAS_LIBRARY_EVENTS:
+            self.autoApply = QCheckBox(_('Apply automatically to the books added or edited in the library'), self)
+            self.autoApply.setToolTip(_('The operations are applied in background only to the books added or edited, '
+                                        'after each change of the library'))
+            self.autoApply.setChecked(self.auto_apply)
+            layout.addWidget(self.autoApply)
+        
         # -- Accept/Reject buttons --
         layout.addWidget(self.bb)
     
@@ -828,6 +779,8 @@ class ConfigOperationListDialog(Dialog):
     
     def accept(self):
         self.operation_list = self.table.get_operation_list()
+        if not self.is_quick and HAS_LIBRARY_EVENTS:
+            self.auto_apply = self.autoApply.isChecked()
         
         if len(self.operation_list)==0:
             debug_print('Saving a empty list')
@@ -916,12 +869,12 @@ class OperationListTableWidget(QTableWidget):
         self.verticalHeader().setDefaultSectionSize(24)
         
         operation_list = clean_empty_operation(operation_list)
-        calibre_queries = JSONConfig('search_replace_queries')
+        calibre_queries = get_named_queries()
         
         self.setRowCount(len(operation_list))
         for row, operation in enumerate(operation_list):
             is_active = operation[KEY_QUERY.ACTIVE]
-            calibre_operation = calibre_queries.get(unicode_type(operation.get(KEY_QUERY.NAME, None)))
+            calibre_operation = calibre_queries.get(operation.get(KEY_QUERY.NAME, None))
             if calibre_operation:
                 operation = Operation(calibre_operation)
             operation[KEY_QUERY.ACTIVE] = is_active
@@ -1074,7 +1027,7 @@ class OperationListTableWidget(QTableWidget):
         for row in range(self.rowCount()):
             operation = self.convert_row_to_operation(row)
             operation_list.append(operation)
-       
+        
         return clean_empty_operation(operation_list)
     
     def convert_row_to_operation(self, row) -> Operation:
@@ -1130,8 +1083,12 @@ class OperationWidgetItem(QTableWidgetItem):
         self.has_error()
     
     def get_operation(self) -> Operation:
-        self._operation[KEY_QUERY.ACTIVE] = Qt.Checked == self.checkState()
-        return copy.copy(self._operation)
+        active = Qt.Checked == self.checkState()
+        if self._operation.get(KEY_QUERY.ACTIVE, True) != active:
+            # the operation can be shared with a other row
+            self._operation = copy.copy(self._operation)
+            self._operation[KEY_QUERY.ACTIVE] = active
+        return self._operation
     
     def has_error(self) -> bool:
         err = self._operation.test_full_error()
@@ -1222,3 +1179,187 @@ class ErrorStrategyDialog(Dialog):
             self.error_update = ERROR_UPDATE.DEFAULT
         
         Dialog.accept(self)
+
+
+class LibrariesDialog(Dialog):
+    '''Select a menu and the libraries where to run it'''
+    
+    def __init__(self, menu_names: List[str], library_paths: List[str], parent=None):
+        self.menu_names = menu_names
+        self.library_paths = library_paths
+        Dialog.__init__(self,
+            title=_('Run a menu on several libraries'),
+            name='plugin.MassSearchReplace:config_Libraries',
+            parent=parent or GUI,
+        )
+    
+    def setup_ui(self):
+        from .batch import library_name
+        
+        layout = QVBoxLayout(self)
+        self.setLayout(layout)
+        
+        menu_label = QLabel(_('Menu:'), self)
+        layout.addWidget(menu_label)
+        self.menuName = KeyValueComboBox(
+            {name:name for name in self.menu_names},
+            self.menu_names[0] if self.menu_names else None,
+            parent=self,
+        )
+        layout.addWidget(self.menuName)
+        menu_label.setBuddy(self.menuName)
+        
+        library_label = QLabel(_('Libraries:'), self)
+        layout.addWidget(library_label)
+        self.libraries = QListWidget(self)
+        for path in self.library_paths:
+            item = QListWidgetItem(library_name(path), self.libraries)
+            item.setToolTip(path)
+            item.setData(Qt.UserRole, path)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+        layout.addWidget(self.libraries)
+        library_label.setBuddy(self.libraries)
+        
+        search_label = QLabel(_('Search in each library (empty for all the books):'), self)
+        layout.addWidget(search_label)
+        self.search = QLineEdit(self)
+        layout.addWidget(self.search)
+        search_label.setBuddy(self.search)
+        
+        self.dryRun = QCheckBox(_('Dry run, count the changes without updating the libraries'), self)
+        layout.addWidget(self.dryRun)
+        
+        # -- Accept/Reject buttons --
+        layout.addWidget(self.bb)
+    
+    def selected_libraries(self) -> List[str]:
+        rslt = []
+        for row in range(self.libraries.count()):
+            item = self.libraries.item(row)
+            if item.checkState() == Qt.Checked:
+                rslt.append(item.data(Qt.UserRole))
+        return rslt
+    
+    def accept(self):
+        self.menu_name = self.menuName.selected_key()
+        self.library_list = self.selected_libraries()
+        self.search_text = self.search.text().strip()
+        self.dry_run = self.dryRun.checkState() == Qt.Checked
+        if not self.menu_name or not self.library_list:
+            return error_dialog(self, _('No library selected'),
+                _('Select a menu and at least one library.'),
+                show=True, show_copy_button=False,
+            )
+        Dialog.accept(self)
+
+
+class HistoryDialog(Dialog):
+    '''The trends of the runs of each menu, the regressions are highlighted'''
+    
+    def __init__(self, parent=None):
+        Dialog.__init__(self,
+            title=_('Run history'),
+            name='plugin.MassSearchReplace:config_History',
+            parent=parent or GUI,
+        )
+    
+    def setup_ui(self):
+        from .history import get_history
+        
+        layout = QVBoxLayout(self)
+        self.setLayout(layout)
+        
+        layout.addWidget(QLabel(_('Throughput of the last run of each menu, '
+                                  'compared to the median of its previous runs:'), self))
+        
+        self.table = QTableWidget(self)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.itemSelectionChanged.connect(self.show_runs)
+        layout.addWidget(self.table)
+        
+        self.runs = QTextEdit(self)
+        self.runs.setReadOnly(True)
+        layout.addWidget(self.runs)
+        
+        button_layout = QHBoxLayout()
+        layout.addLayout(button_layout)
+        clear_button = QPushButton(_('Clear the history'), self)
+        clear_button.clicked.connect(self.clear_history)
+        button_layout.addWidget(clear_button)
+        button_layout.addStretch(1)
+        button_layout.addWidget(self.bb)
+        
+        self.history = get_history()
+        self.populate_table()
+    
+    def populate_table(self):
+        import datetime
+        
+        from .history import KEY_RUN
+        
+        self.trends = self.history.trends(getattr(GUI.current_db.new_api, 'library_id', None))
+        header_labels = [
+            _('Menu'), _('Runs'), _('Last run'), _('Books'), _('Books/s'), _('Median books/s'), _('Trend'),
+        ]
+        self.table.clear()
+        self.table.setColumnCount(len(header_labels))
+        self.table.setHorizontalHeaderLabels(header_labels)
+        self.table.setRowCount(len(self.trends))
+        for row, trend in enumerate(self.trends):
+            date = datetime.datetime.fromtimestamp(trend.last.get(KEY_RUN.TIME, 0))
+            if trend.is_regression():
+                text = _('{:0.1f}x slower').format(trend.ratio)
+            elif trend.ratio:
+                text = _('{:0.1f}x').format(1/trend.ratio)
+            else:
+                text = ''
+            if trend.edited:
+                text = (text + ' ' + _('(edited)')).strip()
+            values = [
+                trend.menu, str(len(trend.records)), date.strftime('%Y-%m-%d %H:%M'),
+                str(trend.last.get(KEY_RUN.BOOK_COUNT, 0)), f'{trend.last_throughput:0.1f}',
+                f'{trend.median_throughput:0.1f}', text,
+            ]
+            for col, value in enumerate(values):
+                item = ReadOnlyTableWidgetItem(value)
+                if trend.is_regression():
+                    item.setForeground(Qt.red)
+                self.table.setItem(row, col, item)
+        self.table.resizeColumnsToContents()
+        self.runs.clear()
+    
+    def show_runs(self):
+        import datetime
+        
+        from .history import KEY_RUN, throughput
+        
+        row = self.table.currentRow()
+        if row < 0 or row >= len(self.trends):
+            return
+        lines = []
+        previous_hash = None
+        for record in reversed(self.trends[row].records):
+            date = datetime.datetime.fromtimestamp(record.get(KEY_RUN.TIME, 0))
+            edited = previous_hash is not None and record.get(KEY_RUN.HASH) != previous_hash
+            previous_hash = record.get(KEY_RUN.HASH)
+            lines.append(
+                f'{date:%Y-%m-%d %H:%M} | {record.get(KEY_RUN.BOOK_COUNT, 0)} books, '
+                f'{record.get(KEY_RUN.BOOKS_UPDATE, 0)} updated, {record.get(KEY_RUN.FIELDS_UPDATE, 0)} fields | '
+                f'evaluate {record.get(KEY_RUN.EVALUATE, 0):0.3f} s ({throughput(record):0.1f} books/s), '
+                f'write {record.get(KEY_RUN.WRITE, 0):0.3f} s, '
+                f'lock {record.get(KEY_RUN.LOCK_HOLD_MAX, 0):0.3f} s max | '
+                f'{record.get(KEY_RUN.OPERATION_ERRORS, 0)} invalid operations, '
+                f'{record.get(KEY_RUN.BOOK_ERRORS, 0)} errors'
+                + (' | ' + _('operations edited after this run') if edited else '')
+            )
+            for op_nums, seconds in record.get(KEY_RUN.OPERATIONS, []):
+                lines.append(f'    {_("Operation")} {",".join(str(n) for n in op_nums)}: {seconds:0.3f} s')
+        self.runs.setPlainText('\n'.join(lines))
+    
+    def clear_history(self):
+        if question_dialog(self, _('Clear the history'), _('Remove the history of all the runs?'),
+                           show_copy_button=False):
+            self.history.clear()
+            self.populate_table()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import random
+import statistics
+from typing import Any, Dict, List, Optional
+
+from .history import KEY_RUN
+from .search_replace.optimizer import PrefilterGroup
+from .search_replace.query import TEMPLATE_FIELD
+from .search_replace.schema import SearchMode
+
+# Estimation of the duration of a run, before it start.
+# This module must not import the GUI libraries.
+#
+# The cost of a operation for a book is proportional to the size of its source field,
+# weighted by the kind of operation. The cost units are converted in seconds with the rate
+# measured by the previous runs (see history.py); when the same operations have already been run
+# on the library, the throughput of these runs is used directly.
+
+# cost of a operation for a book, without the size of the field
+BASE_COST = 20
+KIND_WEIGHT = {
+    SearchMode.CHARACTER     : 1,
+    SearchMode.REGEX         : 2,
+    SearchMode.REPLACE_FIELD : 0.5,
+}
+TEMPLATE_COST = 400
+# the books where no literal of a prefilter group is found are skipped by all its operations
+GROUP_WEIGHT = 0.5
+# count of books read to measure the size of a field
+SAMPLE_SIZE = 200
+# seconds per cost unit, before any run has been measured
+DEFAULT_RATE = 1e-6
+# seconds per book for the library update, before any run has been measured
+DEFAULT_WRITE_RATE = 1e-4
+# count of previous runs used for the rates
+RATE_RUNS = 20
+# duration above which the user is asked to confirm the run, in seconds
+CONFIRM_DURATION = 60
+
+
+def _median(values, default):
+    values = [v for v in values if v > 0]
+    return statistics.median(values) if values else default
+
+
+def field_size(db, field: str, book_ids: List[int]) -> float:
+    '''Average length of the values of the field, measured on a sample of the books'''
+    if not book_ids or not field or field == TEMPLATE_FIELD:
+        return 0
+    sample = book_ids if len(book_ids) <= SAMPLE_SIZE else random.sample(book_ids, SAMPLE_SIZE)
+    try:
+        values = db.all_field_for(field, sample, default_value=None)
+    except Exception:
+        return 0
+    total = 0
+    for value in values.values():
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            total += sum(len(str(k)) + len(str(v)) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            total += sum(len(str(v)) for v in value)
+        else:
+            total += len(str(value))
+    return total / len(sample)
+
+
+def operation_cost(compiled, sizes: Dict[str, float]) -> float:
+    '''Cost of the operation for one book'''
+    cost = BASE_COST + sizes.get(compiled.source, 0)
+    cost *= KIND_WEIGHT.get(compiled.search_mode, 1)
+    if compiled.template:
+        cost += TEMPLATE_COST
+    return cost
+
+
+class Estimate:
+    '''
+    Estimated duration of a run.
+    
+    step_costs: the cost of each step of the plan for all the books, to follow the progress of the run
+    source: 'history' if measured by the previous runs of the same operations, else 'model'
+    '''
+    
+    def __init__(self):
+        self.step_costs: List[float] = []
+        self.cost = 0
+        self.evaluate = 0
+        self.write = 0
+        self.source = 'model'
+    
+    @property
+    def total(self) -> float:
+        return self.evaluate + self.write
+    
+    def __repr__(self):
+        return (f'<Estimate {self.total:0.1f} s ({self.source}), '
+                f'evaluate {self.evaluate:0.1f} s, write {self.write:0.1f} s>')
+
+
+def estimate_run(db, steps, book_ids: List[int], records: Optional[List[Dict[str, Any]]] = None,
+                 op_hash: Optional[str] = None) -> Estimate:
+    '''
+    Estimate the duration of the steps of a Plan on the books.
+    records: the previous runs of the history, op_hash: the hash of the operation list.
+    '''
+    book_ids = list(book_ids)
+    records = [r for r in records or [] if not r.get(KEY_RUN.CANCELED) and r.get(KEY_RUN.BOOK_COUNT)]
+    
+    sizes = {}
+    for op_num, step in steps:
+        operations = step.operations if isinstance(step, PrefilterGroup) else [(op_num, step)]
+        for n, compiled in operations:
+            if compiled.source not in sizes:
+                sizes[compiled.source] = field_size(db, compiled.source, book_ids)
+    
+    rslt = Estimate()
+    for op_num, step in steps:
+        if isinstance(step, PrefilterGroup):
+            cost = GROUP_WEIGHT * sum(operation_cost(c, sizes) for n, c in step.operations)
+        else:
+            cost = operation_cost(step, sizes)
+        rslt.step_costs.append(cost * len(book_ids))
+    rslt.cost = sum(rslt.step_costs)
+    
+    recent = records[-RATE_RUNS:]
+    same = [r for r in records if op_hash and r.get(KEY_RUN.HASH) == op_hash][-RATE_RUNS:]
+    if same:
+        throughput = _median([r[KEY_RUN.BOOK_COUNT] / r[KEY_RUN.EVALUATE] for r in same if r.get(KEY_RUN.EVALUATE)], 0)
+        if throughput:
+            rslt.evaluate = len(book_ids) / throughput
+            rslt.source = 'history'
+    if not rslt.evaluate:
+        rate = _median([r[KEY_RUN.EVALUATE] / r[KEY_RUN.COST] for r in recent if r.get(KEY_RUN.COST)], DEFAULT_RATE)
+        rslt.evaluate = rslt.cost * rate
+    
+    write_rate = _median([r[KEY_RUN.WRITE] / r[KEY_RUN.BOOK_COUNT] for r in (same or recent) if r.get(KEY_RUN.WRITE)],
+                         DEFAULT_WRITE_RATE)
+    rslt.write = len(book_ids) * write_rate
+    return rslt
+
+
+def format_duration(seconds: float) -> str:
+    seconds = round(seconds)
+    if seconds < 60:
+        return _('{:d} s').format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return _('{:d} min {:02d} s').format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return _('{:d} h {:02d} min').format(hours, minutes)
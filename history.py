@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import json
+import os
+import statistics
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from .common_utils import debug_print
+from .store import STORE_FOLDER, write_atomic
+
+# History of the runs of Mass Search/Replace.
+# Each run is appended as a line of JSON to history.jsonl, in the folder of the store.
+# This module must not import the GUI libraries.
+
+HISTORY_FILE = 'history.jsonl'
+# count of runs kept, the oldest are removed
+HISTORY_MAXIMUM = 2000
+# a run is a regression if its throughput is lower than the median of the previous runs divided by this factor
+REGRESSION_FACTOR = 2
+
+
+class KEY_RUN:
+    TIME            = 'time'
+    LIBRARY         = 'library'
+    MENU            = 'menu'
+    HASH            = 'hash'
+    BOOK_COUNT      = 'books'
+    BOOKS_UPDATE    = 'books_update'
+    FIELDS_UPDATE   = 'fields_update'
+    # [[operation numbers, seconds]]
+    OPERATIONS      = 'operations'
+    EVALUATE        = 'evaluate'
+    WRITE           = 'write'
+    LOCK_HOLD       = 'lock_hold'
+    LOCK_HOLD_MAX   = 'lock_hold_max'
+    TOTAL           = 'total'
+    OPERATION_ERRORS = 'operation_errors'
+    BOOK_ERRORS     = 'book_errors'
+    CANCELED        = 'canceled'
+    # estimated cost of the run, see estimate.py
+    COST            = 'cost'
+    # the .prof file of the run, see profiler.py
+    PROFILE         = 'profile'
+    # latency by book of each operation, and the slowest books, see search_replace/latency.py
+    LATENCY         = 'latency'
+    SLOW_BOOKS      = 'slow_books'
+
+
+def throughput(record: Dict[str, Any]) -> float:
+    '''Books evaluated per second, 0 if unknown'''
+    evaluate = record.get(KEY_RUN.EVALUATE, 0) or 0
+    if evaluate <= 0:
+        return 0
+    return (record.get(KEY_RUN.BOOK_COUNT, 0) or 0) / evaluate
+
+
+def new_record(menu: Optional[str], operation_list, library_id=None) -> Dict[str, Any]:
+    '''A empty record of a run of the operations, completed by the caller'''
+    from .book_index import operation_list_hash
+    return {
+        KEY_RUN.TIME: time.time(),
+        KEY_RUN.LIBRARY: library_id,
+        KEY_RUN.MENU: menu,
+        KEY_RUN.HASH: operation_list_hash(operation_list),
+        KEY_RUN.BOOK_COUNT: 0,
+        KEY_RUN.BOOKS_UPDATE: 0,
+        KEY_RUN.FIELDS_UPDATE: 0,
+        KEY_RUN.OPERATIONS: [],
+        KEY_RUN.EVALUATE: 0,
+        KEY_RUN.WRITE: 0,
+        KEY_RUN.LOCK_HOLD: 0,
+        KEY_RUN.LOCK_HOLD_MAX: 0,
+        KEY_RUN.TOTAL: 0,
+        KEY_RUN.OPERATION_ERRORS: 0,
+        KEY_RUN.BOOK_ERRORS: 0,
+        KEY_RUN.CANCELED: False,
+        KEY_RUN.COST: 0,
+        KEY_RUN.PROFILE: None,
+        KEY_RUN.LATENCY: {},
+        KEY_RUN.SLOW_BOOKS: [],
+    }
+
+
+class Trend:
+    '''Throughput of the last run of a menu, compared to the median of its previous runs'''
+    
+    def __init__(self, menu, records: List[Dict[str, Any]]):
+        self.menu = menu
+        self.records = records
+        self.last = records[-1]
+        self.last_throughput = throughput(self.last)
+        previous = [throughput(r) for r in records[:-1] if throughput(r) > 0]
+        self.median_throughput = statistics.median(previous) if previous else 0
+        # the operations have been edited since the previous run
+        self.edited = len(records) > 1 and records[-2].get(KEY_RUN.HASH) != self.last.get(KEY_RUN.HASH)
+    
+    @property
+    def ratio(self) -> float:
+        '''How many times the last run is slower than the median, 0 if unknown'''
+        if not self.median_throughput or not self.last_throughput:
+            return 0
+        return self.median_throughput / self.last_throughput
+    
+    def is_regression(self) -> bool:
+        return self.ratio >= REGRESSION_FACTOR
+
+
+class RunHistory:
+    '''
+    The runs of the menus, stored in a JSON lines file.
+    Adding a run only append a line to the file; the file is rewritten when it exceed HISTORY_MAXIMUM runs.
+    '''
+    
+    def __init__(self, folder=STORE_FOLDER):
+        self.path = os.path.join(folder, HISTORY_FILE)
+        self._lock = Lock()
+        self._count = None
+    
+    def records(self, menu=None, library_id=None) -> List[Dict[str, Any]]:
+        '''The runs, from the oldest to the newest'''
+        rslt = []
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # line truncated by a crash
+                        continue
+                    if menu is not None and record.get(KEY_RUN.MENU) != menu:
+                        continue
+                    if library_id is not None and record.get(KEY_RUN.LIBRARY) != library_id:
+                        continue
+                    rslt.append(record)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            debug_print('Run history: unable to read >', e)
+        return rslt
+    
+    def add(self, record: Dict[str, Any]):
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if self._count is None:
+                    self._count = len(self.records())
+                with open(self.path, 'ab') as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+                self._count += 1
+                if self._count > HISTORY_MAXIMUM * 1.1:
+                    self._trim()
+            except Exception as e:
+                debug_print('Run history: unable to write >', e)
+    
+    def _trim(self):
+        records = self.records()[-HISTORY_MAXIMUM:]
+        data = b''.join(json.dumps(r, ensure_ascii=False, default=str).encode('utf-8') + b'\n' for r in records)
+        write_atomic(self.path, data)
+        self._count = len(records)
+    
+    def clear(self):
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self._count = 0
+    
+    def trends(self, library_id=None) -> List[Trend]:
+        '''The trend of each menu, the regressions first'''
+        by_menu = defaultdict(list)
+        for record in self.records(library_id=library_id):
+            if record.get(KEY_RUN.MENU) and not record.get(KEY_RUN.CANCELED):
+                by_menu[record[KEY_RUN.MENU]].append(record)
+        rslt = [Trend(menu, records) for menu, records in by_menu.items()]
+        rslt.sort(key=lambda t: (not t.is_regression(), -t.last.get(KEY_RUN.TIME, 0)))
+        return rslt
+
+
+_history = None
+
+
+def get_history() -> RunHistory:
+    global _history
+    if _history is None:
+        _history = RunHistory()
+    return _history
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import getpass
+import json
+import time
+from collections import OrderedDict
+from threading import Thread
+from typing import Any, Dict, List, Optional
+
+try:
+    from qt.core import QLocalServer, QObject, pyqtSignal
+except ImportError:
+    from PyQt5.Qt import QObject, pyqtSignal
+    from PyQt5.QtNetwork import QLocalServer
+
+from .common_utils import GUI, debug_print
+from .prefs import KEY_ERROR, KEY_MENU, PREFS
+from .refresh import refresh_books
+from .search_replace.query import TEMPLATE_FIELD
+
+# Local job server, to submit runs to the running calibre from scripts on the same computer.
+#
+# The server listen on a local socket (Unix socket or Windows named pipe) accessible only to the current user,
+# never on the network. Each request is a line of JSON:
+#     {"menu": "Sub-menu > Menu", "search": "tags:foo", "dry_run": false}
+#     {"operations": [{...}, ...], "search": ""}
+#     {"record": 12}
+# The search is a calibre search expression, empty for all the books of the current library.
+# The server answer {"job": 12, "queued": 0} when the job is queued,
+# then the run record of the job when it's done, and "record" return the record of a previous job.
+
+SERVER_NAME = 'calibre-mass-search-replace-' + getpass.getuser()
+# count of run records kept
+RECORDS_MAXIMUM = 100
+
+
+class Job:
+    def __init__(self, job_id: int, operations: List[Dict[str, Any]], search: str, dry_run: bool,
+                 name: Optional[str] = None, socket=None):
+        self.id = job_id
+        self.operations = operations
+        self.search = search
+        self.dry_run = dry_run
+        self.name = name
+        self.socket = socket
+    
+    def same_pass(self, other: 'Job') -> bool:
+        return self.search == other.search and self.dry_run == other.dry_run
+
+
+def _fields(runner):
+    '''Return the fields read (except the destination of the operation) and the fields written by a Runner'''
+    reads = set()
+    writes = set()
+    for op_num, compiled in runner.compiled_list:
+        writes.add(compiled.dest)
+        if compiled.source != compiled.dest:
+            reads.add(compiled.source)
+    return reads, writes
+
+
+def can_coalesce(reads: set, writes: set, written: set) -> bool:
+    '''
+    Return if operations that read and write these fields can be run in the same pass
+    as the previous operations that have written the fields written.
+    A operation read the values stored in the library, except for its destination field:
+    it must not read a other field written by the previous operations.
+    A template can read any field.
+    '''
+    if TEMPLATE_FIELD in reads and written:
+        return False
+    return not (reads & written)
+
+
+class JobServer(QObject):
+    '''
+    Queue the jobs submitted on the local socket, and run them one after the other.
+    
+    The jobs are evaluated in a background thread and the changes are written in the GUI thread.
+    The consecutive jobs with the same search are coalesced in a single pass (one search, one evaluation
+    and one write of the library), as long as their operations don't read the fields written by the previous jobs.
+    '''
+    
+    evaluated = pyqtSignal(object)
+    
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.server = None
+        self.queue: List[Job] = []
+        self.running = False
+        self.next_id = 1
+        # {job_id: run record}
+        self.records = OrderedDict()
+        self.evaluated.connect(self.write)
+    
+    def start(self) -> bool:
+        if self.server is not None:
+            return True
+        # remove the socket left by a crash
+        QLocalServer.removeServer(SERVER_NAME)
+        server = QLocalServer(self)
+        server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
+        if not server.listen(SERVER_NAME):
+            debug_print('Job server: unable to listen >', server.errorString())
+            return False
+        server.newConnection.connect(self.new_connection)
+        self.server = server
+        debug_print('Job server: listen on', server.fullServerName())
+        return True
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server.deleteLater()
+            self.server = None
+            debug_print('Job server: stopped')
+        self.queue.clear()
+    
+    def new_connection(self):
+        while self.server is not None and self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.read_socket(socket))
+            socket.disconnected.connect(socket.deleteLater)
+    
+    def send(self, socket, data: Dict[str, Any]):
+        if socket is None:
+            return
+        try:
+            if socket.isValid():
+                socket.write(json.dumps(data, default=str).encode('utf-8') + b'\n')
+                socket.flush()
+        except RuntimeError:
+            # the client has disconnected, the socket is deleted
+            pass
+    
+    def read_socket(self, socket):
+        while socket.canReadLine():
+            line = bytes(socket.readLine()).strip()
+            if not line:
+                continue
+            try:
+                self.send(socket, self.submit(json.loads(line), socket))
+            except Exception as e:
+                self.send(socket, {'error': str(e)})
+    
+    def submit(self, request: Dict[str, Any], socket=None) -> Dict[str, Any]:
+        '''Queue the job of the request, return the answer to the client'''
+        if 'record' in request:
+            record = self.records.get(int(request['record']), None)
+            if record is None:
+                return {'error': 'unknown job {}'.format(request['record'])}
+            return record
+        
+        name = request.get('menu', None)
+        if name:
+            from .book_index import menu_index_key
+            from .store import get_store
+            for menu in get_store().get_menus():
+                if menu_index_key(menu) == name:
+                    operations = menu[KEY_MENU.OPERATIONS]
+                    break
+            else:
+                return {'error': f'unknown menu "{name}"'}
+        else:
+            operations = request.get('operations', None)
+            if not isinstance(operations, list) or not operations:
+                return {'error': 'the request must contain a "menu" or a list of "operations"'}
+        
+        job = Job(self.next_id, operations, str(request.get('search', None) or ''),
+                  bool(request.get('dry_run')), name, socket)
+        self.next_id += 1
+        self.queue.append(job)
+        answer = {'job': job.id, 'queued': len(self.queue)-1}
+        debug_print(f'Job server: job {job.id} queued, {len(self.queue)} waiting')
+        if not self.running:
+            self.next_batch()
+        return answer
+    
+    def next_batch(self):
+        if not self.queue or GUI.current_db is None:
+            self.running = False
+            return
+        self.running = True
+        # the consecutive jobs that can share the same pass
+        count = 1
+        while count < len(self.queue) and self.queue[count].same_pass(self.queue[0]):
+            count += 1
+        batch = self.queue[:count]
+        del self.queue[:count]
+        Thread(
+            target=self.evaluate, args=(GUI.current_db.new_api, batch),
+            name='MassSearchReplace:JobServer', daemon=True,
+        ).start()
+    
+    def evaluate(self, db, batch: List[Job]):
+        # called in a background thread
+        from .api import Runner
+        start = time.perf_counter()
+        jobs = []
+        result = None
+        error = None
+        runner = None
+        try:
+            written = set()
+            runners = []
+            for job in batch:
+                job_runner = Runner(db, job.operations)
+                reads, writes = _fields(job_runner)
+                if jobs and not can_coalesce(reads, writes, written):
+                    break
+                jobs.append(job)
+                runners.append(job_runner)
+                written.update(writes)
+            # the operations are compiled once, by the coalescing step
+            runner = Runner.join(runners)
+            
+            if batch[0].search:
+                book_ids = db.search(batch[0].search)
+            else:
+                book_ids = db.all_book_ids()
+            result = runner.run(sorted(book_ids), dry_run=True)
+        except Exception as e:
+            debug_print('Job server: exception >', e)
+            jobs = jobs or batch[:1]
+            error = e
+        # the jobs not coalesced are run by the next pass, on the library updated by this one
+        self.evaluated.emit((runner, jobs, batch[len(jobs):], result, error, start))
+    
+    def write(self, args):
+        runner, jobs, remaining, result, error, start = args
+        self.queue[:0] = remaining
+        dry_run = jobs[0].dry_run
+        
+        record = {
+            'jobs': [job.id for job in jobs],
+            'search': jobs[0].search,
+            'dry_run': dry_run,
+        }
+        if result is not None:
+            record.update({
+                'book_count': result.book_count,
+                'operation_errors': result.operation_errors,
+                'timings': result.timings,
+            })
+            changes = result.changes
+            if not dry_run and changes:
+                # the errors of the books are handled like in the GUI: the strategy can skip the write,
+                # stop it, or restore the library (see ERROR_UPDATE)
+                strategy = PREFS[KEY_ERROR.ERROR][KEY_ERROR.UPDATE]
+                try:
+                    runner.write(result, strategy)
+                except Exception as e:
+                    debug_print('Job server: exception during the library update >', e)
+                    error = e
+                changes = result.written
+                record['restored'] = result.restored
+                book_ids = set()
+                for book_id_map in changes.values():
+                    book_ids.update(book_id_map.keys())
+                refresh_books(book_ids, changes.keys())
+                if result.restored:
+                    changes = {}
+            else:
+                record['changes'] = {field:{str(k):v for k,v in m.items()} for field, m in changes.items()}
+            
+            record['book_errors'] = [(book_id, field, str(e)) for book_id, field, e in result.book_errors]
+            if result.book_errors and not error:
+                error = f'{len(result.book_errors)} book errors'
+            record['books_update'] = len({book_id for m in changes.values() for book_id in m})
+            record['fields_update'] = sum(len(m) for m in changes.values())
+            record['timings']['job'] = time.perf_counter() - start
+        
+        record['status'] = 'error' if error else 'done'
+        if error:
+            record['error'] = str(error)
+        debug_print(f'Job server: jobs {record["jobs"]} {record["status"]}')
+        for job in jobs:
+            self.finish(job, dict(record, job=job.id, menu=job.name))
+        
+        self.next_batch()
+    
+    def finish(self, job: Job, record: Dict[str, Any]):
+        self.records[job.id] = record
+        while len(self.records) > RECORDS_MAXIMUM:
+            self.records.popitem(last=False)
+        self.send(job.socket, record)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2020, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from typing import Any, Dict
+
+from .common_utils import PREFS_json
+
+# The preferences of the plugin and their keys.
+# This module is imported at the startup of calibre, it must not import the GUI of the plugin.
+
+
+class ICON:
+    PLUGIN    = 'images/plugin.png'
+    ADD_IMAGE = 'images/image_add.png'
+    EXPORT    = 'images/export.png'
+    IMPORT    = 'images/import.png'
+    WARNING   = 'images/warning.png'
+
+
+class KEY_MENU:
+    MENU = 'Menu'
+    ACTIVE = 'Active'
+    IMAGE = 'Image'
+    TEXT = 'Text'
+    SUBMENU = 'SubMenu'
+    OPERATIONS = 'Operations'
+    
+    ALL = [
+        ACTIVE,
+        TEXT,
+        SUBMENU,
+        IMAGE,
+        OPERATIONS,
+    ]
+    
+    AUTO_APPLY = 'AutoApply'
+    
+    QUICK = 'Quick'
+    UPDATE_REPORT = 'UpdateReport'
+    USE_MARK = 'UseMark'
+    SKIP_UNCHANGED = 'SkipUnchanged'
+    DEFER_BACKUP = 'DeferBackup'
+    JOB_SERVER = 'JobServer'
+    PROFILE = 'Profile'
+
+
+class KEY_ERROR:
+    ERROR = 'ErrorStrategy'
+    UPDATE = 'Update'
+    OPERATION = 'Operation'
+
+
+class ERROR_UPDATE:
+    
+    INTERRUPT = 'interrupt'
+    INTERRUPT_NAME = _('Interrupt execution')
+    INTERRUPT_DESC = _('Stop Mass Search/Replace and display the error normally without further action.')
+    
+    RESTORE = 'restore'
+    RESTORE_NAME = _('Restore the library')
+    RESTORE_DESC = _('Stop Mass Search/Replace and restore the library to its original state.')
+    
+    safely_txt = _('Updates the fields one by one. This operation can be slower than other strategies.')
+    
+    SAFELY = 'safely stop'
+    SAFELY_NAME = _('Carefully executed (slower)')
+    SAFELY_DESC = (safely_txt+'\n'+
+    _('When a error occurs, stop Mass Search/Replace and display the error normally without further action.'))
+    
+    DONT_STOP = "don't stop"
+    DONT_STOP_NAME = _("Don't stop (slower, not recomanded)")
+    DONT_STOP_DESC = (safely_txt+'\n'+
+    _('Update the library, no matter how many errors are encountered. The problematics fields will not be updated.'))
+    
+    LIST = {
+            INTERRUPT: [INTERRUPT_NAME, INTERRUPT_DESC],
+            RESTORE: [RESTORE_NAME, RESTORE_DESC],
+            SAFELY: [SAFELY_NAME, SAFELY_DESC],
+            DONT_STOP: [DONT_STOP_NAME, DONT_STOP_DESC],
+    }
+    
+    DEFAULT = INTERRUPT
+
+
+class ERROR_OPERATION:
+    
+    ABORT = 'abort'
+    ABORT_NAME = _('Abbort')
+    ABORT_DESC = _('If an invalid operation is detected, abort the changes.')
+    
+    ASK = 'ask'
+    ASK_NAME = _('Asked')
+    ASK_DESC = _('If an invalid operation is detected, asked whether to continue or abort the changes.')
+    
+    HIDE = 'hide'
+    HIDE_NAME = _('Hidden')
+    HIDE_DESC = _('Ignore all invalid operations.')
+    
+    LIST = {
+            ABORT: [ABORT_NAME, ABORT_DESC],
+            ASK: [ASK_NAME, ASK_DESC],
+            HIDE: [HIDE_NAME, HIDE_DESC],
+    }
+    
+    DEFAULT = ASK
+
+
+class PROFILE:
+    
+    NONE = 'none'
+    NONE_NAME = _('No profiling')
+    NONE_DESC = _('The runs are not profiled.')
+    
+    CPU = 'cpu'
+    CPU_NAME = _('Profile the runs')
+    CPU_DESC = _('Profile the evaluation and the library update of the runs with cProfile. '
+                 'The .prof file is saved in the config folder of calibre, '
+                 'its location is displayed in the Update Report.')
+    
+    MEMORY = 'memory'
+    MEMORY_NAME = _('Profile the runs and the memory (slower)')
+    MEMORY_DESC = _('Profile the runs with cProfile, and the memory allocations with tracemalloc. '
+                    'The largest allocations are saved next to the .prof file.')
+    
+    TRACE = 'trace'
+    TRACE_NAME = _('Trace the phases of the runs')
+    TRACE_DESC = _('Save a trace of the phases of the runs (compilation, evaluation of each operation, '
+                   'each transaction of the library update…), to open in Perfetto or chrome://tracing.')
+    
+    LIST = {
+            NONE: [NONE_NAME, NONE_DESC],
+            CPU: [CPU_NAME, CPU_DESC],
+            MEMORY: [MEMORY_NAME, MEMORY_DESC],
+            TRACE: [TRACE_NAME, TRACE_DESC],
+    }
+    
+    DEFAULT = NONE
+
+
+# This is where all preferences for this plugin are stored
+PREFS = PREFS_json()
+# Set defaults
+PREFS.defaults[KEY_MENU.MENU] = []
+PREFS.defaults[KEY_MENU.QUICK] = []
+PREFS.defaults[KEY_MENU.UPDATE_REPORT] = False
+PREFS.defaults[KEY_MENU.USE_MARK] = True
+PREFS.defaults[KEY_MENU.SKIP_UNCHANGED] = False
+PREFS.defaults[KEY_MENU.DEFER_BACKUP] = False
+PREFS.defaults[KEY_MENU.JOB_SERVER] = False
+PREFS.defaults[KEY_MENU.PROFILE] = PROFILE.DEFAULT
+
+PREFS.defaults[KEY_ERROR.ERROR] = {
+    KEY_ERROR.OPERATION : ERROR_UPDATE.DEFAULT,
+    KEY_ERROR.UPDATE : ERROR_OPERATION.DEFAULT
+}
+
+
+def get_default_menu() -> Dict[str, Any]:
+    menu = {}
+    menu[KEY_MENU.ACTIVE] = True
+    menu[KEY_MENU.TEXT] = ''
+    menu[KEY_MENU.SUBMENU] = ''
+    menu[KEY_MENU.IMAGE] = ''
+    menu[KEY_MENU.OPERATIONS] = []
+    menu[KEY_MENU.AUTO_APPLY] = False
+    return menu
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from typing import List, Optional
+
+from .common_utils import debug_print
+from .prefs import PROFILE
+from .store import STORE_FOLDER
+from .tracing import start_trace, stop_trace
+
+# Optional profiling of a run, for the bug reports.
+# The .prof file can be read with pstats or snakeviz, the memory snapshot is a text file,
+# the trace (see tracing.py) can be open in Perfetto.
+# This module must not import the GUI libraries.
+
+PROFILE_FOLDER = os.path.join(STORE_FOLDER, 'profiles')
+# count of runs profiled kept, the oldest are removed
+PROFILE_MAXIMUM = 20
+# count of lines of the memory snapshot and of the summary of the CPU profile
+TOP_COUNT = 30
+
+
+def _slug(name) -> str:
+    return re.sub(r'[^\w\-]+', '_', name or 'run').strip('_')[:40] or 'run'
+
+
+class RunProfiler:
+    '''
+    Profile a part of a run with cProfile, and the memory allocations with tracemalloc
+    if mode is PROFILE.MEMORY, or record a trace of the spans if mode is PROFILE.TRACE.
+    Nothing is done if mode is PROFILE.NONE.
+        
+        profiler = RunProfiler(mode, menu_name)
+        profiler.start()
+        ...
+        profiler.stop()
+        files = profiler.save()
+    '''
+    
+    def __init__(self, mode=PROFILE.NONE, name=None, folder=PROFILE_FOLDER):
+        self.mode = mode if mode in PROFILE.LIST else PROFILE.NONE
+        self.name = name
+        self.folder = folder
+        self.profile = None
+        self.tracer = None
+        self.trace = None
+        self.snapshot = None
+        self.memory_peak = 0
+        self._tracemalloc = False
+        self.files: List[str] = []
+    
+    @property
+    def enabled(self) -> bool:
+        return self.mode != PROFILE.NONE
+    
+    def start(self):
+        if not self.enabled:
+            return
+        if self.mode == PROFILE.TRACE:
+            if self.tracer is None:
+                self.tracer = start_trace()
+            return
+        if self.profile is not None:
+            return
+        if self.mode == PROFILE.MEMORY and not tracemalloc.is_tracing():
+            # don't stop the tracing started by someone else
+            tracemalloc.start()
+            self._tracemalloc = True
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+    
+    def stop(self):
+        if self.tracer is not None:
+            stop_trace()
+            self.trace, self.tracer = self.tracer, None
+        if self.profile is None:
+            return
+        self.profile.disable()
+        if self.mode == PROFILE.MEMORY and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            if self._tracemalloc:
+                tracemalloc.stop()
+                self._tracemalloc = False
+    
+    def save(self) -> List[str]:
+        '''Write the profile files, return their paths'''
+        if self.profile is None and self.trace is None:
+            return []
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            base = os.path.join(self.folder, time.strftime('%Y%m%d-%H%M%S-') + _slug(self.name))
+            
+            if self.trace is not None:
+                self.files.append(self.trace.save(base + '.trace.json'))
+                debug_print('Trace of the run saved in', base + '.trace.json')
+                self.trace = None
+                self._remove_old()
+                return list(self.files)
+            
+            self.profile.dump_stats(base + '.prof')
+            self.files.append(base + '.prof')
+            
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(TOP_COUNT)
+            lines = [stream.getvalue()]
+            
+            if self.snapshot is not None:
+                lines.append(f'Memory peak: {self.memory_peak/1024/1024:0.1f} MiB')
+                lines.append(f'Top {TOP_COUNT} allocations:')
+                for stat in self.snapshot.statistics('lineno')[:TOP_COUNT]:
+                    lines.append(str(stat))
+            
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines))
+            self.files.append(base + '.txt')
+            debug_print('Profile of the run saved in', base + '.prof')
+        except Exception as e:
+            debug_print('Unable to save the profile of the run >', e)
+        self._remove_old()
+        return list(self.files)
+    
+    def _remove_old(self):
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        # one run has a .prof and a .txt file, or a .trace.json file
+        bases = sorted({n.split('.', 1)[0] for n in names})
+        remove = set(bases[:-PROFILE_MAXIMUM])
+        for name in names:
+            if name.split('.', 1)[0] in remove:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+    
+    @property
+    def path(self) -> Optional[str]:
+        '''The .prof or the trace file, None if not saved'''
+        return self.files[0] if self.files else None
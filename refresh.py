@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from typing import Iterable
+
+try:
+    from qt.core import QModelIndex
+except ImportError:
+    from PyQt5.Qt import QModelIndex
+
+from .common_utils import GUI, debug_print
+
+
+def _group_numbers(numbers):
+    # consecutive numbers as (first, last)
+    first = last = None
+    for n in sorted(numbers):
+        if first is None:
+            first = last = n
+        elif n == last+1:
+            last = n
+        else:
+            yield first, last
+            first = last = n
+    if first is not None:
+        yield first, last
+
+
+def refresh_books(book_ids: Iterable[int], fields: Iterable[str] = None):
+    '''
+    Refresh the library view after a update of the books.
+    
+    Unlike refresh_gui() of calibre, the books are not searched in the whole view:
+    only the rows currently displayed are redrawn, and only the columns of the updated fields
+    (with the composite columns and the modified date). The other rows
+    are read from the library when they are displayed.
+    '''
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    
+    try:
+        view = GUI.library_view
+        model = view.model()
+        model.db.new_api.clear_search_caches(book_ids)
+        model.clear_caches()
+        
+        columns = range(model.columnCount(QModelIndex()))
+        if fields is not None:
+            fields = set(fields)
+            fields.add('last_modified')
+            fm = model.db.field_metadata
+            columns = [
+                col for col, key in enumerate(model.column_map)
+                if key in fields or fm[key]['datatype'] == 'composite'
+            ]
+        
+        row_count = model.rowCount(QModelIndex())
+        first = view.rowAt(0)
+        last = view.rowAt(view.viewport().height()-1)
+        if first < 0:
+            first = 0
+        if last < 0:
+            last = row_count-1
+        rows = [row for row in range(first, last+1) if model.id(row) in book_ids]
+        
+        if rows and columns:
+            col_first, col_last = min(columns), max(columns)
+            for row_first, row_last in _group_numbers(rows):
+                model.dataChanged.emit(model.index(row_first, col_first), model.index(row_last, col_last))
+        
+        current = view.currentIndex()
+        if current.isValid() and model.id(current.row()) in book_ids:
+            model.current_changed(current, QModelIndex())
+        
+        GUI.tags_view.recount()
+    
+    except Exception as e:
+        debug_print('Targeted refresh failed, refresh the whole view >', e)
+        GUI.iactions['Edit Metadata'].refresh_gui(list(book_ids), covers_changed=False)
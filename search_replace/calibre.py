@@ -19,11 +19,8 @@ from calibre.ebooks.metadata.book.formatter import SafeFormat
 from calibre.gui2 import error_dialog, question_dialog
 from calibre.gui2.dialogs.template_line_editor import TemplateLineEditor
 from calibre.gui2.widgets import HistoryLineEdit
-from calibre.utils.config import JSONConfig, dynamic
-from calibre.utils.icu import capitalize, sort_key
-from calibre.utils.icu import lower as icu_lower
-from calibre.utils.icu import upper as icu_upper
-from calibre.utils.titlecase import titlecase
+from calibre.utils.config import dynamic
+from calibre.utils.icu import sort_key
 from polyglot.builtins import error_message, unicode_type
 
 try:
@@ -32,77 +29,12 @@ except:
     setup_status_actions, update_status_actions = None, None
 
 from . import text as CalibreText
+from .named import get_named_queries
+from .patterns import compile_pattern
+from .query import KEY_QUERY, S_R_FUNCTIONS, S_R_MATCH_MODES, S_R_REPLACE_MODES
 from ..common_utils import current_db
 from ..common_utils.templates import TEMPLATE_FIELD, TemplateEditorDialogButton, check_template, open_template_dialog
 
-S_R_FUNCTIONS = {
-        '' : lambda x: x,
-        _('Lower Case') : lambda x: icu_lower(x),
-        _('Upper Case') : lambda x: icu_upper(x),
-        _('Title Case') : lambda x: titlecase(x),
-        _('Capitalize') : lambda x: capitalize(x),
-                }
-
-S_R_MATCH_MODES = [
-        _('Character match'),
-        _('Regular expression'),
-        CalibreText.S_R_REPLACE,  # un_pogaz: Replace Field
-                  ]
-
-S_R_REPLACE_MODES = [
-        _('Replace field'),
-        _('Prepend to field'),
-        _('Append to field'),
-                    ]
-
-
-class KEY_QUERY:
-    CASE_SENSITIVE      = 'case_sensitive'
-    COMMA_SEPARATED     = 'comma_separated'
-    DESTINATION_FIELD   = 'destination_field'
-    MULTIPLE_SEPARATOR  = 'multiple_separator'
-    NAME                = 'name'
-    REPLACE_FUNC        = 'replace_func'
-    REPLACE_MODE        = 'replace_mode'
-    REPLACE_WITH        = 'replace_with'
-    RESULTS_COUNT       = 'results_count'
-    S_R_DST_IDENT       = 's_r_dst_ident'
-    S_R_SRC_IDENT       = 's_r_src_ident'
-    S_R_TEMPLATE        = 's_r_template'
-    SEARCH_FIELD        = 'search_field'
-    SEARCH_FOR          = 'search_for'
-    SEARCH_MODE         = 'search_mode'
-    STARTING_FROM       = 'starting_from'
-    
-    S_R_ERROR           = 's_r_error'
-    
-    ALL = [
-        NAME,
-        CASE_SENSITIVE    ,
-        COMMA_SEPARATED   ,
-        DESTINATION_FIELD ,
-        MULTIPLE_SEPARATOR,
-        REPLACE_FUNC      ,
-        REPLACE_MODE      ,
-        REPLACE_WITH      ,
-        RESULTS_COUNT     ,
-        S_R_DST_IDENT     ,
-        S_R_SRC_IDENT     ,
-        S_R_TEMPLATE      ,
-        SEARCH_FIELD      ,
-        SEARCH_FOR        ,
-        SEARCH_MODE       ,
-        STARTING_FROM     ,
-    ]
-    
-    LOCALIZED_FIELD = {
-        REPLACE_FUNC : S_R_FUNCTIONS.keys(),
-        REPLACE_MODE : S_R_REPLACE_MODES,
-        SEARCH_MODE  : S_R_MATCH_MODES,
-    }
-    
-    ACTIVE = '_MSR:Active'
-
 
 # class borrowed from src/calibre/gui2/dialogs/metadata_bulk_ui.py & src/calibre/gui2/dialogs/metadata_bulk.py
 class MetadataBulkWidget(QtWidgets.QWidget):
@@ -550,16 +482,24 @@ class MetadataBulkWidget(QtWidgets.QWidget):
         self.save_button.clicked.connect(self.s_r_save_query)
         self.remove_button.clicked.connect(self.s_r_remove_query)
         
-        self.queries = JSONConfig('search_replace_queries')
+        # un_pogaz: the saved Search/Replace are shared by all the widgets
+        self.named_queries = get_named_queries()
+        self.queries = self.named_queries.config
         self.saved_search_name = ''
-        self.query_field.addItem('')
-        self.query_field_values = sorted(self.queries, key=sort_key)
-        self.query_field.addItems(self.query_field_values)
+        self.set_query_field_values()
         self.query_field.currentIndexChanged.connect(self.s_r_query_change)
         self.query_field.setCurrentIndex(0)
         self.search_field.setCurrentIndex(0)
         self.s_r_search_field_changed(0)
     
+    def set_query_field_values(self):
+        self.query_field.clear()
+        self.query_field.addItem('')
+        self.query_field_values = self.named_queries.names()
+        self.query_field.addItems(self.query_field_values)
+        # {name: index in query_field}
+        self.query_field_index = {name:idx for idx, name in enumerate(self.query_field_values, 1)}
+    
     def s_r_sf_itemdata(self, idx):
         if idx is None:
             idx = self.search_field.currentIndex()
@@ -901,13 +841,8 @@ class MetadataBulkWidget(QtWidgets.QWidget):
             stext = unicode_type(self.search_for.text())
             if not stext:
                 raise Exception(_('You must specify a search expression in the "Search for" field'))
-            if self.search_mode.currentIndex() == 0:
-                self.s_r_obj = regex.compile(regex.escape(stext), flags | regex.V1)
-            else:
-                try:
-                    self.s_r_obj = regex.compile(stext, flags | regex.V1)
-                except regex.error:
-                    self.s_r_obj = regex.compile(stext, flags)
+            # un_pogaz: use the shared cache of compiled patterns
+            self.s_r_obj = compile_pattern(stext, flags, self.search_mode.currentIndex())
         except Exception as e:
             self.s_r_obj = None
             self.s_r_error = e
@@ -1039,9 +974,12 @@ class MetadataBulkWidget(QtWidgets.QWidget):
         self.query_field.blockSignals(False)
         self.query_field.setCurrentIndex(0)
         
-        if item_name in list(self.queries.keys()):
+        if item_name in self.queries:
             del self.queries[item_name]
             self.queries.commit()
+            self.named_queries.changed()
+        self.query_field_values = [name for name in self.query_field_values if name != item_name]
+        self.query_field_index = {name:idx for idx, name in enumerate(self.query_field_values, 1)}
     
     def s_r_save_query(self, *args):
         names = ['']
@@ -1061,7 +999,7 @@ class MetadataBulkWidget(QtWidgets.QWidget):
                         _('You must provide a name.'), show=True)
         new = True
         name = unicode_type(name)
-        if name in list(self.queries.keys()):
+        if name in self.queries:
             if not question_dialog(self, _('Save search/replace'),
                     _('That saved search/replace already exists and will be overwritten. '
                         'Are you sure?')):
@@ -1073,15 +1011,13 @@ class MetadataBulkWidget(QtWidgets.QWidget):
         
         self.queries[name] = query
         self.queries.commit()
+        self.named_queries.changed()
         
         if new:
             self.query_field.blockSignals(True)
-            self.query_field.clear()
-            self.query_field.addItem('')
-            self.query_field_values = sorted(self.queries, key=sort_key)
-            self.query_field.addItems(self.query_field_values)
+            self.set_query_field_values()
             self.query_field.blockSignals(False)
-        self.query_field.setCurrentIndex(self.query_field.findText(name))
+        self.query_field.setCurrentIndex(self.query_field_index.get(name, 0))
     
     def s_r_query_change(self, idx):
         self.s_r_query_load(self.query_field.currentText())
@@ -1091,7 +1027,7 @@ class MetadataBulkWidget(QtWidgets.QWidget):
             self.s_r_reset_query_fields()
             self.saved_search_name = ''
             return
-        item = self.queries.get(unicode_type(item_name), None)
+        item = self.named_queries.get(unicode_type(item_name), None)
         if item is None:
             self.s_r_reset_query_fields()
             return
@@ -1121,9 +1057,9 @@ class MetadataBulkWidget(QtWidgets.QWidget):
         if query:
             
             item_name = query.get(KEY_QUERY.NAME, None)
-            if item_name and self.saved_search_name != item_name and unicode_type(item_name) in self.queries:
-                idx = self.query_field.findText(item_name)
-                if idx:
+            if item_name and self.saved_search_name != item_name and unicode_type(item_name) in self.named_queries:
+                idx = self.query_field_index.get(unicode_type(item_name), -1)
+                if idx > 0:
                     self.query_field.setCurrentIndex(idx)
                     return
             
@@ -0,0 +1,642 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net> ; 2020, Ahmed Zaki <azaki00.dev@gmail.com> ; adjustment 2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import numbers
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import regex
+
+from calibre.ebooks.metadata.book.formatter import SafeFormat
+from calibre.utils.formatter import ValidateFormatter
+
+from . import text as CalibreText
+from .latency import LatencyStats
+from .named import get_named_queries
+from .patterns import compile_pattern
+from .prefilter import can_prefilter, may_match, required_literals
+from .query import KEY_QUERY, TEMPLATE_FIELD, OperationError
+from .schema import REPLACE_FUNCTIONS, OperationSpec, ReplaceFunc, ReplaceMode, SearchMode
+from ..tracing import span
+
+# The run engine of Mass Search/Replace.
+# The logic is the one of the calibre Search/Replace widget (search_replace/calibre.py),
+# but the operations are compiled once and applied without any widget.
+# This module must not import the GUI libraries.
+
+TEMPLATE_ERROR = _('S/R TEMPLATE ERROR')
+
+# name displayed in the Search/Replace widget => field name
+FIELD_ALIASES = {'title_sort': 'sort'}
+
+# fields read from the prefetched columns of the library
+# they have the same value in the columns and in a Metadata object
+FAST_FIELDS = frozenset([
+    'title', 'authors', 'author_sort', 'sort', 'publisher', 'series', 'series_index',
+    'tags', 'comments', 'rating', 'identifiers', 'languages',
+])
+FAST_CUSTOM_DATATYPES = frozenset(['text', 'series', 'enumeration', 'comments', 'rating', 'int', 'float', 'bool'])
+
+
+def get_search_fields(db) -> Tuple[List[str], List[str]]:
+    '''
+    Return the list of the searchable fields and the list of the writable fields,
+    the same lists as the Search/Replace widget.
+    '''
+    all_fields = []
+    writable_fields = []
+    fm = db.field_metadata
+    for f in fm:
+        if (f in ['author_sort'] or
+                (fm[f]['datatype'] in ['text', 'series', 'enumeration', 'comments', 'rating'] and
+                 fm[f].get('search_terms', None) and
+                 f not in ['formats', 'ondevice', 'series_sort', 'in_tag_browser']) or
+                (fm[f]['datatype'] in ['int', 'float', 'bool', 'datetime'] and
+                 f not in ['id', 'timestamp'])):
+            all_fields.append(f)
+            writable_fields.append(f)
+        if fm[f]['datatype'] == 'composite':
+            all_fields.append(f)
+    all_fields.append(TEMPLATE_FIELD)
+    return all_fields, writable_fields
+
+
+def get_identifier_types(db) -> List[str]:
+    try:
+        return list(db.fields['identifiers'].table.all_identifier_types())
+    except Exception:
+        return []
+
+
+def has_value(v) -> bool:
+    if v is None:
+        return False
+    elif v is True or v is False:
+        return True
+    elif v == 0 or v == 0.0:
+        return True
+    else:
+        try:
+            return len(v) > 0
+        except:
+            return True
+
+
+class TemplateEvaluator:
+    '''
+    Evaluate the templates of the operations that use the template as source.
+    
+    A single formatter is used for the run and each template is parsed once.
+    The results for the books as stored in the library are shared
+    by all operations that use the same template.
+    '''
+    
+    def __init__(self, db):
+        self.db = db
+        self.formatter = SafeFormat()
+        self.template_cache = {}
+        self.results = {}
+        self.registered = set()
+        self.shared = set()
+        self.evaluations = 0
+        self.hits = 0
+        # {template: error or None}
+        self.errors = {}
+        self._validator = None
+    
+    def check(self, template: str) -> Optional[str]:
+        '''
+        Validate the template statically, with fake values instead of the books:
+        the result is the same for all the books and all the libraries. Return the error, or None.
+        '''
+        if template not in self.errors:
+            if self._validator is None:
+                self._validator = ValidateFormatter()
+            rslt = self._validator.validate(template)
+            valid = self._validator._validation_string in rslt
+            self.errors[template] = None if valid else rslt
+        return self.errors[template]
+    
+    def register(self, template: str):
+        '''Declare a operation that use this template, the results are cached when it's used more than once'''
+        if template in self.registered:
+            self.shared.add(template)
+        else:
+            self.registered.add(template)
+    
+    def evaluate(self, template: str, book_id: int, mi=None) -> str:
+        '''
+        Evaluate the template for the book. If mi is None, the template is evaluated
+        against the book as stored in the library (lazy columns of the ProxyMetadata).
+        '''
+        if mi is not None:
+            return self._format(template, mi)
+        
+        if template not in self.shared:
+            return self._format(template, self.db.get_proxy_metadata(book_id))
+        
+        key = (template, book_id)
+        rslt = self.results.get(key, None)
+        if rslt is None:
+            rslt = self.results[key] = self._format(template, self.db.get_proxy_metadata(book_id))
+        else:
+            self.hits += 1
+        return rslt
+    
+    def _format(self, template, mi) -> str:
+        self.evaluations += 1
+        # the formatter store the parsed template in template_cache, keyed by column_name
+        return self.formatter.safe_format(template, mi, TEMPLATE_ERROR, mi,
+                                          column_name=template, template_cache=self.template_cache)
+
+
+class BookView:
+    '''
+    Read-only view of a book, return the same values as Metadata.get()
+    but read them from the prefetched columns of the engine.
+    The full Metadata object is loaded only for the other fields.
+    '''
+    
+    __slots__ = ('_mi', 'book_id', 'engine')
+    
+    def __init__(self, engine, book_id):
+        self.engine = engine
+        self.book_id = book_id
+        self._mi = None
+    
+    def get(self, field, default=None):
+        if field == 'sort':
+            # Metadata don't have a "sort" attribute
+            return default
+        column = FIELD_ALIASES.get(field, field)
+        if column in self.engine.fast_fields:
+            val = self.engine.column(column).get(self.book_id, None)
+            if isinstance(val, tuple):
+                return list(val)
+            if isinstance(val, dict):
+                return dict(val)
+            if val is None and column == 'identifiers':
+                return {}
+            return val
+        return self.metadata().get(field, default)
+    
+    def format_field(self, field):
+        return self.metadata().format_field(field)
+    
+    def metadata(self):
+        if self._mi is None:
+            self._mi = self.engine.db.get_metadata(self.book_id)
+        return self._mi
+
+
+class CompiledOperation:
+    '''
+    A Search/Replace operation resolved and compiled once for a run.
+    The shared named operations are resolved from the calibre saved Search/Replace.
+    
+    If the operation is invalid, error contains the exception.
+    '''
+    
+    def __init__(self, engine, operation):
+        self.operation = operation
+        
+        operation = engine.queries.resolve(operation)
+        self.query = operation
+        # localized fields resolved to their ids
+        self.spec = OperationSpec(operation)
+        
+        get = operation.get
+        self.name = get(KEY_QUERY.NAME, '') or ''
+        self.source = get(KEY_QUERY.SEARCH_FIELD, '') or ''
+        self.source = FIELD_ALIASES.get(self.source, self.source)
+        self.dest = get(KEY_QUERY.DESTINATION_FIELD, '') or ''
+        self.dest = FIELD_ALIASES.get(self.dest, self.dest)
+        self.template = get(KEY_QUERY.S_R_TEMPLATE, '') or ''
+        self.search_for = get(KEY_QUERY.SEARCH_FOR, '') or ''
+        self.replace_with = get(KEY_QUERY.REPLACE_WITH, '') or ''
+        self.src_ident = get(KEY_QUERY.S_R_SRC_IDENT, '') or ''
+        self.dst_ident = get(KEY_QUERY.S_R_DST_IDENT, '') or ''
+        self.case_sensitive = bool(get(KEY_QUERY.CASE_SENSITIVE, False))
+        self.comma_separated = bool(get(KEY_QUERY.COMMA_SEPARATED, True))
+        self.replace_func = self.spec.replace_func
+        self.search_mode = self.spec.search_mode
+        self.replace_mode = self.spec.replace_mode
+        
+        self.rfunc = None
+        self.flags = 0
+        self.pattern = None
+        self.dest_fm = None
+        # literals required by the pattern, see prefilter.py
+        self.literals = None
+        # the new value is the same for all books, see SearchReplaceEngine.run_constant()
+        self.constant = False
+        
+        self.error = None
+        try:
+            self._compile(engine)
+        except Exception as e:
+            self.error = e
+            self.pattern = None
+    
+    def _compile(self, engine):
+        # the search fields depend of the search mode
+        if self.search_mode < 0:
+            raise OperationError(CalibreText.get_empty_field(CalibreText.FIELD_NAME.SEARCH_MODE))
+        if self.search_mode == SearchMode.REGEX:
+            search_fields = engine.all_fields
+        else:
+            search_fields = engine.writable_fields
+        if not self.source or self.source not in search_fields:
+            raise OperationError(CalibreText.SEARCH_FIELD)
+        
+        if self.replace_mode < 0:
+            raise OperationError(CalibreText.get_empty_field(CalibreText.FIELD_NAME.REPLACE_MODE))
+        
+        if self.source == 'identifiers':
+            if not self.src_ident or self.src_ident not in engine.identifier_types:
+                raise OperationError(CalibreText.get_empty_field(CalibreText.FIELD_NAME.IDENTIFIER_TYPE))
+        
+        if self.source == TEMPLATE_FIELD:
+            error = engine.templates.check(self.template)
+            if error:
+                raise OperationError(TEMPLATE_ERROR+': '+error)
+            engine.templates.register(self.template)
+        else:
+            self.template = ''
+        
+        if self.replace_func < 0:
+            raise OperationError(CalibreText.get_for_localized_field(CalibreText.FIELD_NAME.REPLACE_FUNC,
+                                                                     self.query.get(KEY_QUERY.REPLACE_FUNC, None)))
+        self.rfunc = REPLACE_FUNCTIONS[self.replace_func]
+        
+        flags = regex.FULLCASE | regex.UNICODE
+        if not self.case_sensitive:
+            flags |= regex.IGNORECASE
+        if self.search_mode == SearchMode.REPLACE_FIELD:
+            flags |= regex.DOTALL
+        self.flags = flags
+        
+        if not self.search_for:
+            raise OperationError(_('You must specify a search expression in the "Search for" field'))
+        self.pattern = compile_pattern(self.search_for, flags, self.search_mode)
+        
+        if self.dest:
+            if self.dest not in engine.writable_fields:
+                raise OperationError(_('Destination field "{:s}" is not available for this library').format(self.dest))
+        else:
+            if self.source == TEMPLATE_FIELD or engine.db.field_metadata[self.source]['datatype'] == 'composite':
+                raise OperationError(_('You must specify a destination when source is '
+                                       'a composite field or a template'))
+            self.dest = self.source
+        
+        self.dest_fm = engine.db.field_metadata[self.dest]
+        if self.dest_fm['is_csp']:
+            if not self.dst_ident or (self.source == 'identifiers' and self.dst_ident == '*'):
+                raise OperationError(_('You must specify a destination identifier type'))
+        
+        # a book that the pattern cannot match is left unchanged
+        # if the field is replaced by itself without any conversion
+        if (self.source == self.dest and self.replace_mode == ReplaceMode.REPLACE and self.source in engine.fast_fields
+                and (self.search_mode == SearchMode.REGEX
+                     or (self.search_mode == SearchMode.CHARACTER and self.replace_func == ReplaceFunc.NONE))
+                and can_prefilter(self.dest, self.dest_fm, self.comma_separated)):
+            self.literals = required_literals(self.search_for, self.search_mode, not self.case_sensitive)
+        
+        # "Replace field" ignore the source, the destination is read in bulk from its column
+        self.constant = (self.search_mode == SearchMode.REPLACE_FIELD and not self.dest_fm['is_csp']
+                         and self.dest in engine.fast_fields and self.dest != 'sort')
+    
+    def s_r_func(self, match):
+        return self.rfunc(match.expand(self.replace_with))
+    
+    def replace_mode_separator(self) -> str:
+        if self.comma_separated:
+            return ','
+        return ''
+
+
+class SearchReplaceEngine:
+    '''
+    Apply compiled Search/Replace operations to a list of books, without any widget.
+    
+    The values of the source fields are prefetched in columns for the books of the run.
+    The changes are collected in set_field_calls {field: {book_id: value}},
+    they are not written in the library.
+    '''
+    
+    def __init__(self, db, book_ids):
+        self.db = getattr(db, 'new_api', db)
+        self.book_ids = list(book_ids)
+        self.set_field_calls = defaultdict(dict)
+        # (book_id, field, exception) of the books that cannot be updated
+        self.errors = []
+        self.canceled = False
+        # books skipped by the literal prefilter
+        self.prefilter_skips = 0
+        # latency of each (operation, book) evaluation
+        self.latency = LatencyStats()
+        
+        self.templates = TemplateEvaluator(self.db)
+        self.all_fields, self.writable_fields = get_search_fields(self.db)
+        self.identifier_types = get_identifier_types(self.db)
+        self.queries = get_named_queries()
+        self._columns = {}
+        
+        fm = self.db.field_metadata
+        db_fields = getattr(self.db, 'fields', {})
+        self.fast_fields = set()
+        for f in self.writable_fields:
+            if f not in db_fields:
+                continue
+            if f in FAST_FIELDS or (f.startswith('#') and fm[f]['datatype'] in FAST_CUSTOM_DATATYPES):
+                self.fast_fields.add(f)
+    
+    def compile(self, operation) -> CompiledOperation:
+        return CompiledOperation(self, operation)
+    
+    def cancel(self):
+        self.canceled = True
+    
+    def column(self, field) -> Dict[int, Any]:
+        col = self._columns.get(field, None)
+        if col is None:
+            with span('fetch', 'evaluate', field=field, books=len(self.book_ids)):
+                col = self._columns[field] = self.db.all_field_for(field, self.book_ids)
+        return col
+    
+    def run_operation(self, operation: CompiledOperation, progress=None):
+        '''
+        Apply the operation to all books of the engine.
+        progress is called with the number of the book before each book.
+        '''
+        if operation.error:
+            return
+        if operation.constant:
+            return self.run_constant(operation, progress)
+        
+        clock = time.perf_counter_ns
+        for book_num, book_id in enumerate(self.book_ids, 1):
+            if progress:
+                progress(book_num)
+            if self.canceled:
+                return
+            
+            start = clock()
+            err = self.search_replace(operation, book_id)
+            self.latency.add(operation, book_id, clock() - start)
+            if err:
+                self.errors.append((book_id, 'identifier', err))
+    
+    def run_constant(self, operation, progress=None):
+        '''
+        Apply a "Replace field" operation to all books of the engine.
+        The new value is computed once (or once per book from the column for append/prepend)
+        and compared to the column of the destination field, without reading the books.
+        '''
+        dest = operation.dest
+        base = self.split_destination(operation, [operation.replace_with])
+        if operation.replace_mode == ReplaceMode.REPLACE:
+            constant = self.finalize_value(operation, None, list(base))
+        column = self.column(dest)
+        
+        clock = time.perf_counter_ns
+        for book_num, book_id in enumerate(self.book_ids, 1):
+            if progress:
+                progress(book_num)
+            if self.canceled:
+                return
+            
+            start = clock()
+            pending = self.set_field_calls.get(dest, None)
+            if pending and book_id in pending:
+                err = self.search_replace(operation, book_id)
+                self.latency.add(operation, book_id, clock() - start)
+                if err:
+                    self.errors.append((book_id, 'identifier', err))
+                continue
+            
+            original = column.get(book_id, None)
+            if isinstance(original, tuple):
+                original = list(original)
+            if operation.replace_mode == ReplaceMode.REPLACE:
+                val = constant
+            else:
+                val = self.merge_destination(operation, original, list(base))
+                val = self.finalize_value(operation, original, val)
+            self.store_value(operation, book_id, original, val)
+            self.latency.add(operation, book_id, clock() - start)
+    
+    def run_prefilter_group(self, group, progress=None):
+        '''
+        Apply the operations of a prefilter group (see optimizer.py) to all books of the engine.
+        The books where no literal of the group is found are skipped, the other books
+        are evaluated by each operation in order.
+        progress is called with the number of the book before each book.
+        '''
+        clock = time.perf_counter_ns
+        for book_num, book_id in enumerate(self.book_ids, 1):
+            if progress:
+                progress(book_num)
+            if self.canceled:
+                return
+            
+            pending = self.set_field_calls.get(group.field, None)
+            if not (pending and book_id in pending):
+                if not group.may_match(self.column(group.field).get(book_id, None)):
+                    self.prefilter_skips += len(group.operations)
+                    continue
+            
+            for op_num, operation in group.operations:
+                start = clock()
+                err = self.search_replace(operation, book_id)
+                self.latency.add(operation, book_id, clock() - start)
+                if err:
+                    self.errors.append((book_id, 'identifier', err))
+    
+    def get_field(self, operation, mi, book_id, field, stored=True) -> List[str]:
+        if field:
+            if field == TEMPLATE_FIELD:
+                return [self.templates.evaluate(operation.template, book_id, None if stored else mi)]
+            fm = self.db.field_metadata[field]
+            if field == 'sort':
+                val = mi.get('title_sort', None)
+            elif fm['datatype'] == 'datetime':
+                val = mi.format_field(field)[1]
+            else:
+                val = mi.get(field, None)
+            if isinstance(val, (numbers.Number, bool)):
+                val = str(val)
+            elif fm['is_csp']:
+                # convert the csp dict into a list
+                id_type = operation.src_ident
+                if id_type:
+                    val = [val.get(id_type, '')]
+                else:
+                    val = [f'{t[0]}:{t[1]}' for t in val.items()]
+            if val is None:
+                val = [] if fm['is_multiple'] else ['']
+            elif not fm['is_multiple']:
+                val = [val]
+            elif fm['datatype'] == 'composite':
+                val = [v2.strip() for v2 in val.split(fm['is_multiple']['ui_to_list'])]
+            elif field == 'authors':
+                val = [v2.replace('|', ',') for v2 in val]
+        else:
+            val = []
+        if not val:
+            val = ['']
+        return val
+    
+    def do_regexp(self, operation, mi, book_id, stored=True) -> List[str]:
+        if operation.search_mode == SearchMode.REPLACE_FIELD:
+            return [operation.replace_with]
+        
+        src = self.get_field(operation, mi, book_id, operation.source, stored)
+        result = []
+        for s in src:
+            t = operation.pattern.sub(operation.s_r_func, s)
+            if operation.search_mode == SearchMode.CHARACTER:
+                t = operation.rfunc(t)
+            result.append(t)
+        
+        return result
+    
+    def do_destination(self, operation, mi, val) -> List[Any]:
+        val = self.split_destination(operation, val)
+        if operation.replace_mode != ReplaceMode.REPLACE:
+            val = self.merge_destination(operation, mi.get(operation.dest, ''), val)
+        return val
+    
+    def split_destination(self, operation, val) -> List[Any]:
+        dest_fm = operation.dest_fm
+        
+        if dest_fm['datatype'] == 'rating' and val[0]:
+            ok = True
+            try:
+                v = int(val[0])
+                if v < 0 or v > 10:
+                    ok = False
+            except:
+                ok = False
+            if not ok:
+                raise Exception(_('The replacement value for a rating column must '
+                                  'be empty or an integer between 0 and 10'))
+        
+        if dest_fm['is_multiple']:
+            if operation.comma_separated:
+                splitter = dest_fm['is_multiple']['ui_to_list']
+                res = []
+                for v in val:
+                    res.extend([x.strip() for x in v.split(splitter) if x.strip()])
+                val = res
+            else:
+                val = [v.replace(',', '') for v in val]
+        return val
+    
+    def merge_destination(self, operation, dest_val, val) -> List[Any]:
+        dest_mode = operation.replace_mode
+        
+        if operation.dest_fm['is_csp']:
+            dst_id_type = operation.dst_ident
+            if dst_id_type:
+                dest_val = [dest_val.get(dst_id_type, '')]
+            else:
+                # convert the csp dict into a list
+                dest_val = [f'{t[0]}:{t[1]}' for t in dest_val.items()]
+        if dest_val is None:
+            dest_val = []
+        elif not isinstance(dest_val, list):
+            dest_val = [dest_val]
+        
+        if dest_mode == ReplaceMode.PREPEND:
+            val.extend(dest_val)
+        elif dest_mode == ReplaceMode.APPEND:
+            val[0:0] = dest_val
+        return val
+    
+    def finalize_value(self, operation, original, val) -> Any:
+        '''
+        Convert the list of values into the value stored in the field.
+        Return a exception if the value is invalid.
+        '''
+        dest = operation.dest
+        dfm = operation.dest_fm
+        
+        if dfm['is_multiple']:
+            if dfm['is_csp']:
+                # convert the colon-separated pair strings back into a dict,
+                # which is what set_identifiers wants
+                dst_id_type = operation.dst_ident
+                if dst_id_type and dst_id_type != '*':
+                    v = ''.join(val)
+                    ids = original.copy()  # un_pogaz: fix ghost identifier with empty value
+                    ids[dst_id_type] = v
+                    val = ids
+                else:
+                    try:
+                        val = dict([(t.split(':', maxsplit=1)) for t in val])
+                    except:
+                        return Exception(CalibreText.EXCEPTION_Invalid_identifier)
+        else:
+            val = operation.replace_mode_separator().join(val)
+            if dest == 'title' and len(val) == 0:
+                val = _('Unknown')
+        
+        if not val and dfm['datatype'] == 'datetime':
+            val = None
+        if dfm['datatype'] == 'rating':
+            if (not val or int(val) == 0):
+                val = None
+            if dest == 'rating' and val:
+                val = (int(val) // 2) * 2
+        
+        return val
+    
+    def store_value(self, operation, book_id, original, val):
+        ## add the result value only if different of the original
+        ## and if it is not a pair None/''
+        if original != val and (has_value(original) or has_value(val)):
+            self.set_field_calls[operation.dest][book_id] = val
+    
+    def search_replace(self, operation, book_id) -> Any:
+        '''
+        Apply the operation to the book, and store the new value if it's different.
+        Return a exception if the book cannot be updated.
+        '''
+        dest = operation.dest
+        
+        pending = self.set_field_calls.get(dest, None)
+        if operation.literals is not None and not (pending and book_id in pending):
+            value = self.column(operation.source).get(book_id, None)
+            if not may_match(operation.literals, value, not operation.case_sensitive):
+                self.prefilter_skips += 1
+                return None
+        
+        if pending and book_id in pending:
+            # edit the metadata object with the stored edited field
+            mi = self.db.get_metadata(book_id)
+            mi.set(dest, pending[book_id])
+            stored = False
+        else:
+            mi = BookView(self, book_id)
+            stored = True
+        
+        original = mi.get(dest)
+        
+        val = self.do_regexp(operation, mi, book_id, stored)
+        val = self.do_destination(operation, mi, val)
+        val = self.finalize_value(operation, original, val)
+        if isinstance(val, Exception):
+            return val
+        
+        self.store_value(operation, book_id, original, val)
+        return None
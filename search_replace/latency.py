@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import heapq
+from typing import Any, Dict, List, Optional
+
+# Latency of the evaluation of each operation for each book.
+# This module must not import the GUI libraries.
+
+# count of slowest evaluations kept
+TOP_COUNT = 10
+
+
+class LatencyHistogram:
+    '''
+    Histogram of the latencies of a operation, in buckets of powers of 2 of microseconds:
+    the bucket n count the latencies in [2**(n-1), 2**n[ µs, the bucket 0 the ones under 1 µs.
+    '''
+    
+    __slots__ = ('buckets', 'count', 'maximum', 'total')
+    
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+    
+    def add(self, ns: int):
+        bucket = (ns // 1000).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += ns
+        if ns > self.maximum:
+            self.maximum = ns
+    
+    def percentile(self, p: float) -> float:
+        '''Upper bound of the bucket of the percentile p (0-100), in milliseconds'''
+        if not self.count:
+            return 0
+        rank = self.count * p / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return (2**bucket) / 1000
+        return self.maximum / 1e6
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6 if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.maximum / 1e6,
+            # {upper bound in µs: count}
+            'buckets': {str(2**b): n for b, n in sorted(self.buckets.items())},
+        }
+
+
+class LatencyStats:
+    '''
+    The histogram of each operation, and the slowest (operation, book) evaluations.
+    The operations are the CompiledOperation of the engine, labels() give their numbers.
+    '''
+    
+    def __init__(self, top=TOP_COUNT):
+        self.top = top
+        self.histograms: Dict[Any, LatencyHistogram] = {}
+        # min-heap of (ns, sequence, book_id, operation)
+        self._slowest = []
+        self._sequence = 0
+    
+    def add(self, operation, book_id: int, ns: int):
+        histogram = self.histograms.get(operation, None)
+        if histogram is None:
+            histogram = self.histograms[operation] = LatencyHistogram()
+        histogram.add(ns)
+        
+        if len(self._slowest) < self.top:
+            self._sequence += 1
+            heapq.heappush(self._slowest, (ns, self._sequence, book_id, operation))
+        elif ns > self._slowest[0][0]:
+            self._sequence += 1
+            heapq.heapreplace(self._slowest, (ns, self._sequence, book_id, operation))
+    
+    def __bool__(self):
+        return bool(self.histograms)
+    
+    def summary(self, labels: Optional[Dict[Any, str]] = None) -> Dict[str, Dict[str, Any]]:
+        '''{label of the operation: histogram}'''
+        labels = labels or {}
+        return {labels.get(op, op.source): h.to_dict() for op, h in self.histograms.items()}
+    
+    def slowest(self, db=None, labels: Optional[Dict[Any, str]] = None) -> List[Dict[str, Any]]:
+        '''
+        The slowest evaluations, the slowest first, with the size of the source
+        and of the destination fields of the book if db is given.
+        '''
+        labels = labels or {}
+        rslt = []
+        for ns, seq, book_id, operation in sorted(self._slowest, reverse=True):
+            entry = {
+                'book_id': book_id,
+                'operation': labels.get(operation, operation.source),
+                'ms': ns / 1e6,
+                'sizes': {},
+            }
+            if db is not None:
+                for field in dict.fromkeys((operation.source, operation.dest)):
+                    entry['sizes'][field] = field_size(db, field, book_id)
+            rslt.append(entry)
+        return rslt
+
+
+def field_size(db, field, book_id) -> int:
+    '''Size of the value of the field of the book, in characters'''
+    try:
+        value = db.field_for(field, book_id)
+    except Exception:
+        return 0
+    if value is None:
+        return 0
+    if isinstance(value, dict):
+        return sum(len(str(k)) + len(str(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(len(str(v)) for v in value)
+    return len(str(value))
+
+
+def format_slowest(slowest: List[Dict[str, Any]]) -> List[str]:
+    lines = []
+    for entry in slowest:
+        sizes = ', '.join(f'{field} {size} chars' for field, size in entry['sizes'].items())
+        lines.append(
+            f'Book {entry["book_id"]} | {entry["operation"]} > {entry["ms"]:0.3f} ms' + (f' ({sizes})' if sizes else '')
+        )
+    return lines
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import os
+from threading import RLock
+from typing import Any, Dict, List, Optional
+
+from calibre.utils.config import JSONConfig
+from calibre.utils.icu import sort_key
+
+from .query import KEY_QUERY
+
+# The shared named operations, saved by the calibre Search/Replace widget.
+# This module must not import the GUI libraries.
+
+
+class NamedQueries:
+    '''
+    The saved Search/Replace of calibre (search_replace_queries.json),
+    shared by the runs, the validation and the editors.
+    
+    The file is read once, and read again only when it has been modified
+    (by calibre, by a other widget or by a other process).
+    '''
+    
+    def __init__(self):
+        self._lock = RLock()
+        self._config = None
+        self._mtime = None
+        self._names = []
+        # {name: index in names}
+        self._index = {}
+    
+    def _stat(self):
+        try:
+            return os.stat(self._config.file_path).st_mtime_ns
+        except (OSError, AttributeError):
+            return None
+    
+    @property
+    def config(self) -> JSONConfig:
+        '''The JSONConfig of the saved Search/Replace, up to date with the file'''
+        with self._lock:
+            if self._config is None:
+                self._config = JSONConfig('search_replace_queries')
+                self._update()
+            else:
+                mtime = self._stat()
+                if mtime != self._mtime:
+                    self._config.refresh()
+                    self._update()
+            return self._config
+    
+    def _update(self):
+        self._mtime = self._stat()
+        self._names = sorted(self._config, key=sort_key)
+        self._index = {name:idx for idx, name in enumerate(self._names)}
+    
+    def changed(self):
+        '''To call after a change of the saved Search/Replace by config.commit()'''
+        with self._lock:
+            if self._config is not None:
+                self._update()
+    
+    def get(self, name, default=None) -> Optional[Dict[str, Any]]:
+        if not name:
+            return default
+        return self.config.get(str(name), default)
+    
+    def __contains__(self, name) -> bool:
+        return str(name) in self.config
+    
+    def names(self) -> List[str]:
+        '''The names of the saved Search/Replace, sorted'''
+        self.config
+        return list(self._names)
+    
+    def index(self, name) -> int:
+        '''Index of the name in names(), -1 if not found'''
+        self.config
+        return self._index.get(str(name), -1)
+    
+    def resolve(self, operation: Dict[str, Any]) -> Dict[str, Any]:
+        '''Return the shared named operation, or the operation itself'''
+        shared = self.get(operation.get(KEY_QUERY.NAME, None))
+        return shared or operation
+
+
+_named_queries = None
+
+
+def get_named_queries() -> NamedQueries:
+    global _named_queries
+    if _named_queries is None:
+        _named_queries = NamedQueries()
+    return _named_queries
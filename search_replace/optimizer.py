@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import regex
+
+from .engine import CompiledOperation
+from .prefilter import can_prefilter
+from .schema import ReplaceFunc, ReplaceMode, SearchMode
+
+# Optimization of the list of compiled operations of a run.
+# This module must not import the GUI libraries.
+
+# minimal count of consecutive literal operations to group them
+GROUP_MINIMUM = 2
+
+
+class PrefilterGroup:
+    '''
+    Consecutive operations on the same field that have required literals (see prefilter.py),
+    with a shared prefilter.
+    
+    All the literals of the operations are searched at once with a named list.
+    The books where none is found cannot be matched by any of the operations
+    (a operation that don't match leave the field unchanged, so the next ones see the same value)
+    and are skipped by all of them. The other books are still evaluated by each operation in order,
+    the sequential semantics are kept: this is not a single substitution pass.
+    '''
+    
+    def __init__(self, operations: List[Tuple[int, CompiledOperation]]):
+        self.operations = operations
+        first = operations[0][1]
+        self.field = first.source
+        self.case_sensitive = first.case_sensitive
+        
+        literals = {}
+        for op_num, operation in operations:
+            for alternative in operation.literals:
+                literals.update(dict.fromkeys(alternative))
+        self.literals = list(literals)
+        # the literals are casefolded when the operations ignore the case
+        self.pattern = regex.compile(r'\L<literals>', literals=self.literals)
+    
+    @property
+    def op_nums(self) -> List[int]:
+        return [op_num for op_num, operation in self.operations]
+    
+    def may_match(self, value: Any) -> bool:
+        if value is None:
+            return False
+        if isinstance(value, str):
+            value = (value,)
+        for text in value:
+            if not self.case_sensitive:
+                text = text.casefold()
+            if self.pattern.search(text):
+                return True
+        return False
+    
+    def string_info(self) -> str:
+        return f'{len(self.operations)} operations on "{self.field}" with {len(self.literals)} literals'
+
+
+def can_group(a: CompiledOperation, b: CompiledOperation) -> bool:
+    return (a.literals is not None and b.literals is not None
+            and a.source == b.source and a.case_sensitive == b.case_sensitive)
+
+
+def group_prefilter(compiled_list: List[Tuple[int, CompiledOperation]], minimum=GROUP_MINIMUM) -> List[Tuple[int, Any]]:
+    '''
+    Merge the runs of consecutive literal operations on the same field.
+    Return the list of steps (op_num, CompiledOperation or PrefilterGroup).
+    '''
+    rslt = []
+    run = []
+    
+    def end_run():
+        if len(run) >= minimum:
+            rslt.append((run[-1][0], PrefilterGroup(list(run))))
+        else:
+            rslt.extend(run)
+        run.clear()
+    
+    for op_num, operation in compiled_list:
+        if run and not can_group(run[-1][1], operation):
+            end_run()
+        if operation.literals is not None:
+            run.append((op_num, operation))
+        else:
+            end_run()
+            rslt.append((op_num, operation))
+    end_run()
+    
+    return rslt
+
+
+def format_op_nums(op_nums: List[int]) -> str:
+    '''Format a list of operation numbers, the consecutive numbers as range: "1-3, 5"'''
+    rslt = []
+    for op_num in op_nums:
+        if rslt and rslt[-1][1] == op_num-1:
+            rslt[-1][1] = op_num
+        else:
+            rslt.append([op_num, op_num])
+    return ', '.join(str(a) if a == b else f'{a}-{b}' for a, b in rslt)
+
+
+def noop_reason(operation: CompiledOperation) -> Optional[str]:
+    '''Return why the operation can never change a book, or None'''
+    if (operation.search_mode == SearchMode.CHARACTER and operation.case_sensitive
+            and operation.replace_func == ReplaceFunc.NONE and operation.search_for == operation.replace_with
+            # the replacement is expanded by match.expand(), the escapes change the text
+            and '\\' not in operation.replace_with
+            and operation.source == operation.dest and operation.replace_mode == ReplaceMode.REPLACE
+            and can_prefilter(operation.dest, operation.dest_fm, operation.comma_separated)):
+        return 'the text is replaced by itself'
+    return None
+
+
+class Plan:
+    '''
+    Static analysis and optimization of the compiled operations of a run.
+    
+    A operation read the values of the books as stored in the library,
+    except for its destination field where it read the value edited by the previous operations.
+    So a operation depend only of the previous operations with the same destination field,
+    and the groups of operations with different destination fields are independent.
+    
+    The plan remove the operations that can never change a book,
+    evaluate the independent groups one after the other (the order inside a group is kept)
+    and prefilter together the consecutive literal operations of each group (see group_prefilter()).
+    The reason of each transformation is kept in notes.
+    '''
+    
+    def __init__(self, compiled_list: List[Tuple[int, CompiledOperation]]):
+        self.notes = []
+        # op_num of the operations removed
+        self.removed = []
+        
+        kept = []
+        for op_num, operation in compiled_list:
+            reason = noop_reason(operation)
+            if reason:
+                self.removed.append(op_num)
+                self.notes.append(f'Operation {op_num} removed: {reason}.')
+            else:
+                kept.append((op_num, operation))
+        
+        groups = OrderedDict()
+        for op_num, operation in kept:
+            groups.setdefault(operation.dest, []).append((op_num, operation))
+        self.groups: Dict[str, List[Tuple[int, CompiledOperation]]] = groups
+        
+        ordered = [item for group in groups.values() for item in group]
+        if len(groups) > 1:
+            for field, group in groups.items():
+                self.notes.append(
+                    f'Independent group on "{field}": operations {format_op_nums([n for n, o in group])}.'
+                )
+            if ordered != kept:
+                self.notes.append('Operations reordered by group, the order inside each group is kept.')
+        
+        self.steps = []
+        for group in groups.values():
+            for op_num, step in group_prefilter(group):
+                if isinstance(step, PrefilterGroup):
+                    self.notes.append(
+                        f'Operations {format_op_nums(step.op_nums)} prefiltered together: {step.string_info()}.'
+                    )
+                self.steps.append((op_num, step))
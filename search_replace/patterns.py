@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import copy
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict
+
+import regex
+
+
+class PatternCache:
+    '''
+    Process-wide LRU cache of the compiled Search/Replace patterns.
+    
+    The entries are keyed by (pattern, flags, search_mode) and remember which
+    regex flavour (V1 or V0) has succeeded, so a pattern that fail in V1
+    is not compiled twice. The compile errors are cached too, without their traceback,
+    and a copy of the error is raised by each lookup.
+    '''
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+    
+    def compile(self, pattern: str, flags: int, search_mode: int):
+        key = (pattern, flags, search_mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        
+        if entry is None:
+            entry = self._compile(pattern, flags, search_mode)
+            with self._lock:
+                self.misses += 1
+                if entry[1] is not None:
+                    self.errors += 1
+                self._entries[key] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        
+        obj, err = entry
+        if err is not None:
+            # a new exception, the cached one never get the traceback of the raise
+            raise copy.copy(err)
+        return obj
+    
+    def _compile(self, pattern, flags, search_mode):
+        try:
+            if search_mode == 0:
+                return regex.compile(regex.escape(pattern), flags | regex.V1), None
+            try:
+                return regex.compile(pattern, flags | regex.V1), None
+            except regex.error:
+                return regex.compile(pattern, flags), None
+        except Exception as e:
+            return None, e.with_traceback(None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'size': len(self._entries),
+            }
+
+
+PATTERN_CACHE = PatternCache()
+
+
+def compile_pattern(pattern: str, flags: int, search_mode: int):
+    '''
+    Compile the search pattern of a operation like the calibre Search/Replace module,
+    using the shared cache. Raise the (cached) compile error if the pattern is invalid.
+    '''
+    return PATTERN_CACHE.compile(pattern, flags, search_mode)
+
+
+def pattern_stats_delta(before: Dict[str, int]) -> Dict[str, int]:
+    '''Statistics of the pattern cache since the snapshot "before"'''
+    now = PATTERN_CACHE.stats()
+    return {k: now[k] - before.get(k, 0) for k in ('hits', 'misses', 'errors')}
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from typing import Any, Optional, Tuple
+
+import regex
+
+# Extract the literal strings that a text must contain for a search pattern to match,
+# so the books that cannot match are skipped without running the pattern.
+# The parser is voluntarily conservative: any syntax that is not fully understood
+# (lookarounds, inline flags, backreferences, nested sets, fuzzy matching…)
+# disable the prefilter for the operation.
+
+_ESCAPE_LITERALS = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a'}
+_ESCAPE_ATOMS = frozenset('dDwWsS')
+_ESCAPE_ASSERTIONS = frozenset('bBAZ')
+_QUANTIFIER = regex.compile(r'\{(\d*)(?:,(\d*))?\}')
+
+# Datatypes for which a book that the pattern don't match is never updated
+# (the value read by the operation is written back unchanged).
+PREFILTER_DATATYPES = frozenset(['text', 'comments', 'series', 'enumeration'])
+# 'sort' is never equal to its original value and 'authors' are converted
+PREFILTER_EXCLUDED_FIELDS = frozenset(['sort', 'authors'])
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _skip_class(pattern, i) -> int:
+    # i is on the '['
+    n = len(pattern)
+    i += 1
+    if i < n and pattern[i] == '^':
+        i += 1
+    if i < n and pattern[i] == ']':
+        i += 1
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            # nested set or POSIX class
+            raise _Unsupported()
+        if c == ']':
+            return i+1
+        i += 1
+    raise _Unsupported()
+
+
+def _parse_sequence(pattern, i):
+    # return the list of branches [list of atoms] and the index of the end
+    n = len(pattern)
+    branches = [[]]
+    while i < n:
+        c = pattern[i]
+        atoms = branches[-1]
+        
+        if c == '|':
+            branches.append([])
+            i += 1
+        elif c == ')':
+            return branches, i
+        elif c == '\\':
+            if i+1 >= n:
+                raise _Unsupported()
+            e = pattern[i+1]
+            i += 2
+            if e in _ESCAPE_LITERALS:
+                atoms.append(('char', _ESCAPE_LITERALS[e]))
+            elif e in _ESCAPE_ATOMS:
+                atoms.append(('any', None))
+            elif e in _ESCAPE_ASSERTIONS:
+                atoms.append(('assert', None))
+            elif not e.isalnum():
+                atoms.append(('char', e))
+            else:
+                raise _Unsupported()
+        elif c == '[':
+            i = _skip_class(pattern, i)
+            atoms.append(('any', None))
+        elif c == '(':
+            if pattern.startswith('(?:', i):
+                i += 3
+            elif pattern.startswith('(?', i):
+                raise _Unsupported()
+            else:
+                i += 1
+            sub, i = _parse_sequence(pattern, i)
+            if i >= n:
+                raise _Unsupported()
+            i += 1
+            atoms.append(('group', sub))
+        elif c == '.':
+            atoms.append(('any', None))
+            i += 1
+        elif c in '^$':
+            atoms.append(('assert', None))
+            i += 1
+        elif c in '*+?{':
+            if c == '{':
+                m = _QUANTIFIER.match(pattern, i)
+                if not m:
+                    raise _Unsupported()
+                minimum = int(m.group(1) or 0)
+                i = m.end()
+            else:
+                minimum = 1 if c == '+' else 0
+                i += 1
+            if not atoms or atoms[-1][0] not in ('char', 'any', 'group'):
+                raise _Unsupported()
+            atom = atoms.pop()
+            if minimum == 0:
+                atoms.append(('any', None))
+            else:
+                atoms.append(('repeat', atom))
+            # lazy or possessive quantifier
+            if i < n and pattern[i] in '?+':
+                i += 1
+        else:
+            atoms.append(('char', c))
+            i += 1
+    
+    return branches, i
+
+
+def _branch_literals(atoms):
+    literals = []
+    run = []
+    
+    def end_run():
+        if run:
+            literals.append(''.join(run))
+            run.clear()
+    
+    for kind, value in atoms:
+        if kind == 'repeat':
+            kind, value = value
+            if kind == 'char':
+                # the char is present at least once, but can be followed by itself
+                run.append(value)
+                end_run()
+                continue
+        
+        if kind == 'char':
+            run.append(value)
+        else:
+            end_run()
+            if kind == 'group' and len(value) == 1:
+                literals.extend(_branch_literals(value[0]))
+    
+    end_run()
+    return literals
+
+
+def required_literals(pattern: str, search_mode: int, ignore_case: bool) -> Optional[Tuple[Tuple[str, ...], ...]]:
+    '''
+    Return the literals required by the pattern, as a tuple of alternatives,
+    each alternative being a tuple of literals that must all be present in the text.
+    Return None if no literals can be extracted.
+    The literals are casefolded if ignore_case.
+    '''
+    if search_mode == 0:
+        branches = [[pattern]]
+    elif search_mode == 1:
+        try:
+            branches, end = _parse_sequence(pattern, 0)
+            if end != len(pattern):
+                return None
+        except _Unsupported:
+            return None
+        branches = [_branch_literals(atoms) for atoms in branches]
+    else:
+        return None
+    
+    rslt = []
+    for literals in branches:
+        literals = [lit for lit in literals if lit]
+        if not literals:
+            # this alternative can match any text
+            return None
+        if ignore_case:
+            literals = [lit.casefold() for lit in literals]
+        rslt.append(tuple(dict.fromkeys(literals)))
+    return tuple(rslt)
+
+
+def can_prefilter(field: str, fm: dict, comma_separated: bool) -> bool:
+    '''Return if a book that the pattern don't match is never updated for this destination field'''
+    if field in PREFILTER_EXCLUDED_FIELDS or fm['datatype'] not in PREFILTER_DATATYPES or fm['is_csp']:
+        return False
+    if fm['is_multiple'] and not comma_separated:
+        # the commas are removed from the values
+        return fm['is_multiple'].get('ui_to_list', None) == ','
+    return True
+
+
+def may_match(literals, value: Any, ignore_case: bool) -> bool:
+    '''Return if a value of the field can be matched by a pattern that require these literals'''
+    if value is None:
+        return False
+    if isinstance(value, str):
+        value = (value,)
+    for text in value:
+        if ignore_case:
+            text = text.casefold()
+        for alternative in literals:
+            if all(lit in text for lit in alternative):
+                return True
+    return False
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net> ; 2020, Ahmed Zaki <azaki00.dev@gmail.com> ; adjustment 2020, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+from calibre.utils.icu import capitalize
+from calibre.utils.icu import lower as icu_lower
+from calibre.utils.icu import upper as icu_upper
+from calibre.utils.titlecase import titlecase
+
+from . import text as CalibreText
+
+# Definitions of a Search/Replace operation shared by the widget and the engine.
+# This module must not import the GUI libraries.
+
+# same value as common_utils.templates.TEMPLATE_FIELD, without the GUI imports
+TEMPLATE_FIELD = '{template}'
+
+S_R_FUNCTIONS = {
+        '' : lambda x: x,
+        _('Lower Case') : lambda x: icu_lower(x),
+        _('Upper Case') : lambda x: icu_upper(x),
+        _('Title Case') : lambda x: titlecase(x),
+        _('Capitalize') : lambda x: capitalize(x),
+                }
+
+S_R_MATCH_MODES = [
+        _('Character match'),
+        _('Regular expression'),
+        CalibreText.S_R_REPLACE,  # un_pogaz: Replace Field
+                  ]
+
+S_R_REPLACE_MODES = [
+        _('Replace field'),
+        _('Prepend to field'),
+        _('Append to field'),
+                    ]
+
+
+class KEY_QUERY:
+    CASE_SENSITIVE      = 'case_sensitive'
+    COMMA_SEPARATED     = 'comma_separated'
+    DESTINATION_FIELD   = 'destination_field'
+    MULTIPLE_SEPARATOR  = 'multiple_separator'
+    NAME                = 'name'
+    REPLACE_FUNC        = 'replace_func'
+    REPLACE_MODE        = 'replace_mode'
+    REPLACE_WITH        = 'replace_with'
+    RESULTS_COUNT       = 'results_count'
+    S_R_DST_IDENT       = 's_r_dst_ident'
+    S_R_SRC_IDENT       = 's_r_src_ident'
+    S_R_TEMPLATE        = 's_r_template'
+    SEARCH_FIELD        = 'search_field'
+    SEARCH_FOR          = 'search_for'
+    SEARCH_MODE         = 'search_mode'
+    STARTING_FROM       = 'starting_from'
+    
+    S_R_ERROR           = 's_r_error'
+    
+    ALL = [
+        NAME,
+        CASE_SENSITIVE    ,
+        COMMA_SEPARATED   ,
+        DESTINATION_FIELD ,
+        MULTIPLE_SEPARATOR,
+        REPLACE_FUNC      ,
+        REPLACE_MODE      ,
+        REPLACE_WITH      ,
+        RESULTS_COUNT     ,
+        S_R_DST_IDENT     ,
+        S_R_SRC_IDENT     ,
+        S_R_TEMPLATE      ,
+        SEARCH_FIELD      ,
+        SEARCH_FOR        ,
+        SEARCH_MODE       ,
+        STARTING_FROM     ,
+    ]
+    
+    LOCALIZED_FIELD = {
+        REPLACE_FUNC : S_R_FUNCTIONS.keys(),
+        REPLACE_MODE : S_R_REPLACE_MODES,
+        SEARCH_MODE  : S_R_MATCH_MODES,
+    }
+    
+    ACTIVE = '_MSR:Active'
+
+
+class OperationError(ValueError):
+    pass
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import hashlib
+import json
+from enum import IntEnum
+from typing import Any, Dict, List
+
+from .query import KEY_QUERY, S_R_FUNCTIONS, S_R_MATCH_MODES, S_R_REPLACE_MODES
+
+# Canonical representation of a Search/Replace operation.
+# The operations are stored as the dict of the calibre Search/Replace widget,
+# where search_mode, replace_mode and replace_func are translated strings.
+# The language independent ids of these strings are stored next to them,
+# so a operation saved in a other language of the interface can be restored.
+# This module must not import the GUI libraries.
+
+SCHEMA_VERSION = 1
+
+
+class KEY_SCHEMA:
+    VERSION         = '_MSR:Schema'
+    SEARCH_MODE     = '_MSR:SearchModeId'
+    REPLACE_MODE    = '_MSR:ReplaceModeId'
+    REPLACE_FUNC    = '_MSR:ReplaceFuncId'
+    
+    ALL = [
+        VERSION     ,
+        SEARCH_MODE ,
+        REPLACE_MODE,
+        REPLACE_FUNC,
+    ]
+
+
+class SearchMode(IntEnum):
+    CHARACTER       = 0
+    REGEX           = 1
+    REPLACE_FIELD   = 2
+
+
+class ReplaceMode(IntEnum):
+    REPLACE         = 0
+    PREPEND         = 1
+    APPEND          = 2
+
+
+class ReplaceFunc(IntEnum):
+    NONE            = 0
+    LOWER           = 1
+    UPPER           = 2
+    TITLE           = 3
+    CAPITALIZE      = 4
+
+
+# the strings in the current language, in the order of the ids
+REPLACE_FUNCTIONS = list(S_R_FUNCTIONS.values())
+_LOCALIZED = {
+    KEY_QUERY.SEARCH_MODE  : list(S_R_MATCH_MODES),
+    KEY_QUERY.REPLACE_MODE : list(S_R_REPLACE_MODES),
+    KEY_QUERY.REPLACE_FUNC : list(S_R_FUNCTIONS.keys()),
+}
+# the untranslated strings, in the order of the ids
+_SOURCE = {
+    KEY_QUERY.SEARCH_MODE  : ['Character match', 'Regular expression', 'Replace field'],
+    KEY_QUERY.REPLACE_MODE : ['Replace field', 'Prepend to field', 'Append to field'],
+    KEY_QUERY.REPLACE_FUNC : ['', 'Lower Case', 'Upper Case', 'Title Case', 'Capitalize'],
+}
+_ENUMS = {
+    KEY_QUERY.SEARCH_MODE  : (KEY_SCHEMA.SEARCH_MODE, SearchMode),
+    KEY_QUERY.REPLACE_MODE : (KEY_SCHEMA.REPLACE_MODE, ReplaceMode),
+    KEY_QUERY.REPLACE_FUNC : (KEY_SCHEMA.REPLACE_FUNC, ReplaceFunc),
+}
+
+
+def _reverse(strings: List[str]) -> Dict[str, int]:
+    # {string: id}, the first id of a duplicated string like list.index()
+    rslt = {}
+    for idx, text in enumerate(strings):
+        rslt.setdefault(text, idx)
+    return rslt
+
+
+# {string: id} of the current language and of the untranslated strings
+_LOCALIZED_IDS = {key: _reverse(strings) for key, strings in _LOCALIZED.items()}
+_SOURCE_IDS = {key: _reverse(strings) for key, strings in _SOURCE.items()}
+
+
+def resolve_id(operation: Dict[str, Any], key: str) -> int:
+    '''
+    Return the id of the localized field key of the operation, or -1.
+    The stored id is used when the string is its string in the current language.
+    Else the string displayed in the current language take precedence, so a operation
+    edited in the widget is never overridden by its previous id.
+    '''
+    value = operation.get(key, None)
+    id_key, enum = _ENUMS[key]
+    stored = None
+    if operation.get(KEY_SCHEMA.VERSION, None) == SCHEMA_VERSION:
+        try:
+            stored = int(enum(operation.get(id_key, None)))
+        except (ValueError, TypeError):
+            pass
+    if stored is not None and _LOCALIZED[key][stored] == value:
+        return stored
+    
+    value_id = _LOCALIZED_IDS[key].get(value, None) if isinstance(value, str) else None
+    if value_id is not None:
+        return value_id
+    if stored is not None:
+        # saved in a other language
+        return stored
+    if isinstance(value, str):
+        return _SOURCE_IDS[key].get(value, -1)
+    return -1
+
+
+def migrate_operation(operation: Dict[str, Any]) -> bool:
+    '''
+    Store the ids of the localized fields in the operation,
+    and translate these fields in the current language.
+    Return if the operation was changed.
+    '''
+    changed = False
+    ids = {}
+    for key in _LOCALIZED:
+        value = resolve_id(operation, key)
+        if value < 0:
+            # invalid operation, reported by the validation
+            return False
+        ids[key] = value
+    
+    for key, value in ids.items():
+        id_key, enum = _ENUMS[key]
+        text = _LOCALIZED[key][value]
+        if operation.get(key, None) != text:
+            operation[key] = text
+            changed = True
+        if operation.get(id_key, None) != value:
+            operation[id_key] = value
+            changed = True
+    
+    if operation.get(KEY_SCHEMA.VERSION, None) != SCHEMA_VERSION:
+        operation[KEY_SCHEMA.VERSION] = SCHEMA_VERSION
+        changed = True
+    return changed
+
+
+def migrate_operation_list(operation_list: List[Dict[str, Any]]) -> int:
+    '''Migrate the operations of the list in place, return the count of changed operations'''
+    return sum(1 for operation in operation_list or [] if migrate_operation(operation))
+
+
+class OperationSpec:
+    '''
+    Language independent and immutable content of a Search/Replace operation.
+    
+    The localized fields are resolved to their ids (SearchMode, ReplaceMode, ReplaceFunc),
+    -1 if they are invalid. hash is the digest of the content, the same in all the languages;
+    the name and the active state are not part of the content.
+    '''
+    
+    # the attributes of the content, in the order of the hash (never reorder them, the hash would change)
+    CONTENT = (
+        'version', 'search_field', 'destination_field', 'search_mode', 'replace_mode',
+        'replace_func', 'search_for', 'replace_with', 'template', 'src_ident', 'dst_ident',
+        'case_sensitive', 'comma_separated', 'multiple_separator', 'results_count', 'starting_from',
+    )
+    
+    __slots__ = (
+        'case_sensitive', 'comma_separated', 'destination_field', 'dst_ident', 'hash',
+        'multiple_separator', 'name', 'replace_func', 'replace_mode', 'replace_with', 'results_count',
+        'search_field', 'search_for', 'search_mode', 'src_ident', 'starting_from', 'template', 'version',
+    )
+    
+    def __init__(self, operation: Dict[str, Any]):
+        get = operation.get
+        self.version = SCHEMA_VERSION
+        self.name = get(KEY_QUERY.NAME, '') or ''
+        self.search_field = get(KEY_QUERY.SEARCH_FIELD, '') or ''
+        self.destination_field = get(KEY_QUERY.DESTINATION_FIELD, '') or ''
+        self.search_mode = resolve_id(operation, KEY_QUERY.SEARCH_MODE)
+        self.replace_mode = resolve_id(operation, KEY_QUERY.REPLACE_MODE)
+        self.replace_func = resolve_id(operation, KEY_QUERY.REPLACE_FUNC)
+        self.search_for = get(KEY_QUERY.SEARCH_FOR, '') or ''
+        self.replace_with = get(KEY_QUERY.REPLACE_WITH, '') or ''
+        self.template = get(KEY_QUERY.S_R_TEMPLATE, '') or ''
+        self.src_ident = get(KEY_QUERY.S_R_SRC_IDENT, '') or ''
+        self.dst_ident = get(KEY_QUERY.S_R_DST_IDENT, '') or ''
+        self.case_sensitive = bool(get(KEY_QUERY.CASE_SENSITIVE, False))
+        self.comma_separated = bool(get(KEY_QUERY.COMMA_SEPARATED, True))
+        self.multiple_separator = get(KEY_QUERY.MULTIPLE_SEPARATOR, '') or ''
+        self.results_count = get(KEY_QUERY.RESULTS_COUNT, '') or ''
+        self.starting_from = get(KEY_QUERY.STARTING_FROM, '') or ''
+        
+        data = json.dumps(self.content(), ensure_ascii=False, default=str)
+        self.hash = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    
+    def content(self) -> list:
+        return [getattr(self, k) for k in self.CONTENT]
+    
+    def __setattr__(self, name, value):
+        if hasattr(self, 'hash'):
+            raise AttributeError(f"'{type(self).__name__}' object is read-only")
+        object.__setattr__(self, name, value)
+    
+    def __eq__(self, other):
+        return isinstance(other, OperationSpec) and self.hash == other.hash
+    
+    def __hash__(self):
+        return hash(self.hash)
+    
+    def __repr__(self):
+        return f'<OperationSpec v{self.version} {self.hash[:10]} {self.search_field}>'
+    
+    def is_valid(self) -> bool:
+        return self.search_mode >= 0 and self.replace_mode >= 0 and self.replace_func >= 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        '''Return the operation as stored, with the localized fields in the current language'''
+        rslt = {
+            KEY_QUERY.NAME               : self.name,
+            KEY_QUERY.SEARCH_FIELD       : self.search_field,
+            KEY_QUERY.DESTINATION_FIELD  : self.destination_field,
+            KEY_QUERY.SEARCH_FOR         : self.search_for,
+            KEY_QUERY.REPLACE_WITH       : self.replace_with,
+            KEY_QUERY.S_R_TEMPLATE       : self.template,
+            KEY_QUERY.S_R_SRC_IDENT      : self.src_ident,
+            KEY_QUERY.S_R_DST_IDENT      : self.dst_ident,
+            KEY_QUERY.CASE_SENSITIVE     : self.case_sensitive,
+            KEY_QUERY.COMMA_SEPARATED    : self.comma_separated,
+            KEY_QUERY.MULTIPLE_SEPARATOR : self.multiple_separator,
+            KEY_QUERY.RESULTS_COUNT      : self.results_count,
+            KEY_QUERY.STARTING_FROM      : self.starting_from,
+        }
+        for key, (id_key, enum) in _ENUMS.items():
+            value = getattr(self, key)
+            if value >= 0:
+                rslt[key] = _LOCALIZED[key][value]
+                rslt[id_key] = value
+        rslt[KEY_SCHEMA.VERSION] = SCHEMA_VERSION
+        return rslt
+    
+    @staticmethod
+    def from_dict(operation: Dict[str, Any]) -> 'OperationSpec':
+        return OperationSpec(operation)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List
+
+from calibre.utils.config import config_dir
+
+from .common_utils import debug_print
+from .prefs import KEY_MENU, PREFS
+
+# The menus and their operations, stored out of the preferences of the plugin.
+# This module is imported at the startup of calibre, it must not import the GUI of the plugin.
+
+STORE_FOLDER = os.path.join(config_dir, 'plugins', 'Mass Search-Replace.store')
+MENUS_FILE = 'menus.json'
+QUICK_FILE = 'quick.json'
+
+# keys of the headers of menus.json
+KEY_FILE = '_MSR:File'
+KEY_COUNT = '_MSR:Count'
+
+# name of the operations files, see _operations_file()
+OPERATIONS_FILE = re.compile(r'[0-9a-f]{20}\.json')
+
+
+def _operations_file(data: bytes) -> str:
+    '''Name of the file of a operation list, by the hash of its content'''
+    return hashlib.sha1(data).hexdigest()[:20] + '.json'
+
+
+def _dumps(data) -> bytes:
+    return json.dumps(data, indent=2, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def write_atomic(path, data: bytes):
+    '''Write the data in the file atomically, a interrupted write never leave a truncated file'''
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class StoredMenu(dict):
+    '''
+    A menu read from the store. The operations are read from their file on first access.
+    '''
+    
+    def __init__(self, store, header: Dict[str, Any]):
+        dict.__init__(self, {k:v for k,v in header.items() if k not in (KEY_FILE, KEY_COUNT)})
+        self.store = store
+        self.file = header.get(KEY_FILE, None)
+        self.count = header.get(KEY_COUNT, 0)
+    
+    def is_loaded(self) -> bool:
+        return dict.__contains__(self, KEY_MENU.OPERATIONS)
+    
+    def _load(self):
+        if not self.is_loaded():
+            operation_list = self.store.read_operations(self.file)
+            self.count = len(operation_list)
+            dict.__setitem__(self, KEY_MENU.OPERATIONS, operation_list)
+    
+    def __missing__(self, key):
+        if key == KEY_MENU.OPERATIONS:
+            self._load()
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+    
+    def __contains__(self, key):
+        return key == KEY_MENU.OPERATIONS or dict.__contains__(self, key)
+    
+    def get(self, key, default=None):
+        if key == KEY_MENU.OPERATIONS:
+            self._load()
+        return dict.get(self, key, default)
+
+
+def operation_count(menu) -> int:
+    '''Count of operations of the menu, without reading them from the store'''
+    if isinstance(menu, StoredMenu) and not menu.is_loaded():
+        return menu.count
+    return len(menu.get(KEY_MENU.OPERATIONS, None) or [])
+
+
+class OperationStore:
+    '''
+    Store of the menus and of their operations, in the config folder of calibre.
+    
+    menus.json contain the headers of the menus (text, sub-menu, image…) and the name of the file
+    of their operations. The operations files are named by the hash of their content: saving the menus
+    write only the files of the edited menus, and the unchanged menus are never read.
+    Each file is written atomically.
+    
+    At first use, the menus and the quick operations stored in the preferences are copied in the store.
+    '''
+    
+    def __init__(self, folder=STORE_FOLDER):
+        self.folder = folder
+        self._headers = None
+        self._mtime = None
+        # {file: operation list}, the files never change once written
+        self._operations = {}
+    
+    def _path(self, name) -> str:
+        return os.path.join(self.folder, name)
+    
+    def _read(self, name, default):
+        try:
+            with open(self._path(name), 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            debug_print(f'Operation store: unable to read "{name}" >', e)
+            return default
+    
+    def _migrate(self):
+        if os.path.exists(self._path(MENUS_FILE)):
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        menu_list = PREFS[KEY_MENU.MENU]
+        quick = PREFS[KEY_MENU.QUICK]
+        self.set_quick(quick)
+        self.set_menus(menu_list)
+        if menu_list or quick:
+            # the preferences are kept as a backup, for a downgrade of the plugin
+            # and the export of its settings; they are no longer read nor written
+            debug_print(f'Operation store: {len(menu_list)} menus copied from the preferences.')
+    
+    def _load_headers(self) -> List[Dict[str, Any]]:
+        self._migrate()
+        try:
+            mtime = os.stat(self._path(MENUS_FILE)).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._headers is None or mtime != self._mtime:
+            self._headers = self._read(MENUS_FILE, [])
+            self._mtime = mtime
+        return self._headers
+    
+    def get_menus(self) -> List[StoredMenu]:
+        '''Return the menus, their operations are read on first access'''
+        return [StoredMenu(self, header) for header in self._load_headers()]
+    
+    def read_operations(self, file) -> List[Dict[str, Any]]:
+        if not file:
+            return []
+        if file not in self._operations:
+            self._operations[file] = self._read(file, [])
+        return list(self._operations[file])
+    
+    def set_menus(self, menu_list: List[Dict[str, Any]]):
+        '''Save the menus, only the files of the new operation lists are written'''
+        os.makedirs(self.folder, exist_ok=True)
+        headers = []
+        for menu in menu_list:
+            header = {k:v for k,v in dict.items(menu) if k != KEY_MENU.OPERATIONS}
+            
+            if isinstance(menu, StoredMenu) and not menu.is_loaded():
+                file, count = menu.file, menu.count
+            else:
+                operation_list = menu.get(KEY_MENU.OPERATIONS, None) or []
+                data = _dumps(operation_list)
+                file = _operations_file(data)
+                count = len(operation_list)
+                if not os.path.exists(self._path(file)):
+                    write_atomic(self._path(file), data)
+                self._operations[file] = json.loads(data)
+            
+            header[KEY_FILE] = file
+            header[KEY_COUNT] = count
+            headers.append(header)
+        
+        write_atomic(self._path(MENUS_FILE), _dumps(headers))
+        self._headers = headers
+        self._mtime = os.stat(self._path(MENUS_FILE)).st_mtime_ns
+        self._remove_unused()
+    
+    def _remove_unused(self):
+        used = {header.get(KEY_FILE, None) for header in self._headers}
+        used.update((MENUS_FILE, QUICK_FILE))
+        for name in os.listdir(self.folder):
+            # only the operations files written by set_menus(), never the other files of the folder
+            if OPERATIONS_FILE.fullmatch(name) and name not in used:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+                self._operations.pop(name, None)
+    
+    def get_quick(self) -> List[Dict[str, Any]]:
+        '''Return the operations of the quick Search/Replace'''
+        self._migrate()
+        return self._read(QUICK_FILE, [])
+    
+    def set_quick(self, operation_list: List[Dict[str, Any]]):
+        os.makedirs(self.folder, exist_ok=True)
+        write_atomic(self._path(QUICK_FILE), _dumps(operation_list or []))
+
+
+_store = None
+
+
+def get_store() -> OperationStore:
+    global _store
+    if _store is None:
+        _store = OperationStore()
+    return _store
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Trace of the phases of a run, in the Chrome trace event format (Perfetto, chrome://tracing).
+# This module must not import the GUI libraries.
+#
+#     with span('fetch', 'evaluate', field=field):
+#         ...
+#
+# When no trace is recording, span() return a shared object that does nothing:
+# the cost is a function call, the steps run for each book are never traced.
+
+
+class _NullSpan:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        return False
+    
+    def begin(self):
+        return self
+    
+    def end(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('args', 'cat', 'name', 'start', 'tracer')
+    
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+    
+    def __enter__(self):
+        return self.begin()
+    
+    def __exit__(self, *args):
+        self.end()
+        return False
+    
+    def begin(self):
+        self.start = time.perf_counter_ns()
+        return self
+    
+    def end(self, **args):
+        '''End the span, args are added to the ones of the event'''
+        if self.start is None:
+            return
+        if args:
+            self.args = dict(self.args, **args)
+        self.tracer.add(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+        self.start = None
+
+
+class Tracer:
+    '''The events recorded during a run, by all the threads'''
+    
+    def __init__(self):
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+    
+    def span(self, name, cat, args) -> Span:
+        return Span(self, name, cat, args)
+    
+    def add(self, name, cat, start, end, args):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': (start - self.origin) / 1000,
+            'dur': (end - start) / 1000,
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid in {e['tid'] for e in events}:
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                'args': {'name': names.get(tid, str(tid))},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    
+    def save(self, path) -> str:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, default=str)
+        return path
+
+
+_tracer: Optional[Tracer] = None
+
+
+def span(name: str, cat: str = 'run', **args):
+    '''A span of the trace recording, or NULL_SPAN'''
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, cat, args)
+
+
+def start_trace() -> Optional[Tracer]:
+    '''Start to record a trace, return None if a trace is already recording'''
+    global _tracer
+    if _tracer is not None:
+        return None
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_trace() -> Optional[Tracer]:
+    '''Stop the recording, return the trace'''
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+__license__   = 'GPL v3'
+__copyright__ = '2026, un_pogaz <un.pogaz@gmail.com>'
+
+
+try:
+    load_translations()
+except NameError:
+    pass  # load_translations() added in calibre 1.9
+
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+
+from .common_utils import debug_print
+from .tracing import span
+
+# a chunk is committed when it contains this count of values…
+CHUNK_ROWS = 2000
+# …or when the write lock has been held this time (seconds)
+CHUNK_TIME = 0.25
+# count of values of a single set_field call
+PIECE_ROWS = 250
+
+# fields written by Mass Search/Replace, the library events for them are ignored by AutoApply (auto_apply.py)
+# {(field, book_id): expiration time}
+_written = {}
+_written_lock = Lock()
+WRITTEN_TIMEOUT = 60
+# fields updated by calibre when a field is written, their events are ignored too
+DERIVED_FIELDS = {
+    'title': ('sort',),
+    'authors': ('author_sort',),
+}
+# the library listened by AutoApply, the changes of the other libraries are not recorded
+_listened_db = None
+
+
+def listen_changes(db):
+    '''Record the changes written in the library db by ignore_changes(), None to stop'''
+    global _listened_db
+    with _written_lock:
+        _listened_db = getattr(db, 'new_api', db)
+        _written.clear()
+
+
+def ignore_changes(db, set_field_calls: Dict[str, Dict[int, Any]]):
+    '''Ignore the library events caused by the write of these changes in the library db'''
+    if _listened_db is None or getattr(db, 'new_api', db) is not _listened_db:
+        return
+    now = time.monotonic()
+    expire = now + WRITTEN_TIMEOUT
+    with _written_lock:
+        # the events of some writes never come (value unchanged)
+        for key in [k for k, e in _written.items() if e < now]:
+            del _written[key]
+        for field, book_id_val_map in set_field_calls.items():
+            for book_id in book_id_val_map.keys():
+                _written[(field, book_id)] = expire
+                for derived in DERIVED_FIELDS.get(field, ()):
+                    _written[(derived, book_id)] = expire
+
+
+def filter_written(field, book_ids) -> List[int]:
+    '''The books whose field has not been written by ignore_changes()'''
+    now = time.monotonic()
+    rslt = []
+    with _written_lock:
+        for book_id in book_ids:
+            expire = _written.pop((field, book_id), None)
+            if expire is None or expire < now:
+                rslt.append(book_id)
+    return rslt
+
+
+class ChunkedWriter:
+    '''
+    Write the changes {field: {book_id: value}} in the library with bounded transactions.
+    
+    The write lock of the library is released between the chunks,
+    so calibre and the other plugins are not blocked during a long update.
+    If journal is True, the original values are saved before the write
+    and restore() can revert it. The journaled write is a single transaction:
+    no other writer can change the books between the chunks, and a failed write
+    is restored before the write lock is released.
+    '''
+    
+    def __init__(self, db, set_field_calls: Dict[str, Dict[int, Any]], journal=False,
+                 max_rows=CHUNK_ROWS, max_time=CHUNK_TIME):
+        self.db = getattr(db, 'new_api', db)
+        self.set_field_calls = set_field_calls
+        self.max_rows = max_rows
+        self.max_time = max_time
+        
+        # {field: {book_id: original value}}
+        self.journal = defaultdict(dict) if journal else None
+        if journal:
+            # restoring the journal after a other writer has changed the books would overwrite its changes
+            self.max_rows = self.max_time = float('inf')
+        # {field: {book_id: ''}} of the written values
+        self.written = defaultdict(dict)
+        # (count of values, lock hold time) of each chunk
+        self.chunks: List[Tuple[int, float]] = []
+        
+        self.pieces = []
+        for field, book_id_val_map in set_field_calls.items():
+            items = list(book_id_val_map.items())
+            for i in range(0, len(items), PIECE_ROWS):
+                self.pieces.append((field, dict(items[i:i+PIECE_ROWS])))
+        self.total = sum(len(m) for f, m in self.pieces)
+    
+    def write(self, callback=None):
+        '''
+        Write all the changes. callback is called between the chunks with
+        the count of written values and the total.
+        Raise the exception of the chunk that has failed, this chunk is rolled back.
+        '''
+        self._write(self.pieces, self.journal, self.written, callback)
+    
+    def restore(self):
+        '''
+        Restore the original values of all the journaled values.
+        A failed write is already restored by write().
+        '''
+        if not self.journal:
+            return
+        with self.db.write_lock:
+            self._restore()
+    
+    def _restore(self):
+        # called with the write lock
+        with span('restore', 'write'), self.db.backend.conn:
+            for field, book_id_val_map in self.journal.items():
+                items = list(book_id_val_map.items())
+                for i in range(0, len(items), PIECE_ROWS):
+                    self.db.set_field(field, dict(items[i:i+PIECE_ROWS]))
+        debug_print(f'Library update: {sum(len(m) for m in self.journal.values())} values restored.')
+        self.journal.clear()
+        self.written.clear()
+    
+    def _write(self, pieces, journal, written, callback):
+        i = 0
+        done = 0
+        while i < len(pieces):
+            if journal is not None:
+                # the original values are read before taking the write lock
+                rows = 0
+                with span('journal', 'write'):
+                    for field, book_id_val_map in pieces[i:]:
+                        journal[field].update(self.db.all_field_for(field, book_id_val_map.keys()))
+                        rows += len(book_id_val_map)
+                        if rows >= self.max_rows:
+                            break
+            
+            rows = 0
+            chunk = []
+            chunk_span = span('chunk', 'write', chunk=len(self.chunks)+1).begin()
+            lock_span = span('acquire write lock', 'write').begin()
+            start = time.perf_counter()
+            with self.db.write_lock:
+                lock_span.end()
+                try:
+                    with self.db.backend.conn:
+                        while i < len(pieces):
+                            field, book_id_val_map = pieces[i]
+                            with span('set_field', 'write', field=field, rows=len(book_id_val_map)):
+                                self.db.set_field(field, book_id_val_map)
+                            chunk.append(pieces[i])
+                            rows += len(book_id_val_map)
+                            i += 1
+                            if rows >= self.max_rows or time.perf_counter() - start >= self.max_time:
+                                break
+                except Exception:
+                    if journal is not None:
+                        # the values in memory have been changed, restore them before releasing the lock
+                        self._restore()
+                    raise
+            hold = time.perf_counter() - start
+            chunk_span.end(rows=rows)
+            
+            # the chunk is committed
+            for field, book_id_val_map in chunk:
+                written[field].update({book_id:'' for book_id in book_id_val_map.keys()})
+            self.chunks.append((rows, hold))
+            done += rows
+            debug_print(
+                f'Library update: chunk {len(self.chunks)}, {rows} values, write lock held {hold:0.3f} seconds.'
+            )
+            
+            if callback:
+                callback(done, self.total)
+            # let the other threads take the lock
+            time.sleep(0)
+
+
+def write_safely(db, set_field_calls: Dict[str, Dict[int, Any]], dont_stop=False,
+                 callback=None) -> Tuple[Dict[str, Dict[int, str]], List[Tuple[int, str, Exception]]]:
+    '''
+    Write the changes {field: {book_id: value}} one field of one book at a time.
+    Stop at the first error, or continue with the other fields if dont_stop is True.
+    Return the written values {field: {book_id: ''}} and the errors [(book_id, field, exception)].
+    '''
+    db = getattr(db, 'new_api', db)
+    written = defaultdict(dict)
+    errors = []
+    book_ids = list(dict.fromkeys(book_id for m in set_field_calls.values() for book_id in m.keys()))
+    for book_num, book_id in enumerate(book_ids, 1):
+        for field, book_id_val_map in set_field_calls.items():
+            if book_id not in book_id_val_map:
+                continue
+            try:
+                with span('set_field', 'write', field=field, book_id=book_id):
+                    db.set_field(field, {book_id:book_id_val_map[book_id]})
+                written[field][book_id] = ''
+            except Exception as e:
+                errors.append((book_id, field, e))
+                if not dont_stop:
+                    return written, errors
+        if callback:
+            callback(book_num, len(book_ids))
+    return written, errors